@@ -1,10 +1,27 @@
+import copy
 import os
+import threading
+from datetime import datetime
 from pathlib import Path
 
-from flask import Flask, request, send_from_directory
+from flask import Flask, Response, request, send_from_directory
 
 from calcatrix.devices.multiview import MultiView  # pylint: disable=import-error
+from calcatrix.functions.archive import (  # pylint: disable=import-error
+    FORMATS,
+    stream_archive,
+)
 from calcatrix.functions.photo import Photo  # pylint: disable=import-error
+from calcatrix.functions.thumbnail import (  # pylint: disable=import-error
+    ThumbnailCache,
+)
+from calcatrix.jobs.worker import FINISHED, JobQueue  # pylint: disable=import-error
+from calcatrix.metrics.registry import (  # pylint: disable=import-error
+    CONTENT_TYPE,
+    REGISTRY,
+)
+from calcatrix.metrics.trace import TRACER  # pylint: disable=import-error
+from calcatrix.state.catalog import ImageCatalog  # pylint: disable=import-error
 
 DIR_PIN = 27
 STEP_PIN = 17
@@ -29,6 +46,9 @@ init_config = {
             # data = {"marker_positions": [], "current_position": 0}
             "file_path": "/home/pi/dev/saved_positions/trial_0.pickle",
             "init_from_file": True,
+            # confirm the stored location on the nearest marker, full homing
+            # only if that fails
+            "verify": True,
         },
     },
 }
@@ -37,9 +57,124 @@ init_config = {
 app = Flask(__name__)
 
 
+# the cart is only created/moved by the job worker thread (see `jobs`), request
+# handlers only read from it and enqueue work
 global_cart = None
 BASE_PATH = "/home/pi/dev/imgs"
-photo_func = Photo(base_path=BASE_PATH)
+# kept next to the state store, out of the directory the image endpoints serve
+STATE_PATH = Path(init_config["linear"]["positions"]["file_path"]).parent
+# rebuilt from the files in BASE_PATH if missing
+catalog = ImageCatalog(BASE_PATH, db_path=STATE_PATH.joinpath("catalog.sqlite3"))
+# previews for the dashboard, least recently used evicted past 64MB
+thumbnails = ThumbnailCache(STATE_PATH.joinpath("thumbnails"))
+photo_func = Photo(base_path=BASE_PATH, catalog=catalog, thumbnails=thumbnails)
+jobs = JobQueue()
+
+
+def _submitted(job):
+    return {"job_id": job.id, "state": job.state}, 202
+
+
+NOT_INITIALIZED = "cart not initialized, please initialize (/cart/initialize, POST)"
+
+
+def _initializing():
+    # an initialize job is queued/running, work submitted now runs after it
+    return any(
+        job.kind == "initialize" and job.state not in FINISHED for job in jobs.list()
+    )
+
+
+def _cart():
+    # looked up when the job runs (not when it is submitted), so work queued
+    # behind an initialize job uses the cart it creates
+    if global_cart is None:
+        raise ValueError(NOT_INITIALIZED)
+    return global_cart
+
+
+def _flag(name, default=False):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes")
+
+
+# longest a request waits for an inline image (see `_capture_one`)
+INLINE_TIMEOUT = 120
+
+
+def _burst():
+    # frames per view (see `Photo.capture_burst`), None for the default
+    burst = request.args.get("burst")
+    if not burst:
+        return None
+    burst = int(burst)
+    if burst <= 0:
+        raise ValueError(f"burst must be a positive int, not {burst}")
+    return burst
+
+
+def _capture_one(kind, get_instruction, params):
+    """submit a single view capture, of the instruction `get_instruction(cart)`
+    returns when the job runs
+
+    With `inline=true` the image is captured to memory and returned in the
+    response (image/jpeg) as soon as it is captured: writing it to disk
+    (skipped with `save=false`) and the rotation back to 0 finish in the job
+    after the response. Without, returns the job id (the result is the file
+    path, or the paths of a `burst` of frames)
+    """
+    try:
+        burst = _burst()
+    except ValueError as e:
+        return f"{e}", 400
+    if not _flag("inline"):
+        job = jobs.submit(
+            kind,
+            lambda job: _cart().follow_instruction(
+                get_instruction(_cart()), func=photo_func, burst=burst
+            ),
+            params=dict(params, burst=burst),
+            total=1,
+        )
+        return _submitted(job)
+    if burst is not None and burst > 1:
+        return "a burst can not be returned inline, please remove `inline`", 400
+
+    save = _flag("save", default=True)
+    captured = {}
+    ready = threading.Event()
+
+    def _to_memory(ins):
+        captured["path"], captured["data"] = photo_func.capture_bytes(ins, save=save)
+        ready.set()
+        return captured["path"]
+
+    def _inline(job):
+        try:
+            cart = _cart()
+            instruction = get_instruction(cart)
+            # the session is exited (pending write flushed) after `ready`
+            with photo_func:
+                return cart.follow_instruction(instruction, func=_to_memory)
+        finally:
+            ready.set()
+
+    job = jobs.submit(
+        kind, _inline, params=dict(params, inline=True, save=save), total=1
+    )
+    if not ready.wait(INLINE_TIMEOUT):
+        # still queued/moving, can be followed as a regular job
+        return _submitted(job)
+    if "data" not in captured:
+        # failed or cancelled before the capture
+        job.wait(INLINE_TIMEOUT)
+        return f"capture job ({job.id}) {job.state}: {job.error}", 500
+    headers = {"X-Job-Id": job.id}
+    if captured["path"]:
+        headers["X-File-Path"] = captured["path"]
+    return Response(captured["data"], mimetype="image/jpeg", headers=headers)
 
 
 @app.route("/cart/status", methods=["GET"])
@@ -62,50 +197,105 @@ def status():
             sd["cur_location"] = global_cart.linear.cur_location
             sd["_view_locations"] = global_cart._view_locations
             sd["instructions"] = global_cart.instructions
+            sd["route_summary"] = global_cart.route_summary
         else:
             sd["cart"] = None
+        current = jobs.current
+        sd["job"] = current.to_dict() if current is not None else None
         return sd, 200
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Counters and histograms of the cart (steps, pulse lateness, bound trips,
+    marker hits, phase durations, capture failures) in the Prometheus text
+    format
+    """
+    if request.method == "GET":
+        return REGISTRY.render(), 200, {"Content-Type": CONTENT_TYPE}
+
+
 @app.route("/cart/initialize", methods=["POST"])
 def initialize():
     """
     Initialize the cart, the cart is stored in `global_cart` as a global
     variable
+
+    Runs as a job, returns the job id (see /cart/jobs/status)
     """
-    global global_cart
     if request.method == "POST":
         # TODO: ensure reasonable
         mm_to_object = request.args.get("mm_to_object")
         angle = request.args.get("angle")
         force_init = request.args.get("force_init")
+        # the job gets its own copy, the worker may be reading the config of
+        # an earlier job
+        config = copy.deepcopy(init_config)
         try:
-            _ = init_config["multiview"]
+            _ = config["multiview"]
         except KeyError:
-            init_config["multiview"] = {}
+            config["multiview"] = {}
         if mm_to_object:
-            init_config["multiview"]["mm_to_object"] = int(mm_to_object)
+            config["multiview"]["mm_to_object"] = int(mm_to_object)
         if angle:
-            init_config["multiview"]["angle"] = int(angle)
-
-        if global_cart is not None:
-            if global_cart.instructions is not None:
-                # cart+instructions have already been created at least once
-                if force_init == False:
-                    return f"already initialized: {global_cart.instructions}", 200
+            config["multiview"]["angle"] = int(angle)
+
+        def _initialize(job):
+            global global_cart
+            if global_cart is not None:
+                if global_cart.instructions is not None:
+                    # cart+instructions have already been created at least once
+                    if force_init == False:
+                        return f"already initialized: {global_cart.instructions}"
+                    else:
+                        global_cart.initialize(force_init=force_init)
+                        return f"no existing instructions, re-initializing"
                 else:
-                    global_cart.initialize(force_init=force_init)
-                    return f"no existing instructions, re-initializing", 200
+                    global_cart.initialize()
+                    return f"cart existed, but no instructions found, reinitializing"
             else:
-                global_cart.initialize()
-                return f"cart existed, but no instructions found, reinitializing", 200
-        else:
-            global_cart = MultiView(init_config=init_config)
-            global_cart.initialize(force_init=force_init)
-            return (
-                f"initialized: mm_to_object: {mm_to_object}, angle: {angle}, force_init: {force_init}",
-                200,
+                cart = MultiView(init_config=config)
+                cart.initialize(force_init=force_init)
+                global_cart = cart
+                return f"initialized: mm_to_object: {mm_to_object}, angle: {angle}, force_init: {force_init}"
+
+        job = jobs.submit(
+            "initialize",
+            _initialize,
+            params={
+                "mm_to_object": mm_to_object,
+                "angle": angle,
+                "force_init": force_init,
+            },
+        )
+        return _submitted(job)
+
+
+@app.route("/cart/estimate", methods=["GET"])
+def estimate():
+    """
+    Estimated duration of a capture run, optionally for another mm_to_object,
+    angle and number of (serpentine) passes, without moving the cart.
+    `approach=true` includes the overshoot of the moves toward lower
+    locations
+    """
+    if request.method == "GET":
+        if global_cart is None:
+            return "MultiView cart not initialized", 400
+        mm_to_object = request.args.get("mm_to_object")
+        angle = request.args.get("angle")
+        passes = request.args.get("passes")
+        try:
+            rd = global_cart.estimate(
+                mm_to_object=int(mm_to_object) if mm_to_object else None,
+                angle=int(angle) if angle else None,
+                passes=int(passes) if passes else 1,
+                approach=_flag("approach"),
             )
+        except ValueError as e:
+            return f"unable to estimate: {e}", 400
+        return rd, 200
 
 
 @app.route("/cart/images/retrieve", methods=["GET"])
@@ -128,6 +318,29 @@ def retrieve():
                     return send_from_directory(BASE_PATH, file_name), 200
 
 
+@app.route("/cart/images/thumbnail", methods=["GET"])
+def thumbnail():
+    """
+    Retrieve a downscaled preview of a captured image (made if not cached)
+    """
+    if request.method == "GET":
+        file_name = request.args.get("file_name")
+        if not file_name:
+            return f"Please provide a file name", 400
+        full_path = Path(BASE_PATH).joinpath(file_name)
+        if full_path.resolve().parent != Path(BASE_PATH).resolve():
+            return f"Requested file {file_name} is not a valid file", 400
+        if not full_path.is_file():
+            return f"File ({file_name}) not found", 404
+        try:
+            thumb = thumbnails.get(full_path)
+        except ImportError as e:
+            return f"thumbnails are not available: {e}", 501
+        except OSError as e:
+            return f"unable to make a thumbnail of {file_name}. \n {e}", 400
+        return send_from_directory(str(thumb.parent), thumb.name), 200
+
+
 @app.route("/cart/images/remove", methods=["GET"])
 def remove_file():
     """
@@ -146,46 +359,198 @@ def remove_file():
                     return f"Requested file {file_name} is not a valid file", 400
                 else:
                     os.remove(str(full_path))
+                    catalog.remove(full_path)
+                    thumbnails.discard(full_path)
                     return f"file ({full_path}) removed", 200
 
 
+def _time_arg(value):
+    # unix time or ISO 8601 (e.g. 2021-01-01T17:13:18)
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
 @app.route("/cart/images/list", methods=["GET"])
 def list_files():
     """
-    List all the images currently present
+    List the captured images, from the image catalog
+
+    Filters: `index`, `name` (view), `rot_degree`, `since`/`until` (unix time
+    or ISO 8601). Pages of `limit` (default 100, max 1000) images, pass the
+    returned `next` as `after` for the following page
     """
     if request.method == "GET":
+        args = request.args
         try:
-            files = (str(x) for x in Path(BASE_PATH).iterdir() if x.is_file())
-        except Exception as e:
-            return f"unable to list files from {BASE_PATH}. \n {e}", 400
-        files = list(files)
+            limit = min(int(args.get("limit", 100)), 1000)
+            page = catalog.list(
+                index=args.get("index"),
+                name=args.get("name"),
+                rot_degree=args.get("rot_degree"),
+                since=_time_arg(args["since"]) if args.get("since") else None,
+                until=_time_arg(args["until"]) if args.get("until") else None,
+                limit=limit,
+                after=args.get("after"),
+            )
+        except ValueError as e:
+            return f"invalid image list request: {e}", 400
         rd = {}
-        rd["files"] = files
-        rd["num_files"] = len(files)
+        rd["files"] = [image["path"] for image in page["images"]]
+        rd["images"] = page["images"]
+        rd["num_files"] = page["total"]
+        rd["next"] = page["next"]
         return rd, 200
 
 
+@app.route("/cart/images/archive", methods=["GET"])
+def archive():
+    """
+    Download images as a single tar (default) or zip (`format=zip`), streamed
+    as the files are read
+
+    The images of a capture job (`job_id`) or those matching the
+    /cart/images/list filters (`index`, `name`, `rot_degree`, `since`,
+    `until`, all images if none)
+    """
+    if request.method == "GET":
+        args = request.args
+        fmt = args.get("format", "tar")
+        if fmt not in FORMATS:
+            return (
+                f"format ({fmt}) not supported, please select from {list(FORMATS)}",
+                400,
+            )
+        if args.get("job_id"):
+            job, err = _requested_job()
+            if err:
+                return err
+            result = job.result
+            if isinstance(result, str):
+                result = [result]
+            if not isinstance(result, list):
+                return f"job ({job.id}) has no captured images", 400
+            # bursts are a list of frames per view
+            result = [
+                p
+                for item in result
+                for p in (item if isinstance(item, list) else [item])
+            ]
+            base = Path(BASE_PATH).resolve()
+            paths = [
+                p
+                for p in result
+                if isinstance(p, str) and Path(p).resolve().parent == base
+            ]
+            name = f"job_{job.id}"
+        else:
+            try:
+                filters = {
+                    "index": args.get("index"),
+                    "name": args.get("name"),
+                    "rot_degree": args.get("rot_degree"),
+                    "since": _time_arg(args["since"]) if args.get("since") else None,
+                    "until": _time_arg(args["until"]) if args.get("until") else None,
+                }
+                # validate the filters before the response starts
+                catalog.list(limit=1, **filters)
+            except ValueError as e:
+                return f"invalid archive request: {e}", 400
+            paths = catalog.iter_paths(**filters)
+            name = "images"
+        return Response(
+            stream_archive(paths, fmt),
+            mimetype=FORMATS[fmt],
+            headers={"Content-Disposition": f"attachment; filename={name}.{fmt}"},
+        )
+
+
+@app.route("/cart/images/catalog/rebuild", methods=["POST"])
+def rebuild_catalog():
+    """
+    Rebuild the image catalog from the files present (`checksums=true` also
+    reads every file to checksum it)
+    """
+    if request.method == "POST":
+        checksums = _flag("checksums")
+        try:
+            num_images = catalog.rebuild(checksums=checksums)
+        except OSError as e:
+            return f"unable to rebuild the catalog from {BASE_PATH}. \n {e}", 400
+        return {"num_files": num_images}, 200
+
+
 @app.route("/cart/images/capture", methods=["POST"])
 def capture():
     """
     Follow all pre-initialized cart instructions
+
+    Runs as a job, returns the job id. The results are the captured file paths
+    (so far, if cancelled), a list of paths per view with `burst` frames. With
+    `trace=true` the run is traced, see /cart/trace
     """
     if request.method == "POST":
-        if global_cart is None:
+        if global_cart is None and not _initializing():
             return "MultiView cart not initialized", 400
-        else:
+        trace = _flag("trace")
+        try:
+            burst = _burst()
+        except ValueError as e:
+            return f"{e}", 400
+
+        def _capture(job):
+            cart = _cart()
+            if trace:
+                TRACER.start(clock=cart.clock)
             try:
-                global_cart.follow_all_instructions(func=photo_func)
-                return f"instructions followed", 200
-            except Exception as e:
-                return f"Unable to follow all instruction: Exception: {e}", 400
+                return _run_capture(job, cart)
+            finally:
+                TRACER.stop()
+
+        def _run_capture(job, cart):
+            job.total = len(cart.instructions)
+            job.plan = cart.schedule()
+
+            def _photo(instruction):
+                file_path = photo_func(instruction)
+                job.advance()
+                return file_path
+
+            # one camera session for the whole run
+            with photo_func:
+                try:
+                    job.result = cart.follow_all_instructions(
+                        func=_photo, should_stop=lambda: job.cancelled, burst=burst
+                    )
+                finally:
+                    # keep the estimates in line with the real runs
+                    cart.calibrate()
+            job.check()
+            return job.result
+
+        return _submitted(
+            jobs.submit("capture", _capture, params={"trace": trace, "burst": burst})
+        )
+
+
+@app.route("/cart/trace", methods=["GET"])
+def trace():
+    """
+    Spans of the last traced capture (see /cart/images/capture), in the Chrome
+    trace / Perfetto JSON format
+    """
+    if request.method == "GET":
+        return TRACER.to_dict(), 200
 
 
 @app.route("/cart/images/capture_index", methods=["POST"])
 def capture_index():
     """
     Capture image at the specified index
+
+    Returns the job id, or the image itself with `inline=true` (see
+    `_capture_one`)
     """
     if request.method == "POST":
         # args
@@ -203,42 +568,46 @@ def capture_index():
             pos_name = "0"
 
         # capture if specified exists
-        if global_cart:
-            cur_locations = global_cart._view_locations
-            try:
-                loc = cur_locations[index]
-                try:
-                    _ = loc[pos_name]
-                    found = False
-                    # NOTE: a more clever implementation could be worked here.
-                    # Technically, only the inner or outter loop is necessary, but this
-                    # the outter loop makes it easy to provide better error messages
-                    for instruction in global_cart.instructions:
-                        if str(instruction["index"]) == str(index):
-                            if str(instruction["name"]) == str(pos_name):
-                                found = True
-                                break
-                    if found:
-                        # CAPTURE IMAGE
-                        ret_val = global_cart.follow_instruction(
-                            instruction, func=photo_func
-                        )
-                        return f"instruction followed ({ret_val})", 200
-                    else:
-                        return (
-                            f"index ({index}) and position_name ({pos_name}) not found"
-                            f"\n {global_cart.instructions}",
-                            400,
-                        )
-                except KeyError:
-                    return f"position ({pos_name}), not in index ({loc})", 400
-            except KeyError:
-                return f"index ({index}), not in {cur_locations.keys()}", 400
-        else:
-            return (
-                "cart not initialized, please initialize (/cart/initialize, POST)",
-                400,
-            )
+        if global_cart is None and not _initializing():
+            return NOT_INITIALIZED, 400
+        if global_cart is not None:
+            _, err = _find_instruction(global_cart, index, pos_name)
+            if err:
+                return err
+
+        def _instruction(cart):
+            # checked again against the cart the job runs on
+            instruction, err = _find_instruction(cart, index, pos_name)
+            if err:
+                raise ValueError(err[0])
+            return instruction
+
+        return _capture_one(
+            "capture_index", _instruction, {"index": index, "position_name": pos_name}
+        )
+
+
+def _find_instruction(cart, index, pos_name):
+    # (instruction, None), or (None, error response) if not found
+    cur_locations = cart._view_locations
+    try:
+        loc = cur_locations[index]
+    except KeyError:
+        return None, (f"index ({index}), not in {cur_locations.keys()}", 400)
+    if pos_name not in loc:
+        return None, (f"position ({pos_name}), not in index ({loc})", 400)
+    # NOTE: a more clever implementation could be worked here.
+    # Technically, only the inner or outter loop is necessary, but this
+    # the outter loop makes it easy to provide better error messages
+    for instruction in cart.instructions:
+        if str(instruction["index"]) == str(index):
+            if str(instruction["name"]) == str(pos_name):
+                return instruction, None
+    return None, (
+        f"index ({index}) and position_name ({pos_name}) not found"
+        f"\n {cart.instructions}",
+        400,
+    )
 
 
 # TODO: allow for custom photos
@@ -246,6 +615,9 @@ def capture_index():
 def capture_step():
     """
     Capture image at the specified step/rotation
+
+    Returns the job id, or the image itself with `inline=true` (see
+    `_capture_one`)
     """
     if request.method == "POST":
         # TODO: ensure existing
@@ -273,15 +645,23 @@ def capture_step():
         if not isinstance(index, int):
             index = int(index)
 
-        if global_cart:
-            instruction = global_cart._create_instruction(
-                location=location,
-                rotation_degree=rotation_degree,
-                name=name,
-                index=index,
+        if global_cart is not None or _initializing():
+            params = {
+                "location": location,
+                "rot_degree": rotation_degree,
+                "name": name,
+                "index": index,
+            }
+            return _capture_one(
+                "capture_step",
+                lambda cart: cart._create_instruction(
+                    location=location,
+                    rotation_degree=rotation_degree,
+                    name=name,
+                    index=index,
+                ),
+                params,
             )
-            ret_val = global_cart.follow_instruction(instruction, func=photo_func)
-            return f"instruction followed ({ret_val})", 200
 
         return (
             f"location: {location}, rotation_degree: {rotation_degree}, name: {name}, index: {index}",
@@ -289,7 +669,69 @@ def capture_step():
         )
 
 
+@app.route("/cart/jobs", methods=["GET"])
+def list_jobs():
+    """
+    List the queued, running and recently finished jobs
+    """
+    if request.method == "GET":
+        rd = {}
+        rd["jobs"] = [job.to_dict() for job in jobs.list()]
+        rd["num_jobs"] = len(rd["jobs"])
+        return rd, 200
+
+
+def _requested_job():
+    job_id = request.args.get("job_id")
+    if not job_id:
+        return None, (f"Please provide a job_id", 400)
+    job = jobs.get(job_id)
+    if job is None:
+        return None, (f"job ({job_id}) not found", 404)
+    return job, None
+
+
+@app.route("/cart/jobs/status", methods=["GET"])
+def job_status():
+    """
+    State and progress of a job
+    """
+    if request.method == "GET":
+        job, err = _requested_job()
+        if err:
+            return err
+        return job.to_dict(), 200
+
+
+@app.route("/cart/jobs/cancel", methods=["POST"])
+def job_cancel():
+    """
+    Cancel a queued job, a running job stops before its next instruction
+    """
+    if request.method == "POST":
+        job, err = _requested_job()
+        if err:
+            return err
+        job = jobs.cancel(job.id)
+        return job.to_dict(), 200
+
+
+@app.route("/cart/jobs/results", methods=["GET"])
+def job_results():
+    """
+    Results of a finished job (e.g. the captured file paths)
+    """
+    if request.method == "GET":
+        job, err = _requested_job()
+        if err:
+            return err
+        if job.state not in ("done", "failed", "cancelled"):
+            return f"job ({job.id}) is {job.state}", 409
+        return job.to_dict(include_result=True), 200
+
+
 if __name__ == "__main__":
-    # threded=False --> allow only one instruction at a time. This could be
-    # modifed by using a queue, but for now, having only a single thread is sufficient
-    app.run(host="0.0.0.0", threaded=False)
+    # hardware work is serialized by the job worker, so requests can be served
+    # (e.g. /cart/status) while a scan runs
+    jobs.start()
+    app.run(host="0.0.0.0", threaded=True)
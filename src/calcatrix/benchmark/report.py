@@ -0,0 +1,98 @@
+import json
+import platform
+from datetime import datetime
+
+RESULTS_VERSION = 1
+
+
+def result_key(result):
+    params = ",".join(f"{k}={result['params'][k]}" for k in sorted(result["params"]))
+    return f"{result['scenario']}[{params}]"
+
+
+def build_results(results, backend):
+    return {
+        "version": RESULTS_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "backend": backend,
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+
+
+def write_results(data, fpath):
+    with open(fpath, "w") as fh:
+        json.dump(data, fh, indent=2, sort_keys=True)
+
+
+def load_results(fpath):
+    with open(fpath, "r") as fh:
+        data = json.load(fh)
+    try:
+        version = data["version"]
+    except KeyError:
+        raise ValueError(f"no version present in results {fpath}")
+    if version != RESULTS_VERSION:
+        raise ValueError(
+            f"results {fpath} are version {version}, expected {RESULTS_VERSION}"
+        )
+    return data
+
+
+def compare(current, baseline, tolerance=0.1, include_wall=False):
+    """compare two result sets (as from `build_results`)
+
+    A metric regresses if it is worse than the baseline by more than
+    `tolerance` (relative). Metrics without a direction (`better` is None),
+    real time (`clock` == "wall") metrics unless `include_wall`, and results
+    missing from either set are skipped.
+
+    Returns a list of dicts, one per compared metric
+    """
+    base_results = {result_key(r): r for r in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        key = result_key(result)
+        try:
+            base = base_results[key]
+        except KeyError:
+            continue
+        for name, metric in result["metrics"].items():
+            better = metric["better"]
+            try:
+                base_value = base["metrics"][name]["value"]
+            except KeyError:
+                continue
+            if better is None or not base_value:
+                continue
+            if metric.get("clock") == "wall" and not include_wall:
+                continue
+            change = (metric["value"] - base_value) / abs(base_value)
+            if better == "lower":
+                regressed = change > tolerance
+            else:
+                regressed = change < -tolerance
+            rows.append(
+                {
+                    "key": key,
+                    "metric": name,
+                    "unit": metric["unit"],
+                    "baseline": base_value,
+                    "current": metric["value"],
+                    "change": change,
+                    "regressed": regressed,
+                }
+            )
+    return rows
+
+
+def format_comparison(rows):
+    lines = []
+    for row in rows:
+        flag = "REGRESSED" if row["regressed"] else "ok"
+        lines.append(
+            f"{flag:>9} {row['key']} {row['metric']}: {row['baseline']:.4g} -> "
+            f"{row['current']:.4g} {row['unit']} ({row['change']:+.1%})"
+        )
+    return "\n".join(lines)
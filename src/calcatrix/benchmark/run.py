@@ -0,0 +1,177 @@
+"""Benchmark homing, traversal and full scan throughput
+
+    python -m calcatrix.benchmark.run --output results.json
+    python -m calcatrix.benchmark.run --output new.json --baseline results.json
+
+With `--backend sim` (default) each scan scenario runs on a simulated rig for
+every combination of track length, marker count and (mm_to_object, angle).
+With `--backend hardware` the rig config is read from `--config` (json) and
+only (mm_to_object, angle) are varied. Exits with 1 if any metric regressed
+against the baseline (real time metrics are only compared with
+`--include-wall`, rig time metrics are deterministic on the simulated rig).
+"""
+
+import argparse
+import contextlib
+import copy
+import json
+import sys
+
+from calcatrix.benchmark.report import (
+    build_results,
+    compare,
+    format_comparison,
+    load_results,
+    write_results,
+)
+from calcatrix.benchmark.scenarios import bench_pulse_engine, bench_scan, sim_config
+
+DEFAULT_TRACKS = [20000, 133333]
+DEFAULT_MARKERS = [5, 50]
+DEFAULT_VIEWS = [(300, 10), (500, 20)]
+
+QUICK_TRACKS = [20000]
+QUICK_MARKERS = [5]
+QUICK_VIEWS = [(300, 10)]
+
+
+def _views(values):
+    views = []
+    for value in values:
+        mm_to_object, angle = value.split(":")
+        views.append((int(mm_to_object), int(angle)))
+    return views
+
+
+def run_benchmarks(
+    backend="sim",
+    tracks=None,
+    markers=None,
+    views=None,
+    hardware_config=None,
+    pulse_engine=True,
+    log=print,
+):
+    """run all scenarios, returns results as from `build_results`"""
+    tracks = tracks if tracks is not None else DEFAULT_TRACKS
+    markers = markers if markers is not None else DEFAULT_MARKERS
+    views = views if views is not None else DEFAULT_VIEWS
+
+    results = []
+    if pulse_engine:
+        params = {"num_steps": 2000, "velocity": 2000}
+        log(f"pulse_engine {params}")
+        results.append(
+            {
+                "scenario": "pulse_engine",
+                "params": params,
+                "metrics": bench_pulse_engine(**params),
+            }
+        )
+
+    for mm_to_object, angle in views:
+        if backend == "sim":
+            for track_steps in tracks:
+                for num_markers in markers:
+                    params = {
+                        "track_steps": track_steps,
+                        "num_markers": num_markers,
+                        "mm_to_object": mm_to_object,
+                        "angle": angle,
+                    }
+                    log(f"scan {params}")
+                    config = sim_config(track_steps, num_markers, mm_to_object, angle)
+                    results.append(
+                        {
+                            "scenario": "scan",
+                            "params": params,
+                            "metrics": bench_scan(config),
+                        }
+                    )
+        elif backend == "hardware":
+            if hardware_config is None:
+                raise ValueError("a rig config is required for the hardware backend")
+            config = copy.deepcopy(hardware_config)
+            config["backend"] = "hardware"
+            config["multiview"] = {"mm_to_object": mm_to_object, "angle": angle}
+            params = {"mm_to_object": mm_to_object, "angle": angle}
+            log(f"scan {params}")
+            results.append(
+                {"scenario": "scan", "params": params, "metrics": bench_scan(config)}
+            )
+        else:
+            raise ValueError(
+                f"backend ({backend}) not supported, please select from "
+                f"['sim', 'hardware']"
+            )
+    return build_results(results, backend)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default="sim", choices=["sim", "hardware"])
+    parser.add_argument("--config", help="rig init config (json), hardware only")
+    parser.add_argument("--output", help="where to write the results (json)")
+    parser.add_argument("--baseline", help="results (json) to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument(
+        "--include-wall",
+        action="store_true",
+        help="also compare real time (noisy) metrics against the baseline",
+    )
+    parser.add_argument("--tracks", type=int, nargs="+")
+    parser.add_argument("--markers", type=int, nargs="+")
+    parser.add_argument(
+        "--views", nargs="+", help="mm_to_object:angle pairs, e.g. 300:10 500:20"
+    )
+    parser.add_argument("--quick", action="store_true", help="small scenario grid")
+    parser.add_argument(
+        "--no-pulse-engine", action="store_true", help="skip the pulse engine jitter"
+    )
+    args = parser.parse_args(argv)
+
+    tracks, markers, views = args.tracks, args.markers, None
+    if args.views:
+        views = _views(args.views)
+    if args.quick:
+        tracks = tracks or QUICK_TRACKS
+        markers = markers or QUICK_MARKERS
+        views = views or QUICK_VIEWS
+
+    hardware_config = None
+    if args.config:
+        with open(args.config, "r") as fh:
+            hardware_config = json.load(fh)
+
+    # the devices print progress (e.g. homing) to stdout, keep stdout for the
+    # results
+    with contextlib.redirect_stdout(sys.stderr):
+        data = run_benchmarks(
+            backend=args.backend,
+            tracks=tracks,
+            markers=markers,
+            views=views,
+            hardware_config=hardware_config,
+            pulse_engine=not args.no_pulse_engine,
+            log=lambda msg: print(msg, file=sys.stderr),
+        )
+    if args.output:
+        write_results(data, args.output)
+    else:
+        print(json.dumps(data, indent=2, sort_keys=True))
+
+    if args.baseline:
+        rows = compare(
+            data,
+            load_results(args.baseline),
+            tolerance=args.tolerance,
+            include_wall=args.include_wall,
+        )
+        print(format_comparison(rows), file=sys.stderr)
+        if any(row["regressed"] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import copy
+import time
+
+from calcatrix.devices.multiview import MultiView
+from calcatrix.motion.profile import MotionProfile
+from calcatrix.motion.pulse import PulseEngine, SystemClock
+
+# pins are only used by the hardware backend
+_BASE_CONFIG = {
+    "rotate": {"pins": [21, 20, 16, 12]},
+    "linear": {
+        "stepper": {"dir": 27, "step": 17, "enable": 22},
+        "location": {
+            "marker": {"pin": 26},
+            "bound_a": {"pin": 23},
+            "bound_b": {"pin": 25},
+        },
+    },
+}
+
+
+def _metric(value, unit, better="lower", clock="rig"):
+    # clock="wall" marks real time measurements, which are noisy on a shared
+    # machine (see `compare`)
+    return {"value": value, "unit": unit, "better": better, "clock": clock}
+
+
+def _stats(values, unit, prefix):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {
+        f"{prefix}_mean": _metric(sum(ordered) / len(ordered), unit),
+        f"{prefix}_p50": _metric(ordered[len(ordered) // 2], unit),
+        f"{prefix}_max": _metric(ordered[-1], unit),
+    }
+
+
+def sim_config(track_steps, num_markers, mm_to_object=300, angle=10, base=None):
+    """init config for a simulated rig with evenly spaced markers"""
+    config = copy.deepcopy(base if base is not None else _BASE_CONFIG)
+    margin = max(track_steps // 20, 500)
+    span = track_steps - 2 * margin
+    magnets = [margin + int(span * (i + 0.5) / num_markers) for i in range(num_markers)]
+    config["backend"] = {
+        "type": "sim",
+        "track_steps": track_steps,
+        "magnets": magnets,
+        "start": track_steps // 2,
+    }
+    config["multiview"] = {"mm_to_object": mm_to_object, "angle": angle}
+    return config
+
+
+def _noop_capture(instruction):
+    return None
+
+
+def bench_pulse_engine(num_steps=2000, velocity=2000):
+    """jitter of the in process pulse engine on this machine (no hardware)"""
+
+    class _NullPin:
+        def on(self):
+            pass
+
+        def off(self):
+            pass
+
+    engine = PulseEngine(_NullPin(), clock=SystemClock())
+    profile = MotionProfile(max_velocity=velocity)
+    start = time.perf_counter()
+    report = engine.run(profile.iter_periods(num_steps), 1 / velocity / 2)
+    wall = time.perf_counter() - start
+
+    metrics = {
+        "steps_per_s": _metric(report.steps / wall, "steps/s", "higher", "wall"),
+        "late_mean": _metric(report.mean_late_ns / 1e3, "us", clock="wall"),
+        "late_p99": _metric(report.percentile_late_ns(99) / 1e3, "us", clock="wall"),
+        "late_max": _metric(report.max_late_ns / 1e3, "us", clock="wall"),
+    }
+    return metrics
+
+
+def bench_scan(config, capture=None, traverse_fraction=0.8):
+    """homing, traversal and full scan of a MultiView built from `config`
+
+    Durations are measured on the backend's clock (rig time, virtual for the
+    simulated rig), `wall_*` is the real time spent (python overhead in sim)
+    """
+    if capture is None:
+        capture = _noop_capture
+    metrics = {}
+
+    wall_start = time.perf_counter()
+    mv = MultiView(init_config=config)
+    clock = mv.backend.clock
+
+    # homing
+    t0 = clock.now_ns()
+    w0 = time.perf_counter()
+    mv.initialize(force_init=True)
+    metrics["set_home_s"] = _metric((clock.now_ns() - t0) / 1e9, "s")
+    metrics["wall_set_home_s"] = _metric(time.perf_counter() - w0, "s", clock="wall")
+    metrics["num_markers"] = _metric(len(mv.linear.positions), "markers", better=None)
+
+    # traversal, steps/s + pulse lateness of a long move
+    linear = mv.linear
+    target = int(linear.max_steps * traverse_fraction)
+    start_loc = linear.cur_location
+    t0 = clock.now_ns()
+    linear.move_to_location(target)
+    elapsed = (clock.now_ns() - t0) / 1e9
+    steps = abs(target - start_loc)
+    if elapsed > 0:
+        metrics["traverse_steps_per_s"] = _metric(steps / elapsed, "steps/s", "higher")
+    report = linear.stepper.last_report
+    if report is not None:
+        metrics["traverse_late_p99"] = _metric(
+            report.percentile_late_ns(99) / 1e3, "us"
+        )
+        metrics["traverse_late_max"] = _metric(report.max_late_ns / 1e3, "us")
+
+    # full scan (as run: route, coordinated moves, final return to 0), per
+    # instruction latency from the run's timings
+    t_scan = clock.now_ns()
+    w0 = time.perf_counter()
+    mv.follow_all_instructions(func=capture)
+    latencies = [timing["total"] for timing in mv.timings]
+    metrics["scan_s"] = _metric((clock.now_ns() - t_scan) / 1e9, "s")
+    metrics["wall_scan_s"] = _metric(time.perf_counter() - w0, "s", clock="wall")
+    metrics["num_instructions"] = _metric(len(latencies), "instructions", better=None)
+    metrics.update(_stats(latencies, "s", "instruction"))
+    metrics["wall_total_s"] = _metric(
+        time.perf_counter() - wall_start, "s", clock="wall"
+    )
+    return metrics
@@ -0,0 +1,76 @@
+from calcatrix.motion.pulse import SystemClock
+
+
+class HardwareBackend:
+    """Real devices on a Pi
+
+    gpiozero (native pin factory) for the linear device and RPi.GPIO for the
+    rotator. Hardware modules are only imported when this backend is used, so
+    other backends (e.g. `calcatrix.sim`) run without them.
+    """
+
+    name = "hardware"
+
+    def __init__(self):
+        from gpiozero import Device  # pylint: disable=import-error
+        from gpiozero.pins.native import NativeFactory  # pylint: disable=import-error
+
+        if not isinstance(Device.pin_factory, NativeFactory):
+            Device.pin_factory = NativeFactory()
+        self.clock = SystemClock()
+
+    def stepper(self, init_config, name="stepper"):
+        from calcatrix.devices.stepper import Stepper
+
+        return Stepper(init_config, name=name, clock=self.clock)
+
+    def hall(self, **kwargs):
+        from calcatrix.devices.hall import Hall
+
+        return Hall(**kwargs)
+
+    def limit(self, **kwargs):
+        from calcatrix.devices.limit import Limit
+
+        return Limit(**kwargs)
+
+    def rotator(self, pins, output=None, profile=None):
+        from calcatrix.devices.rotate import Rotator
+
+        return Rotator(pins, output=output, clock=self.clock, profile=profile)
+
+    def __repr__(self):
+        return str(self.__class__.__name__)
+
+
+def get_backend(config=None):
+    """select the device backend from the `backend` config
+
+    - None, "hardware" or {"type": "hardware"}: real devices
+    - {"type": "sim", ...}: simulated rig (see `calcatrix.sim.rig.SimRig`)
+    - an already built backend is returned as is (so it can be shared)
+    """
+    if config is None:
+        return HardwareBackend()
+    if isinstance(config, str):
+        config = {"type": config}
+    if not isinstance(config, dict):
+        return config
+
+    try:
+        backend_type = config["type"]
+    except KeyError:
+        backend_type = "hardware"
+
+    if backend_type == "hardware":
+        return HardwareBackend()
+    elif backend_type == "sim":
+        from calcatrix.sim.rig import SimRig
+
+        kwargs = {k: v for k, v in config.items() if k != "type"}
+        return SimRig(**kwargs)
+    else:
+        raise ValueError(
+            f"backend type ({backend_type}) not supported, please select from "
+            f"['hardware', 'sim']"
+        )
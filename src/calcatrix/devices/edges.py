@@ -0,0 +1,78 @@
+import time
+
+
+class EdgeMixin:
+    """Interrupt driven edge capture for an input device
+
+    Edges come from the pin's edge detection (not the smoothing queue), so they
+    are seen as soon as they happen. Each edge is timestamped (`ticks`, ns on
+    the `time.perf_counter_ns` timeline of the pulse engines): the pin
+    factory's tick is converted with `ticks_diff` against a reference taken
+    by `arm` (pigpio ticks are microseconds wrapping at 2**32, the local
+    factories take the tick when the edge is dispatched, not at the
+    interrupt, so the accuracy of the time depends on the factory). While
+    armed, each edge records the value of
+    `counter(ticks)` (e.g. the step of the current move at that time) and an
+    activation sets `trip` (a `threading.Event` the motion loop checks before
+    every step).
+
+    The `when_activated`/`when_deactivated` passed to the constructor are
+    called on every edge, armed or not.
+    """
+
+    def _init_edges(self, when_activated=None, when_deactivated=None):
+        self._edge_activated = when_activated
+        self._edge_deactivated = when_deactivated
+        self.counter = None
+        self.trip = None
+        self._ref_ticks = None
+        self._ref_ns = None
+        if getattr(self, "pin", None) is not None:
+            self.pin.edges = "both"
+            self.pin.when_changed = self._pin_edge
+
+    def arm(self, counter=None, trip=None):
+        factory = getattr(self, "pin_factory", None)
+        if factory is not None:
+            # reference for `_ticks_ns`, taken before any edge of the move
+            self._ref_ticks = factory.ticks()
+            self._ref_ns = time.perf_counter_ns()
+        self.counter = counter
+        self.trip = trip
+
+    def disarm(self):
+        self.counter = None
+        self.trip = None
+        self._ref_ticks = None
+        self._ref_ns = None
+
+    def _ticks_ns(self, ticks):
+        ref_ticks, ref_ns = self._ref_ticks, self._ref_ns
+        if ref_ticks is None:
+            return time.perf_counter_ns()
+        # seconds since the reference, whatever the factory's tick unit/wrap
+        return ref_ns + int(self.pin_factory.ticks_diff(ticks, ref_ticks) * 1e9)
+
+    def _pin_edge(self, ticks, state):
+        self._edge(bool(self._state_to_value(state)), self._ticks_ns(ticks))
+
+    def _edge(self, active, ticks=None):
+        counter = self.counter
+        step = counter(ticks) if counter is not None else None
+        if active:
+            trip = self.trip
+            if trip is not None:
+                trip.set()
+            self._on_activated(step, ticks)
+            if self._edge_activated is not None:
+                self._edge_activated()
+        else:
+            self._on_deactivated(step, ticks)
+            if self._edge_deactivated is not None:
+                self._edge_deactivated()
+
+    def _on_activated(self, step, ticks):
+        pass
+
+    def _on_deactivated(self, step, ticks):
+        pass
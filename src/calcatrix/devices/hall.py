@@ -1,12 +1,20 @@
+from array import array
+
 from gpiozero import SmoothedInputDevice  # pylint: disable=import-error
 
+from calcatrix.devices.edges import EdgeMixin
+
 
-class Hall(SmoothedInputDevice):
+class Hall(EdgeMixin, SmoothedInputDevice):
     """
     Hall sensor is used to detect magnets.
 
     The magnets are placed in the track marking fixed locations.
 
+    While armed (see `EdgeMixin`), the (fractional) step count at each
+    rising/falling edge is appended to `activations`/`deactivations` and its
+    time (ns) to `activation_ticks`/`deactivation_ticks`. Only edges are
+    stored, so memory grows with the number of magnets, not the track length
     """
 
     def __init__(
@@ -41,16 +49,29 @@ class Hall(SmoothedInputDevice):
                 f"name ({name}) expected to be type {str}, not {type(name)}"
             )
         self.name = name
-        self.activations = []
-        self.deactivations = []
+        self.rezero()
+        self._init_edges(when_activated, when_deactivated)
+
+    def _on_activated(self, step, ticks):
+        if step is not None:
+            self.activations.append(step)
+            self.activation_ticks.append(ticks or 0)
+
+    def _on_deactivated(self, step, ticks):
+        if step is not None:
+            self.deactivations.append(step)
+            self.deactivation_ticks.append(ticks or 0)
 
     @property
     def value(self):
         return super(Hall, self).value
 
     def rezero(self):
-        self.activations = []
-        self.deactivations = []
+        # (fractional) step and time (ns) of each edge
+        self.activations = array("d")
+        self.deactivations = array("d")
+        self.activation_ticks = array("q")
+        self.deactivation_ticks = array("q")
 
     def __repr__(self):
         return str(self.__class__.__name__) + ": " + f"{self.__dict__}"
@@ -1,12 +1,17 @@
 from gpiozero import SmoothedInputDevice  # pylint: disable=import-error
 
+from calcatrix.devices.edges import EdgeMixin
 
-class Limit(SmoothedInputDevice):
+
+class Limit(EdgeMixin, SmoothedInputDevice):
     """
     Limit switch -- normally open
 
     The limit switches are used to discover "ends" of the track as well as
     stop the cart in case something has fallen over/on the track
+
+    While armed (see `EdgeMixin`), an activation sets the motion loop's abort
+    flag and the step count is appended to `trips`
     """
 
     def __init__(
@@ -41,10 +46,19 @@ class Limit(SmoothedInputDevice):
                 f"name ({name}) expected to be type {str}, not {type(name)}"
             )
         self.name = name
+        self.trips = []
+        self._init_edges(when_activated, when_deactivated)
+
+    def _on_activated(self, step, ticks):
+        if self.trip is not None:
+            self.trips.append(step)
 
     @property
     def value(self):
         return super(Limit, self).value
 
+    def rezero(self):
+        self.trips = []
+
     def __repr__(self):
         return str(self.__class__.__name__) + ": " + f"{self.__dict__}"
@@ -1,20 +1,21 @@
-import pickle
-from pathlib import Path
+import math
+import threading
 
-from gpiozero import Device  # pylint: disable=import-error
-from gpiozero.pins.native import NativeFactory  # pylint: disable=import-error
-
-from calcatrix.devices.hall import Hall
-from calcatrix.devices.limit import Limit
-from calcatrix.devices.stepper import Stepper
-
-Device.pin_factory = NativeFactory()
+from calcatrix.devices.backend import get_backend
+from calcatrix.devices.markers import cluster_edges
+from calcatrix.metrics.registry import BOUND_TRIPS, MARKER_HITS
+from calcatrix.metrics.trace import TRACER
+from calcatrix.motion.profile import MotionProfile
+from calcatrix.state.store import StateStore
 
 
 class LinearDevice:
     """Linear moving cart
 
     Moves in two directions, has knowledge of fixed locations
+
+    The devices are built by `backend` (hardware unless `init_config["backend"]`
+    selects another, see `get_backend`)
     """
 
     def __init__(
@@ -23,25 +24,102 @@ class LinearDevice:
         init_config,
         max_steps=None,
         name="linear",
+        backend=None,
     ):
         self.name = name
-        self.stepper = Stepper(init_config["stepper"], name="step")
-        self.marker = Hall(**init_config["location"]["marker"], name="marker")
-        self.bound_a = Limit(**init_config["location"]["bound_a"], name="a")
-        self.bound_b = Limit(**init_config["location"]["bound_b"], name="b")
+        if backend is None:
+            try:
+                backend = init_config["backend"]
+            except KeyError:
+                backend = None
+        self.backend = get_backend(backend)
+        self.stepper = self.backend.stepper(init_config["stepper"], name="step")
+        self.marker = self.backend.hall(
+            **init_config["location"]["marker"], name="marker"
+        )
+        self.bound_a = self.backend.limit(
+            **init_config["location"]["bound_a"], name="a"
+        )
+        self.bound_b = self.backend.limit(
+            **init_config["location"]["bound_b"], name="b"
+        )
 
         self.cur_location = None
         self.dir_dict = {}
 
         # TODO: const by hardware
         self.backoff_steps = 40
-        self.pulses_per_step = 5
 
         self.sequence_tolerance = 5
 
-        # 'average' Location of the markers, is set on the set_home() sequence
+        # an edge on a bound pin stops the move at once, the trip is only taken
+        # as the bound if the (smoothed) bound value still reads active
+        # `bound_confirm_s` after stopping (e.g. not a glitch from the driver)
+        try:
+            self.bound_confirm_s = init_config["bound_confirm_s"]
+        except KeyError:
+            self.bound_confirm_s = 0.02
+
+        # with `approach`, moves toward a lower location overshoot it by
+        # `overshoot_steps` and come back, so every location is reached from
+        # the same side (the belt/gear slack is always taken up the same way)
+        try:
+            self.overshoot_steps = init_config["overshoot_steps"]
+        except KeyError:
+            self.overshoot_steps = 50
+
+        # "single": each bound is found at the fixed step rate (markers are
+        # collected on the way to the second bound)
+        # "fast": seek the first bound fast, back off and re-approach slowly
+        # for a precise zero, then sweep the track at `sweep_velocity` for
+        # the markers (see `_init_location_information_fast`)
+        try:
+            homing_config = init_config["homing"]
+        except KeyError:
+            homing_config = {}
+        default_velocity = self.stepper.default_velocity
+        self.homing = {
+            "mode": "single",
+            "seek_velocity": 4 * default_velocity,
+            # the markers are collected at the stepper's rate (known to catch
+            # the narrowest magnet), rigs whose edge latency has been measured
+            # can sweep faster with `init_config["homing"]["sweep_velocity"]`
+            "sweep_velocity": default_velocity,
+            "approach_velocity": default_velocity / 2,
+            "acceleration": 4 * default_velocity,
+            "approach_steps": 200,
+        }
+        for k, v in homing_config.items():
+            if k not in self.homing:
+                raise ValueError(
+                    f"homing option ({k}) not supported, please select from "
+                    f"{list(self.homing.keys())}"
+                )
+            self.homing[k] = v
+        if self.homing["mode"] not in ("single", "fast"):
+            raise ValueError(
+                f"homing mode ({self.homing['mode']}) not supported, please select "
+                f"from ['single', 'fast']"
+            )
+
+        # ramp up/cruise/ramp down used by `move_direction`, if no profile is
+        # specified every step is taken at the stepper's fixed rate
+        try:
+            profile_config = init_config["profile"]
+        except KeyError:
+            profile_config = None
+        self.profile = MotionProfile.from_config(
+            profile_config, default_velocity=self.stepper.default_velocity
+        )
+
+        # center of the markers (fractional steps, interpolated from the edge
+        # times), is set on the set_home() sequence
         self.positions = None
+        # center, width, spans and confidence of each marker (see `cluster_edges`)
+        self.markers = None
         self._dir_increase = None
+        # steps pulsed by each segment of the last `move_to_location`
+        self.last_segments = []
 
         self._pulley_teeth = 60
         self._timing_pitch_mm = 3
@@ -82,52 +160,81 @@ class LinearDevice:
         except KeyError:
             init_from_file = False
 
+        # position updates are journaled, the full state is compacted every
+        # `compact_every` updates (see `StateStore`)
+        try:
+            compact_every = init_config["positions"]["compact_every"]
+        except KeyError:
+            compact_every = 200
+        try:
+            sync_interval = init_config["positions"]["sync_interval"]
+        except KeyError:
+            sync_interval = 1.0
+
+        if self.stored_loc_path:
+            self.store = StateStore(
+                self.stored_loc_path,
+                compact_every=compact_every,
+                sync_interval=sync_interval,
+            )
+        else:
+            self.store = None
+
         if init_from_file:
-            self.file_data = self._parse_saved_locations(self.stored_loc_path)
+            self.file_data = self._load_state()
         else:
             self.file_data = None
 
+        # when initializing from file, confirm the stored location against the
+        # nearest marker (scanning +/- `verify_window` steps around it) rather
+        # than trusting it blindly
+        try:
+            self.verify_from_file = init_config["positions"]["verify"]
+        except KeyError:
+            self.verify_from_file = False
+        try:
+            self.verify_window = init_config["positions"]["verify_window"]
+        except KeyError:
+            self.verify_window = 200
+
     def at_location(self):
         return self.marker.value
 
-    def _parse_saved_locations(self, fpath):
-        if fpath is None:
+    def _load_state(self):
+        if self.store is None:
             raise ValueError(f"no filepath has been specified")
-
-        saved_data = Path(fpath)
-        if saved_data.is_file():
-            with open(saved_data, "rb") as fp:
-                data = pickle.load(fp)
-        else:
-            data = None
+        data = self.store.load()
+        if data and data.get("positions"):
+            # json object keys are strings
+            data["positions"] = {int(k): v for k, v in data["positions"].items()}
         return data
 
-    def _find_seqs_with_tol(self, positions, tolerance=1):
-        # https://stackoverflow.com/questions/2361945/detecting-consecutive-integers-in-a-list
-        # drop duplicates (shouldn't be present) + ensure sort
-        positions = sorted(set(positions))
-        gaps = [[s, e] for s, e in zip(positions, positions[1:]) if s + tolerance < e]
-        edges = iter(positions[:1] + sum(gaps, []) + positions[-1:])
-        return list(zip(edges, edges))
-
-    def _obtain_average_from_seq(self, l, lt):
-        positions = {}
-        for i, inds in enumerate(lt):
-            # NOTE: will round down, e.g. 123.5 --> 123
-            avg = int((inds[0] + inds[1]) / 2)
-            positions[i] = avg
-        return positions
-
-    def _obtain_positions(self, l, tolerance=1):
-        lt = self._find_seqs_with_tol(l, tolerance)
-        pos = self._obtain_average_from_seq(l, lt)
-        # NOTE: convert to int
-        return pos
+    def _measure_markers(self, end_step, keep=True):
+        """cluster the recorded marker edges (see `cluster_edges`)
+
+        Returns {index: center} (fractional steps) and, with `keep`, stores the
+        full per marker information (center, width, spans, confidence) in
+        `self.markers`
+        """
+        MARKER_HITS.inc(len(self.marker.activations))
+        markers = cluster_edges(
+            self.marker.activations,
+            self.marker.deactivations,
+            tolerance=self.sequence_tolerance,
+            end_step=end_step,
+        )
+        if keep:
+            self.markers = markers
+        return {i: m["center"] for i, m in enumerate(markers)}
 
     def _init_location_information(self):
+        if self.homing["mode"] == "fast":
+            return self._init_location_information_fast()
+
         # move one direction
         print("moving True")
-        o_t = self._move_to_bound(True)
+        with TRACER.span("home.first_bound", cat="homing"):
+            o_t = self._move_to_bound(True)
         if o_t[0]:
             home_name = "a"
         else:
@@ -136,47 +243,142 @@ class LinearDevice:
 
         print("moving other")
         # move the other + and collect marker locations along the way
-        o_f = self._move_to_bound(False, collect_markers=True, prev_bound=home_name)
+        with TRACER.span("home.sweep", cat="homing"):
+            o_f = self._move_to_bound(False, collect_markers=True, prev_bound=home_name)
         if o_f[0]:
             end_name = "a"
         else:
             end_name = "b"
-        self._dir_increase = True
-        self.dir_dict[end_name] = {"direction": False, "location": o_f[2]}
+        self._set_home_information(home_name, end_name, o_f[2])
 
-        # ensure each direction uses a different sensor
-        if home_name == end_name:
-            raise ValueError("bounds appear to share same sensor")
+    def _init_location_information_fast(self):
+        """two phase homing
 
-        # override max_steps
-        self.max_steps = o_f[2]
+        1. seek the first bound fast (ramped), back off `approach_steps` and
+           re-approach at `approach_velocity`, zero is `backoff_steps` from it
+        2. sweep to the other bound at `sweep_velocity` collecting markers,
+           then back off and re-approach slowly for a precise `max_steps`
+        """
+        h = self.homing
+        default_velocity = self.stepper.default_velocity
+        seek = MotionProfile(
+            max_velocity=h["seek_velocity"],
+            acceleration=h["acceleration"],
+            start_velocity=min(default_velocity, h["seek_velocity"]),
+        )
+        sweep = MotionProfile(
+            max_velocity=h["sweep_velocity"],
+            acceleration=h["acceleration"],
+            start_velocity=min(default_velocity, h["sweep_velocity"]),
+        )
+        approach = MotionProfile(max_velocity=h["approach_velocity"])
+        approach_steps = h["approach_steps"]
+        max_search = math.ceil(self.max_steps)
 
-        if self.marker.activations:
-            self.positions = self._obtain_positions(
-                self.marker.activations, self.sequence_tolerance
+        self.stepper.enable_pin.off()
+        try:
+            print("seeking True")
+            with TRACER.span("home.seek", cat="homing"):
+                a_val, _, _ = self._run_to_bound(
+                    True,
+                    [self.bound_a, self.bound_b],
+                    periods=seek.iter_periods(max_search),
+                )
+            home_name, home_bound = (
+                ("a", self.bound_a) if a_val else ("b", self.bound_b)
             )
+            end_name = "b" if home_name == "a" else "a"
+            end_bound = self.bound_b if home_name == "a" else self.bound_a
+            self.dir_dict[home_name] = {"direction": True, "location": 0}
+
+            # precise zero
+            with TRACER.span("home.approach_zero", cat="homing"):
+                self.stepper.step_n(approach_steps, False)
+                self._run_to_bound(
+                    True,
+                    [home_bound],
+                    periods=approach.iter_periods(2 * approach_steps),
+                    max_steps=2 * approach_steps,
+                )
+                self._backoff_bound(True)
+
+            print("sweeping False")
+            with TRACER.span("home.sweep", cat="homing"):
+                _, _, swept = self._run_to_bound(
+                    False,
+                    [end_bound],
+                    periods=sweep.iter_periods(max_search),
+                    collect_markers=True,
+                )
+            # precise end
+            with TRACER.span("home.approach_end", cat="homing"):
+                self.stepper.step_n(approach_steps, True)
+                _, _, approached = self._run_to_bound(
+                    False,
+                    [end_bound],
+                    periods=approach.iter_periods(2 * approach_steps),
+                    max_steps=2 * approach_steps,
+                )
+                self._backoff_bound(False)
+        finally:
+            self.stepper.enable_pin.on()
 
-        self.cur_location = 0
+        self._set_home_information(
+            home_name, end_name, swept - approach_steps + approached, swept=swept
+        )
 
-    def _save_meta(self):
+    def _set_home_information(self, home_name, end_name, end_steps, swept=None):
+        """store the result of homing
 
-        file_dict = {}
-        file_dict["positions"] = self.positions
-        file_dict["cur_location"] = self.cur_location
-        file_dict["_dir_increase"] = self._dir_increase
-        file_dict["max_steps"] = self.max_steps
+        Location 0 is `backoff_steps` from the home bound and increases toward
+        the end bound (direction False), the cart is left `backoff_steps` from
+        the end bound
+        """
+        if swept is None:
+            swept = end_steps
+        self._dir_increase = False
+        self.dir_dict[end_name] = {"direction": False, "location": end_steps}
 
-        # "home/pi/dev/saved_positions/trial_0.pickle"
-        storefile = Path(self.stored_loc_path)
-        storefile.parent.mkdir(parents=True, exist_ok=True)
-        storefile.touch(exist_ok=True)
-        with open(storefile, "wb") as fh:
-            pickle.dump(file_dict, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        # ensure each direction uses a different sensor
+        if home_name == end_name:
+            raise ValueError("bounds appear to share same sensor")
 
-    def set_home(self, force=False):
+        # override max_steps
+        self.max_steps = end_steps
+
+        positions = self._measure_markers(swept)
+        if positions:
+            self.positions = positions
+
+        self.cur_location = end_steps - self.backoff_steps
+
+    def _save_state(self, **fields):
+        """journal `fields`, or snapshot the full state if none are given"""
+        if self.store is None:
+            return
+        if fields:
+            self.store.update(**fields)
+            return
+        self.store.save(
+            {
+                "positions": self.positions,
+                "markers": self.markers,
+                "cur_location": self.cur_location,
+                "_dir_increase": self._dir_increase,
+                "max_steps": self.max_steps,
+            }
+        )
+
+    def set_home(self, force=False, verify=None):
         """
         set homing/marker information (from file, if specified). and store to file
+
+        If `verify` (defaults to the `verify` positions config), information
+        from file is checked with `verify_location` and a full homing is only
+        performed if that fails
         """
+        if verify is None:
+            verify = self.verify_from_file
 
         if self.file_data and not force:
             # {"positions": [], "current_position": 0, "_dir_increase": Bool, max_steps, marker}
@@ -204,13 +406,13 @@ class LinearDevice:
                 raise ValueError(
                     f"no max_steps information present in stored {self.stored_loc_path}"
                 )
+            # not in files saved before the markers were measured
+            self.markers = self.file_data.get("markers")
+            if verify and not self.verify_location():
+                print("stored location could not be verified, homing")
+                self._home()
         else:
-            # overwrite max_steps to allow for full track travel (if necessary on reinit)
-            self.max_steps = self.__steps_per_belt
-            self._init_location_information()
-            # TODO: save to file
-            if self.stored_loc_path:
-                self._save_meta()
+            self._home()
         for x in [
             self.positions,
             self.cur_location,
@@ -220,64 +422,159 @@ class LinearDevice:
             if x is None:
                 raise ValueError(f"No {x} information has been set")
 
+    def _home(self):
+        # overwrite max_steps to allow for full track travel (if necessary on reinit)
+        self.max_steps = self.__steps_per_belt
+        with TRACER.span("home", cat="homing", mode=self.homing["mode"]):
+            self._init_location_information()
+        self._save_state()
+
+    def verify_location(self):
+        """confirm (and correct) `cur_location` using the nearest stored marker
+
+        Scans `verify_window` steps either side of the nearest marker, in the
+        same direction as homing, and measures its center from the marker edges.
+        If the offset from the stored position is within `sequence_tolerance`
+        `cur_location` is corrected and True is returned, otherwise False
+        """
+        if not self.positions or self.cur_location is None:
+            return False
+        index = min(
+            self.positions, key=lambda k: abs(self.positions[k] - self.cur_location)
+        )
+        stored = self.positions[index]
+        scan_start = max(stored - self.verify_window, 0)
+        scan_end = min(stored + self.verify_window, math.floor(self.max_steps))
+
+        try:
+            self.move_to_location(scan_start)
+            if self.marker.value:
+                # already over a marker, the stored location is too far off
+                return False
+            start = self.cur_location
+            sign = 1 if scan_end > start else -1
+            self.marker.rezero()
+            self.marker.arm(lambda ticks=None: start + sign * self._step_counter(ticks))
+            try:
+                self.move_to_location(scan_end)
+            finally:
+                self.marker.disarm()
+        except ValueError as e:
+            print(f"unable to verify location: {e}")
+            return False
+
+        if not self.marker.activations or not self.marker.deactivations:
+            return False
+        # a single marker, the stored `markers` of the track are kept
+        measured = self._measure_markers(self.cur_location, keep=False)
+        if len(measured) != 1:
+            return False
+        offset = measured[0] - stored
+        if abs(offset) > self.sequence_tolerance:
+            print(f"marker {index} found {offset} steps from its stored position")
+            return False
+
+        # the cart can only be at whole steps
+        self.cur_location -= round(offset)
+        self._save_state(cur_location=self.cur_location)
+        return True
+
     def _backoff_bound(self, cur_direction):
         opp_direction = not cur_direction
-        for _ in range(self.backoff_steps):
-            self.stepper.step_direction(opp_direction)
-            # TODO: ensure backoff
+        self.stepper.step_n(self.backoff_steps, opp_direction)
+        # TODO: ensure backoff
+
+    def _step_counter(self, ticks=None):
+        # steps taken in the current segment, at the time of the edge if known
+        if ticks is None:
+            return self.stepper.engine.steps
+        return self.stepper.engine.step_at(ticks)
+
+    def _run_to_bound(
+        self, direction, watched, periods=None, max_steps=None, collect_markers=False
+    ):
+        """step toward `watched` bound(s) until one trips (no backoff)
+
+        Returns (a tripped, b tripped, steps taken)
+        """
+        if max_steps is None:
+            max_steps = self.max_steps
+
+        trip = threading.Event()
+        for bound in watched:
+            bound.rezero()
+            bound.arm(self._step_counter, trip)
+            # already at the bound, no edge will fire
+            if bound.value:
+                bound.trips.append(0)
+                trip.set()
+        if collect_markers:
+            self.marker.rezero()
+            self.marker.arm(self._step_counter)
+
+        try:
+            report = self.stepper.step_n(
+                math.ceil(max_steps), direction, periods=periods, abort=trip
+            )
+            if not trip.is_set():
+                raise ValueError("Did not find bounds in max allowed step")
+            self._confirm_trips(watched, report.steps)
+        finally:
+            for bound in watched:
+                bound.disarm()
+                if bound.trips:
+                    BOUND_TRIPS.inc(bound=bound.name, expected="true")
+            self.marker.disarm()
+
+        a_val = self.bound_a in watched and bool(self.bound_a.trips)
+        b_val = self.bound_b in watched and bool(self.bound_b.trips)
+        return (a_val, b_val, report.steps)
+
+    def _confirm_trips(self, bounds, steps):
+        """drop the trips of `bounds` that do not read active once stopped,
+        raises if none is left"""
+        self.stepper.clock.sleep(self.bound_confirm_s)
+        for bound in bounds:
+            if bound.trips and not bound.value:
+                bound.rezero()
+        if not any(bound.trips for bound in bounds):
+            raise ValueError(
+                f"bound trip after {steps} steps could not be confirmed, "
+                f"{[bound.name for bound in bounds]} not active once stopped"
+            )
 
     def _move_to_bound(self, direction, collect_markers=False, prev_bound=None):
-        cur_step = 0
         self.stepper.enable_pin.off()
-        a_val, b_val = False, False
+
+        # only the bound we are looking for stops the move
+        if prev_bound is None:
+            watched = [self.bound_a, self.bound_b]
+        elif prev_bound == "a":
+            watched = [self.bound_b]
+        else:
+            watched = [self.bound_a]
+
         try:
-            while cur_step < self.max_steps:
-                self.stepper.step_direction(direction)
-                cur_step += 1
-                if cur_step % self.pulses_per_step == 0:
-                    # TODO: this logic can likely be improved
-                    if self.bound_a.value or self.bound_b.value:
-                        if prev_bound is not None:
-                            if prev_bound == "a":
-                                if self.bound_b.value:
-                                    print("AT BOUND 2 (B)")
-                                    a_val, b_val = (
-                                        self.bound_a.value,
-                                        self.bound_b.value,
-                                    )
-                                    self._backoff_bound(direction)
-                                    break
-                            else:
-                                if self.bound_a.value:
-                                    a_val, b_val = (
-                                        self.bound_a.value,
-                                        self.bound_b.value,
-                                    )
-                                    print("AT BOUND 2 (A)")
-                                    self._backoff_bound(direction)
-                                    break
-                        else:
-                            print("AT BOUND 1")
-                            a_val, b_val = self.bound_a.value, self.bound_b.value
-                            self._backoff_bound(direction)
-                            break
-                    else:
-                        if collect_markers:
-                            if self.marker.value:
-                                self.marker.activations.append(cur_step)
-
-            if cur_step >= self.max_steps:
-                raise ValueError("Did not find bounds in max allowed step")
+            a_val, b_val, cur_step = self._run_to_bound(
+                direction, watched, collect_markers=collect_markers
+            )
+            if prev_bound is None:
+                print("AT BOUND 1")
+            else:
+                print(f"AT BOUND 2 ({'A' if a_val else 'B'})")
+            self._backoff_bound(direction)
         finally:
             self.stepper.enable_pin.on()
 
-        self.cur_location = 0
-
         return (a_val, b_val, cur_step)
 
     def move_direction(self, num_steps, direction):
         """
         NOTE: the number of steps taken is converted (via round) to an int.
+
+        Steps follow `self.profile` (ramp up, cruise, ramp down) and are handed
+        to the stepper as a single segment, which is aborted by either bound
+        activating
         """
         # turn stepper enable_pin off at start and on at end (opposite logic)
         self.stepper.enable_pin.off()
@@ -298,26 +595,47 @@ class LinearDevice:
                 f"will land at {end_position}, which is outside [0, {self.max_steps}]"
             )
 
-        cur_step = 0
+        trip = threading.Event()
+        for bound in (self.bound_a, self.bound_b):
+            bound.arm(self._step_counter, trip)
+            if bound.value:
+                trip.set()
+
+        start_location = self.cur_location
         try:
-            while cur_step < num_steps:
-                cur_step += 1
-                self.stepper.step_direction(direction)
-                self.cur_location = op(self.cur_location, 1)
-                if cur_step % self.pulses_per_step == 0:
-                    if self.bound_a.value or self.bound_b.value:
-                        raise ValueError(
-                            f"Unexpected bound: or obstacle. cur:{self.cur_location}, [0,{self.max_steps}]"
-                        )
+            report = self.stepper.step_n(
+                num_steps,
+                direction,
+                periods=self.profile.iter_periods(num_steps),
+                abort=trip,
+            )
+            if report.aborted:
+                for bound in (self.bound_a, self.bound_b):
+                    if bound.value:
+                        BOUND_TRIPS.inc(bound=bound.name, expected="false")
+                raise ValueError(
+                    f"Unexpected bound: or obstacle. cur:{op(start_location, report.steps)}, [0,{self.max_steps}]"
+                )
         finally:
+            self.bound_a.disarm()
+            self.bound_b.disarm()
+            # the engine count is live, so this is correct even if interrupted
+            self.cur_location = op(start_location, self.stepper.engine.steps)
             self.stepper.enable_pin.on()
-            self._save_meta()
+            self._save_state(cur_location=self.cur_location)
 
-    def move_to_location(self, location, check_location=False):
+    def move_to_location(self, location, check_location=False, approach=False):
         if self.cur_location is None:
             raise ValueError(
                 f"No current location `cur_location` - device must be homed first (or location set)"
             )
+        segments = []
+        if approach and round(location) < self.cur_location:
+            # approach from below, see `overshoot_steps`
+            below = max(round(location) - self.overshoot_steps, 0)
+            if below < round(location):
+                self.move_to_location(below)
+                segments.extend(self.last_segments)
         num_steps = self.cur_location - location
         if location > self.cur_location:
             dir_to_index = self._dir_increase
@@ -330,7 +648,15 @@ class LinearDevice:
             )
 
         num_steps = abs(num_steps)
-        self.move_direction(num_steps, dir_to_index)
+        with TRACER.span(
+            "move_to_location",
+            cat="linear",
+            start=self.cur_location,
+            location=location,
+            steps=num_steps,
+        ):
+            self.move_direction(num_steps, dir_to_index)
+        self.last_segments = segments + [self.stepper.engine.steps]
 
         if check_location:
             if not self.at_location():
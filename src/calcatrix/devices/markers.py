@@ -0,0 +1,75 @@
+def cluster_edges(rises, falls, tolerance=5, end_step=None):
+    """cluster marker edges into markers in a single pass
+
+    `rises`/`falls` are the (possibly fractional) step counts of the rising and
+    falling edges of the marker sensor. Consecutive active spans separated by
+    no more than `tolerance` steps (e.g. chatter at the edge of a magnet) are
+    merged into one marker. A marker that is already active before the first
+    edge starts at 0, one still active at the end closes at `end_step`.
+
+    Returns a list (ordered by step) of dicts with:
+    - center: (start + end) / 2, not rounded. The fraction is interpolated
+      from the edge times (see `step_at`), it is only as accurate as the
+      timestamps of the edges, which has not been measured on hardware
+    - width: end - start
+    - spans: number of active spans merged into the marker
+    - confidence: 1 for a single clean span of typical (median) width, reduced
+      by chatter and by a width that differs from the median
+    """
+    # edges from a sweep are already ordered, so this is a linear merge of two
+    # sorted runs
+    events = sorted(
+        [(s, True) for s in rises] + [(s, False) for s in falls],
+        key=lambda e: (e[0], e[1]),
+    )
+
+    clusters = []
+    cur = None
+    span_start = None
+    for i, (step, rising) in enumerate(events):
+        if rising:
+            if span_start is None:
+                span_start = step
+            continue
+        if span_start is None:
+            if i != 0:
+                # falling edge without a rise (chatter), ignore
+                continue
+            # already active at the start
+            span_start = 0
+        if cur is not None and span_start - cur["end"] <= tolerance:
+            cur["end"] = step
+            cur["spans"] += 1
+        else:
+            cur = {"start": span_start, "end": step, "spans": 1}
+            clusters.append(cur)
+        span_start = None
+
+    if span_start is not None and end_step is not None:
+        if cur is not None and span_start - cur["end"] <= tolerance:
+            cur["end"] = end_step
+            cur["spans"] += 1
+        else:
+            clusters.append({"start": span_start, "end": end_step, "spans": 1})
+
+    if not clusters:
+        return []
+
+    widths = sorted(c["end"] - c["start"] for c in clusters)
+    median = widths[len(widths) // 2]
+    markers = []
+    for c in clusters:
+        width = c["end"] - c["start"]
+        if median > 0 and width > 0:
+            width_conf = min(width, median) / max(width, median)
+        else:
+            width_conf = 0.0
+        markers.append(
+            {
+                "center": (c["start"] + c["end"]) / 2,
+                "width": width,
+                "spans": c["spans"],
+                "confidence": width_conf / c["spans"],
+            }
+        )
+    return markers
@@ -1,18 +1,22 @@
+import contextlib
 import math
+from collections import deque
 
-from gpiozero import Device  # pylint: disable=import-error
-from gpiozero.pins.native import NativeFactory  # pylint: disable=import-error
-
+from calcatrix.devices.backend import get_backend
 from calcatrix.devices.linear import LinearDevice
-from calcatrix.devices.rotate import Rotator
-
-Device.pin_factory = NativeFactory()
+from calcatrix.metrics.registry import PHASE_SECONDS
+from calcatrix.metrics.trace import TRACER
+from calcatrix.motion.planner import CostModel, plan_route
+from calcatrix.motion.waveform import WaveformEngine
 
 
 class MultiView:
     """Multiview cart
 
     Combines the linear device and a rotator that travels the track
+
+    Both are built by the same backend (`init_config["backend"]`, hardware by
+    default), e.g. {"type": "sim", ...} runs against a simulated rig
     """
 
     def __init__(
@@ -23,8 +27,23 @@ class MultiView:
         name="linear",
     ):
         self.name = name
-        self.linear = LinearDevice(init_config["linear"])
-        self.rotate = Rotator(init_config["rotate"]["pins"])
+        try:
+            backend = init_config["backend"]
+        except KeyError:
+            backend = None
+        self.backend = get_backend(backend)
+        self.linear = LinearDevice(init_config["linear"], backend=self.backend)
+        try:
+            rotate_output = init_config["rotate"]["output"]
+        except KeyError:
+            rotate_output = None
+        try:
+            rotate_profile = init_config["rotate"]["profile"]
+        except KeyError:
+            rotate_profile = None
+        self.rotate = self.backend.rotator(
+            init_config["rotate"]["pins"], output=rotate_output, profile=rotate_profile
+        )
 
         try:
             mm_to_object = init_config["multiview"]["mm_to_object"]
@@ -36,8 +55,43 @@ class MultiView:
         except KeyError:
             angle = 10
 
+        # move the linear device and the rotator at the same time, the
+        # rotator goes straight from view to view (back to 0 at the end of
+        # `follow_all_instructions`) rather than returning to 0 after each
+        try:
+            coordinated = init_config["multiview"]["coordinated"]
+        except KeyError:
+            coordinated = False
+        if coordinated and self.rotate.engine is not None:
+            if isinstance(self.linear.stepper.engine, WaveformEngine):
+                # the daemon plays a single wave at a time
+                raise ValueError(
+                    "coordinated motion is not supported with both the linear "
+                    "device and the rotator using a waveform output"
+                )
+
+        # "sorted": by location, returning the rotator to 0 after each view
+        # "planned": ordered by estimated time (see `calcatrix.motion.planner`)
+        try:
+            route = init_config["multiview"]["route"]
+        except KeyError:
+            route = "sorted"
+        if route not in ("sorted", "planned"):
+            raise ValueError(
+                f"route ({route}) not supported, please select from "
+                f"['sorted', 'planned']"
+            )
+
         self.mm_to_object = mm_to_object
         self.angle = angle
+        self.coordinated = coordinated
+        self.route = route
+        self.cost_model = CostModel.from_devices(
+            self.linear, self.rotate, coordinated=coordinated
+        )
+        # estimated time of the sorted and the planned route
+        self.route_summary = None
+        self.clock = self.backend.clock
 
         self._dist = self._set_angle_dist(self.mm_to_object, self.angle)
         self._angle_a = self.angle / 2
@@ -46,36 +100,273 @@ class MultiView:
         self._view_locations = None
         self.instructions = None
 
+        # per axis timing (s) of the last instruction, and of each instruction
+        # of the last `follow_all_instructions`
+        self.last_timing = None
+        self.timings = []
+        # timings of recent runs, used to `calibrate` the cost model
+        self.timing_history = deque(maxlen=1000)
+
     def initialize(self, force_init=False):
         self._view_locations = self._init_locations(force_init)
         self.instructions = self._create_instructions(self._view_locations)
+        if self.route == "planned":
+            self.instructions, self.route_summary = plan_route(
+                self.instructions,
+                self.cost_model,
+                start_loc=self.linear.cur_location,
+                start_deg=self._cur_degree,
+            )
+
+    @property
+    def _cur_degree(self):
+        return self.rotate.step_angle * self.rotate.deg_per_step
+
+    def calibrate(self):
+        """fit the cost model to the timings of recent runs"""
+        if self.timing_history:
+            self.cost_model.calibrate_timings(self.timing_history)
+        return self.cost_model
 
-    def follow_instruction(self, instruction, func=None):
-        # move to specified location and angle
-        self.linear.move_to_location(instruction["location"])
-        self.rotate.move_to(instruction["rot_degree"])
+    def schedule(self, instructions=None, approach=False):
+        """estimated time (s, from now) at which each instruction is done"""
+        if instructions is None:
+            instructions = self.instructions or []
+        return self.cost_model.schedule(
+            instructions,
+            self.linear.cur_location or 0,
+            self._cur_degree,
+            return_to_zero=not self._direct,
+            approach=approach,
+        )
 
-        # perform function if required
-        ret_value = None
-        if func:
-            if callable(func):
-                ret_value = func(instruction)
+    def estimate(
+        self, mm_to_object=None, angle=None, passes=1, serpentine=True, approach=False
+    ):
+        """estimated duration (s) of a scan, without moving
+
+        The current instructions are used unless `mm_to_object`/`angle` are
+        given, in which case the instructions of that configuration are built
+        from the known marker positions (so configurations can be compared).
+        `passes`, `serpentine` and `approach` are those of `follow_passes`
+        """
+        if mm_to_object is None and angle is None:
+            instructions = self.instructions
+        else:
+            if not self.linear.positions:
+                raise ValueError("No positions present, please initialize")
+            if mm_to_object is None:
+                mm_to_object = self.mm_to_object
+            if angle is None:
+                angle = self.angle
+            dist = self._set_angle_dist(mm_to_object, angle)
+            instructions = self._create_instructions(
+                self._view_locations_from(dist, angle / 2, 360 - angle / 2)
+            )
+            if self.route == "planned":
+                instructions, _ = plan_route(
+                    instructions,
+                    self.cost_model,
+                    start_loc=self.linear.cur_location or 0,
+                    start_deg=self._cur_degree,
+                )
+        if not instructions:
+            raise ValueError("No instructions present")
+
+        start_loc = self.linear.cur_location or 0
+        start_deg = self._cur_degree
+        per_pass = []
+        for i in range(passes):
+            ordered = instructions
+            if serpentine and i % 2 == 1:
+                ordered = instructions[::-1]
+            per_pass.append(
+                self.cost_model.route_time(
+                    ordered,
+                    start_loc,
+                    start_deg,
+                    return_to_zero=not self._direct,
+                    approach=approach,
+                )
+            )
+            start_loc, start_deg = ordered[-1]["location"], 0
+        return {
+            "total_s": sum(per_pass),
+            "per_pass_s": per_pass,
+            "num_views": len(instructions),
+            "capture_s": self.cost_model.capture_s,
+        }
+
+    @property
+    def _direct(self):
+        # rotate straight from view to view during a run
+        return self.coordinated or self.route == "planned"
+
+    def _timed(self, fn, *args):
+        start = self.clock.now_ns()
+        fn(*args)
+        return (self.clock.now_ns() - start) / 1e9
+
+    def follow_instruction(
+        self, instruction, func=None, return_to_zero=True, approach=False, burst=None
+    ):
+        """move to the instruction location and angle then call `func`
+
+        With `coordinated` both axes move at the same time and `func` is
+        called once both have settled. The time (s) taken by each axis, the
+        move (until both settled), `func` and the return to 0 is stored in
+        `last_timing`. `approach` reaches the location from the same side
+        whatever the direction of travel (see `LinearDevice.overshoot_steps`).
+        `burst` (frames per view) is passed to `func` as the instruction's
+        "burst" (see `Photo.capture_burst`)
+        """
+        if burst is not None:
+            instruction = dict(instruction, burst=burst)
+        with TRACER.span(
+            "follow_instruction",
+            cat="multiview",
+            index=instruction.get("index"),
+            view=instruction.get("name"),
+            location=instruction["location"],
+            rot_degree=instruction["rot_degree"],
+        ):
+            start = self.clock.now_ns()
+            start_deg = self._cur_degree
+            timing = {}
+
+            # move to specified location and angle
+            location, angle = instruction["location"], instruction["rot_degree"]
+            if self.coordinated:
+                timing["linear"], timing["rotate"] = self.clock.parallel(
+                    lambda: self.linear.move_to_location(location, approach=approach),
+                    lambda: self.rotate.move_to(angle),
+                )
             else:
-                raise TypeError(f"function {func} is not callable")
+                timing["linear"] = self._timed(
+                    self.linear.move_to_location, location, False, approach
+                )
+                timing["rotate"] = self._timed(self.rotate.move_to, angle)
+            timing["move"] = (self.clock.now_ns() - start) / 1e9
+            # steps actually pulsed (with `approach`, the overshoot and back)
+            timing["linear_segments"] = list(self.linear.last_segments)
+            timing["linear_steps"] = sum(timing["linear_segments"])
+            timing["rotate_deg"] = CostModel.rotation(start_deg, angle)
 
-        # return to zero state
-        self.rotate.move_to(0)
-        return ret_value
+            # perform function if required
+            ret_value = None
+            if func:
+                if callable(func):
+                    func_start = self.clock.now_ns()
+                    ret_value = func(instruction)
+                    timing["func"] = (self.clock.now_ns() - func_start) / 1e9
+                else:
+                    raise TypeError(f"function {func} is not callable")
 
-    def follow_all_instructions(self, func=print):
-        if not self.instructions:
-            raise ValueError(f"No instructions present")
+            # return to zero state
+            if return_to_zero:
+                timing["reset"] = self._timed(self.rotate.move_to, 0)
+            timing["total"] = (self.clock.now_ns() - start) / 1e9
+            self.last_timing = timing
+            PHASE_SECONDS.observe(timing["linear"], phase="move")
+            PHASE_SECONDS.observe(timing["rotate"], phase="rotate")
+            if "reset" in timing:
+                PHASE_SECONDS.observe(timing["reset"], phase="reset")
+            return ret_value
+
+    def follow_all_instructions(
+        self,
+        func=print,
+        should_stop=None,
+        instructions=None,
+        approach=False,
+        burst=None,
+    ):
+        """follow every instruction (`instructions`, defaults to
+        `self.instructions`), in order
+
+        `should_stop()` is called before each instruction, the run ends early
+        (returning the values so far) if it returns True. If `func` is a
+        context manager (e.g. `Photo`, to keep one camera session for the run)
+        it is entered for the whole run, and exited (e.g. pending images
+        written) before returning. `burst` is passed on to `follow_instruction`
+        """
+        if instructions is None:
+            instructions = self.instructions
+        if not instructions:
+            raise ValueError("No instructions present")
+        if hasattr(func, "__enter__") and hasattr(func, "__exit__"):
+            session = func
+        else:
+            session = contextlib.nullcontext()
         return_values = []
-        for instruction in self.instructions:
-            return_value = self.follow_instruction(instruction, func=func)
-            return_values.append(return_value)
+        self.timings = []
+        with session:
+            try:
+                for instruction in instructions:
+                    if should_stop is not None and should_stop():
+                        break
+                    return_value = self.follow_instruction(
+                        instruction,
+                        func=func,
+                        return_to_zero=not self._direct,
+                        approach=approach,
+                        burst=burst,
+                    )
+                    return_values.append(return_value)
+                    self.timings.append(self.last_timing)
+                    self.timing_history.append(self.last_timing)
+            finally:
+                if self._direct:
+                    self.rotate.move_to(0)
         return return_values
 
+    def follow_passes(
+        self,
+        num_passes,
+        func=print,
+        serpentine=True,
+        approach=False,
+        should_stop=None,
+        between=None,
+        burst=None,
+    ):
+        """repeat the scan `num_passes` times (e.g. a timelapse)
+
+        With `serpentine` every other pass runs the instructions in reverse,
+        so each pass starts where the last one ended rather than driving back
+        across the track first. `approach` reaches every location from the
+        same side (see `follow_instruction`), so the positions of the forward
+        and reverse passes match. `between(pass_index)` is called between
+        passes, `burst` is passed on to `follow_instruction`. Returns the
+        values of each pass
+        """
+        if not self.instructions:
+            raise ValueError("No instructions present")
+        if hasattr(func, "__enter__") and hasattr(func, "__exit__"):
+            session = func
+        else:
+            session = contextlib.nullcontext()
+        passes = []
+        with session:
+            for i in range(num_passes):
+                if should_stop is not None and should_stop():
+                    break
+                if i and between is not None:
+                    between(i)
+                instructions = self.instructions
+                if serpentine and i % 2 == 1:
+                    instructions = instructions[::-1]
+                passes.append(
+                    self.follow_all_instructions(
+                        func=func,
+                        should_stop=should_stop,
+                        instructions=instructions,
+                        approach=approach,
+                        burst=burst,
+                    )
+                )
+        return passes
+
     def _set_angle_dist(self, dist, angle):
         travel = math.tan(angle * math.pi / 180) * dist
         return travel
@@ -116,13 +407,16 @@ class MultiView:
         if not self.linear.positions:
             raise ValueError("No positions present")
 
+        return self._view_locations_from(self._dist, self._angle_a, self._angle_b)
+
+    def _view_locations_from(self, dist, angle_a, angle_b):
         view_locs = {}
         for ind, iloc in self.linear.positions.items():
             # NOTE: unsure what the keys should be here
             loc_d = {
-                "a": (iloc - self._dist, self._angle_a),
+                "a": (iloc - dist, angle_a),
                 "0": (iloc, 0),
-                "b": (iloc + self._dist, self._angle_b),
+                "b": (iloc + dist, angle_b),
             }
             view_locs[ind] = loc_d
         return view_locs
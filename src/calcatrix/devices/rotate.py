@@ -1,14 +1,61 @@
-from time import sleep
+import threading
+from bisect import bisect_right
 
-import RPi.GPIO as GPIO  # pylint: disable=import-error
+try:
+    import RPi.GPIO as GPIO  # pylint: disable=import-error
+except (ImportError, RuntimeError):
+    # not on a Pi, a `gpio` must be passed to the Rotator (e.g. simulated)
+    GPIO = None
+
+from calcatrix.metrics.registry import MOVES, STEPS
+from calcatrix.metrics.trace import TRACER
+from calcatrix.motion.profile import MotionProfile
+from calcatrix.motion.pulse import SystemClock
+from calcatrix.motion.waveform import WaveformEngine
+
+# coil levels (P1, P2, P3, P4) of each half step phase, stepping forward
+# through the table turns anti-clockwise, backward clockwise
+PHASES = [
+    (0, 0, 0, 1),
+    (0, 0, 1, 1),
+    (0, 0, 1, 0),
+    (0, 1, 1, 0),
+    (0, 1, 0, 0),
+    (1, 1, 0, 0),
+    (1, 0, 0, 0),
+    (1, 0, 0, 1),
+]
+_OFF = (0, 0, 0, 0)
 
 
 class Rotator(object):
-    def __init__(self, pins):
+    def __init__(
+        self, pins, output=None, gpio=None, clock=None, profile=None, background=True
+    ):
         """Rotator, Half step
         inspired by http://blog.scphillips.com/
+
+        Each half step writes all four coils at once from the `PHASES` table,
+        with the step periods of `profile` (a `MotionProfile`, in half
+        steps/s, 5 rpm without ramping by default).
+
+        `output` selects how the phases are played, by default each phase is
+        written + waited for here (against absolute deadlines),
+        `{"type": "waveform", ...}` uploads the whole move to a waveform
+        daemon. `gpio` (`RPi.GPIO` by default) and `clock` can be replaced by a
+        backend (e.g. the simulated rig).
+
+        `move_to_async` runs the move in a background thread (`wait` for it),
+        with `background=False` (e.g. on a simulated clock) it runs inline.
         """
-        GPIO.setmode(GPIO.BCM)
+        if gpio is None:
+            gpio = GPIO
+        if gpio is None:
+            raise ImportError("RPi.GPIO is not available, please specify a `gpio`")
+        self._gpio = gpio
+        self.clock = clock if clock is not None else SystemClock()
+        self.background = background
+        gpio.setmode(gpio.BCM)
         # set pins
         if not isinstance(pins, list):
             raise TypeError(f"pins is expected to be type {list}, not {type(pins)}")
@@ -20,87 +67,213 @@ class Rotator(object):
         self.P2 = pins[1]
         self.P3 = pins[2]
         self.P4 = pins[3]
+        self.pins = list(pins)
 
         self.deg_per_step = 5.625 / 64
         self.steps_per_rev = int(360 / self.deg_per_step)  # 4096
 
         # TODO: set home, presently it is assumed init position is home
         self.step_angle = 0  # Assume the way it is pointing is zero degrees
+        # index into PHASES of the last phase written
+        self.phase = len(PHASES) - 1
 
         # set pins
         for pin in pins:
-            GPIO.setup(pin, GPIO.OUT)
-            GPIO.output(pin, 0)
+            gpio.setup(pin, gpio.OUT)
+            gpio.output(pin, 0)
+
+        if profile is None:
+            self.rpm = 5
+        elif isinstance(profile, MotionProfile):
+            self.profile = profile
+        else:
+            profile = MotionProfile.from_config(
+                profile, default_velocity=self._rpm_to_velocity(5)
+            )
+            self.profile = profile
 
-        self.rpm = 5
+        self.engine = None
+        if output:
+            try:
+                output_type = output["type"]
+            except KeyError:
+                output_type = "sleep"
+            if output_type == "waveform":
+                kwargs = {k: v for k, v in output.items() if k != "type"}
+                self.engine = WaveformEngine(self.P1, **kwargs)
+                for pin in pins:
+                    self.engine.client.set_output(pin)
+            elif output_type != "sleep":
+                raise ValueError(
+                    f"output type ({output_type}) not supported, please select from "
+                    f"['sleep', 'waveform']"
+                )
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._error = None
+        # time (s) taken by the last move
+        self.last_duration = 0.0
+
+    def _rpm_to_velocity(self, rpm):
+        return rpm * self.steps_per_rev / 60.0
 
     def _set_rpm(self, rpm):
-        """Set the turn speed in RPM."""
-        self._rpm = rpm
-        # _T is the amount of time to stop between signals
-        self._T = (60.0 / rpm) / self.steps_per_rev
+        """Set the turn speed in RPM (constant, no ramping)."""
+        self.profile = MotionProfile(max_velocity=self._rpm_to_velocity(rpm))
 
-    rpm = property(lambda self: self._rpm, _set_rpm)
+    rpm = property(
+        lambda self: self.profile.max_velocity * 60.0 / self.steps_per_rev, _set_rpm
+    )
 
-    def move_to(self, angle):
-        """Take the shortest route to a particular angle (degrees)."""
-        # Make sure there is a 1:1 mapping between angle and stepper angle
-        # TODO: 8*n where n = n/8 ??
-        target_step_angle = 8 * (int(angle / self.deg_per_step) / 8)
-        steps = target_step_angle - self.step_angle
-        steps = steps % self.steps_per_rev
+    @property
+    def _T(self):
+        # time between half steps at full speed
+        return 1 / self.profile.max_velocity
+
+    @property
+    def busy(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _steps_to(self, angle):
+        """signed half steps of the shortest route to `angle` (degrees),
+        positive is clockwise"""
+        target_step_angle = int(angle / self.deg_per_step) % self.steps_per_rev
+        steps = (target_step_angle - self.step_angle) % self.steps_per_rev
         if steps > self.steps_per_rev / 2:
             steps -= self.steps_per_rev
-            self._move_acw(-steps // 8)
-        else:
-            self._move_cw(steps // 8)
-        self.step_angle = target_step_angle
+        return steps
 
-        # clear
-        self.__clear()
+    def move_to(self, angle):
+        """Take the shortest route to a particular angle (degrees)."""
+        with TRACER.span(
+            "Rotator.move_to",
+            cat="rotate",
+            start=self.step_angle * self.deg_per_step,
+            angle=angle,
+        ):
+            self.move_to_async(angle)
+            self.wait()
+
+    def move_to_async(self, angle):
+        """start moving to `angle` (degrees) and return, see `wait`
+
+        A move already in progress is finished first
+        """
+        self.wait()
+        steps = self._steps_to(angle)
+        self._stop.clear()
+        self._error = None
+        if not self.background:
+            self._move(steps)
+            return self
+        self._thread = threading.Thread(
+            target=self._run, args=(steps,), name="rotator", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def _run(self, steps):
+        try:
+            self._move(steps)
+        except BaseException as e:  # pylint: disable=broad-except
+            self._error = e
+
+    def wait(self, timeout=None):
+        """wait for the current move, re-raises an error from the move
+
+        Returns False if still moving after `timeout` seconds
+        """
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                return False
+            self._thread = None
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise err
+        return True
+
+    def stop(self):
+        """end the current move early (at the current phase)"""
+        self._stop.set()
+        return self.wait()
+
+    def _move(self, steps):
+        start = self.clock.now_ns()
+        direction = -1 if steps > 0 else 1
+        num_steps = abs(steps)
+        try:
+            if num_steps:
+                if self.engine is None:
+                    done = self._play_gpio(num_steps, direction)
+                else:
+                    done = self._play_wave(num_steps, direction)
+                self.step_angle = (
+                    self.step_angle - direction * done
+                ) % self.steps_per_rev
+                MOVES.inc(device="rotator")
+                STEPS.inc(done, device="rotator")
+        finally:
+            self.__clear()
+            self.last_duration = (self.clock.now_ns() - start) / 1e9
+
+    def _phases(self, num_steps, direction):
+        phase = self.phase
+        n = len(PHASES)
+        for _ in range(num_steps):
+            phase = (phase + direction) % n
+            yield phase
+
+    def _play_gpio(self, num_steps, direction):
+        output, pins = self._gpio.output, self.pins
+        clock, stop = self.clock, self._stop
+        done = 0
+        deadline = clock.now_ns()
+        periods = self.profile.iter_periods(num_steps)
+        for phase, period in zip(self._phases(num_steps, direction), periods):
+            if stop.is_set():
+                break
+            output(pins, PHASES[phase])
+            self.phase = phase
+            done += 1
+            deadline += int(period * 1e9)
+            clock.wait_until(deadline)
+        return done
+
+    def _play_wave(self, num_steps, direction):
+        bits = [1 << pin for pin in self.pins]
+        pulses = []
+        ends = []
+        total = 0
+        phases = list(self._phases(num_steps, direction))
+        for phase, period in zip(phases, self.profile.iter_periods(num_steps)):
+            on_mask = off_mask = 0
+            for bit, level in zip(bits, PHASES[phase]):
+                if level:
+                    on_mask |= bit
+                else:
+                    off_mask |= bit
+            delay_us = int(period * 1e6)
+            pulses.append((on_mask, off_mask, delay_us))
+            total += delay_us * 1000
+            ends.append(total)
+        completed, elapsed = self.engine.play(
+            pulses, ends=ends, should_stop=lambda done: self._stop.is_set()
+        )
+        done = num_steps if completed else min(bisect_right(ends, elapsed), num_steps)
+        if done:
+            self.phase = phases[done - 1]
+        return done
 
     def __clear(self):
-        GPIO.output(self.P1, 0)
-        GPIO.output(self.P2, 0)
-        GPIO.output(self.P3, 0)
-        GPIO.output(self.P4, 0)
-
-    def _move_acw(self, big_steps):
-        self.__clear()
-        for _ in range(int(big_steps)):
-            GPIO.output(self.P1, 0)
-            sleep(self._T)
-            GPIO.output(self.P3, 1)
-            sleep(self._T)
-            GPIO.output(self.P4, 0)
-            sleep(self._T)
-            GPIO.output(self.P2, 1)
-            sleep(self._T)
-            GPIO.output(self.P3, 0)
-            sleep(self._T)
-            GPIO.output(self.P1, 1)
-            sleep(self._T)
-            GPIO.output(self.P2, 0)
-            sleep(self._T)
-            GPIO.output(self.P4, 1)
-            sleep(self._T)
-
-    def _move_cw(self, big_steps):
-        self.__clear()
-        for _ in range(int(big_steps)):
-            GPIO.output(self.P3, 0)
-            sleep(self._T)
-            GPIO.output(self.P1, 1)
-            sleep(self._T)
-            GPIO.output(self.P4, 0)
-            sleep(self._T)
-            GPIO.output(self.P2, 1)
-            sleep(self._T)
-            GPIO.output(self.P1, 0)
-            sleep(self._T)
-            GPIO.output(self.P3, 1)
-            sleep(self._T)
-            GPIO.output(self.P2, 0)
-            sleep(self._T)
-            GPIO.output(self.P4, 1)
-            sleep(self._T)
+        if self.engine is not None:
+            # the daemon drives the pins in waveform mode, a wave can leave
+            # coils energized
+            for pin in self.pins:
+                self.engine.client.write(pin, 0)
+        self._gpio.output(self.pins, _OFF)
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.__dict__}"
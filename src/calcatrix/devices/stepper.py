@@ -1,42 +1,137 @@
-import time
+from itertools import islice, repeat
 
-from gpiozero import Device, DigitalOutputDevice  # pylint: disable=import-error
+from calcatrix.metrics.registry import MOVES, PULSE_LATENESS, STEPS
+from calcatrix.motion.pulse import SystemClock
+from calcatrix.motion.waveform import build_engine
 
 
 class Stepper:
-    """stepper"""
+    """stepper
+
+    `pin_cls` builds the dir/step/enable outputs from their pin numbers
+    (`gpiozero.DigitalOutputDevice` by default) and `clock` is used for all
+    timing, both can be replaced by a backend (e.g. the simulated rig)
+    """
 
     def __init__(
         self,
         # init params
         init_config,
         name="stepper",
+        pin_cls=None,
+        clock=None,
     ):
+        if pin_cls is None:
+            from gpiozero import DigitalOutputDevice  # pylint: disable=import-error
+
+            pin_cls = DigitalOutputDevice
         self.name = name
-        self.dir_pin = DigitalOutputDevice(init_config["dir"])
-        self.step_pin = DigitalOutputDevice(init_config["step"])
-        self.enable_pin = DigitalOutputDevice(init_config["enable"])
-        self.pulse_width = 0.0015
-        self.time_between = 0.001
+        self.clock = clock if clock is not None else SystemClock()
+        self.dir_pin = pin_cls(init_config["dir"])
+        self.step_pin = pin_cls(init_config["step"])
+        self.enable_pin = pin_cls(init_config["enable"])
+        try:
+            self.pulse_width = init_config["pulse_width"]
+        except KeyError:
+            self.pulse_width = 0.0015
+        try:
+            self.time_between = init_config["time_between"]
+        except KeyError:
+            self.time_between = 0.001
+
+        # bulk pulse output, see `step_n`. By default pulses are timed in
+        # process, {"type": "waveform", ...} hands them to a waveform daemon
+        try:
+            output_config = init_config["output"]
+        except KeyError:
+            output_config = None
+        self.engine = build_engine(
+            output_config, init_config["step"], self.step_pin, clock=self.clock
+        )
+        self.last_report = None
 
         # ensure stepper off
         self.enable_pin.on()
 
-    def _step(self):
+    @property
+    def default_velocity(self):
+        """steps/s of the fixed (un-profiled) step timing"""
+        return 1 / (self.pulse_width + self.time_between)
+
+    def _step(self, pulse_width=None):
+        if pulse_width is None:
+            pulse_width = self.pulse_width
         self.step_pin.on()
-        time.sleep(self.pulse_width)
+        self.clock.sleep(pulse_width)
         self.step_pin.off()
 
-    def step_direction(self, direction=True):
+    def step_direction(self, direction=True, period=None):
+        """take a single step
+
+        `period` is the full step period (seconds), as produced by a
+        `MotionProfile`. If not set the fixed `pulse_width` + `time_between` is
+        used. The pulse is kept to at most half of the period. Single steps
+        are not counted in the metrics (see `step_n`).
+        """
         # set direction
         if direction:
             self.dir_pin.on()
         else:
             self.dir_pin.off()
-        # take step
-        self._step()
-        # sleep between steps
-        time.sleep(self.time_between)
+        if period is None:
+            # take step
+            self._step()
+            # sleep between steps
+            self.clock.sleep(self.time_between)
+        else:
+            pulse_width = min(self.pulse_width, period / 2)
+            self._step(pulse_width)
+            self.clock.sleep(period - pulse_width)
+
+    def step_n(
+        self,
+        num_steps,
+        direction=True,
+        periods=None,
+        should_stop=None,
+        check_every=1,
+        abort=None,
+    ):
+        """take `num_steps` steps in one direction
+
+        The direction is set once and the pulses are output by `self.engine`.
+        `periods` is the step period (seconds) of each step (e.g. from
+        `MotionProfile.iter_periods`), if not set the fixed `pulse_width` +
+        `time_between` is used. `should_stop(steps)` is called every
+        `check_every` steps and ends the move early if it returns True, setting
+        `abort` (a `threading.Event`) ends it before the next step.
+
+        Returns a `PulseReport` (also stored as `last_report`)
+        """
+        num_steps = int(num_steps)
+        if direction:
+            self.dir_pin.on()
+        else:
+            self.dir_pin.off()
+        if periods is None:
+            periods = repeat(self.pulse_width + self.time_between, num_steps)
+        else:
+            periods = islice(periods, num_steps)
+        report = self.engine.run(
+            periods,
+            self.pulse_width,
+            should_stop=should_stop,
+            check_every=check_every,
+            abort=abort,
+        )
+        self.last_report = report
+        # recorded once per move, from the report (not in the step loop)
+        MOVES.inc(device=self.name)
+        STEPS.inc(report.steps, device=self.name)
+        PULSE_LATENESS.observe_many(
+            [late / 1e9 for late in report.lateness_ns], device=self.name
+        )
+        return report
 
     def __repr__(self):
         return str(self.__class__.__name__) + ": " + f"{self.__dict__}"
@@ -0,0 +1,126 @@
+"""Stream images as a tar or zip archive
+
+`stream_archive(paths, fmt)` is a generator of byte chunks (e.g. for a
+streamed HTTP response). Each file is read `chunk_size` bytes at a time and
+the archive is produced as it is read, nothing is built in memory or on disk
+first (memory stays at about one chunk whatever the number of images).
+
+Images are stored uncompressed (jpeg is already compressed). Missing files
+(e.g. removed since they were listed) are skipped.
+"""
+
+import os
+import tarfile
+import time
+import zipfile
+
+FORMATS = {
+    "tar": "application/x-tar",
+    "zip": "application/zip",
+}
+
+_BLOCK = tarfile.BLOCKSIZE
+
+
+class _Sink:
+    """unseekable file object collecting what is written until `drain`"""
+
+    def __init__(self):
+        self._chunks = []
+        self._written = 0
+
+    def write(self, data):
+        if data:
+            self._chunks.append(bytes(data))
+            self._written += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._written
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _open(path):
+    try:
+        fh = open(path, "rb")
+    except FileNotFoundError:
+        return None, None
+    return fh, os.fstat(fh.fileno())
+
+
+def _iter_file(fh, chunk_size):
+    for chunk in iter(lambda: fh.read(chunk_size), b""):
+        yield chunk
+
+
+def stream_tar(paths, chunk_size=1 << 16):
+    for path in paths:
+        fh, st = _open(path)
+        if fh is None:
+            continue
+        with fh:
+            info = tarfile.TarInfo(os.path.basename(path))
+            info.size = st.st_size
+            info.mtime = int(st.st_mtime)
+            info.mode = 0o644
+            yield info.tobuf(format=tarfile.PAX_FORMAT)
+            sent = 0
+            for chunk in _iter_file(fh, chunk_size):
+                # the size in the header is final, even if the file grows
+                chunk = chunk[: info.size - sent]
+                sent += len(chunk)
+                yield chunk
+                if sent >= info.size:
+                    break
+            if sent < info.size:
+                # the file shrank while being read
+                raise OSError(f"{path} changed size while being archived")
+            remainder = info.size % _BLOCK
+            if remainder:
+                yield b"\0" * (_BLOCK - remainder)
+    # end of archive: two zero blocks
+    yield b"\0" * (2 * _BLOCK)
+
+
+def stream_zip(paths, chunk_size=1 << 16):
+    sink = _Sink()
+    # an unseekable output: sizes/crc are written in data descriptors
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as zf:
+        for path in paths:
+            fh, st = _open(path)
+            if fh is None:
+                continue
+            with fh:
+                info = zipfile.ZipInfo(
+                    os.path.basename(path),
+                    date_time=time.localtime(st.st_mtime)[:6],
+                )
+                info.compress_type = zipfile.ZIP_STORED
+                with zf.open(info, "w", force_zip64=True) as dest:
+                    for chunk in _iter_file(fh, chunk_size):
+                        dest.write(chunk)
+                        yield sink.drain()
+            yield sink.drain()
+    # central directory
+    yield sink.drain()
+
+
+def stream_archive(paths, fmt="tar", chunk_size=1 << 16):
+    """byte chunks of a `fmt` ("tar" or "zip") archive of `paths`"""
+    if fmt == "tar":
+        chunks = stream_tar(paths, chunk_size)
+    elif fmt == "zip":
+        chunks = stream_zip(paths, chunk_size)
+    else:
+        raise ValueError(
+            f"archive format ({fmt}) not supported, please select from "
+            f"{list(FORMATS)}"
+        )
+    return (chunk for chunk in chunks if chunk)
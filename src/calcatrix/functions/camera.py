@@ -0,0 +1,159 @@
+import time
+
+
+class PiCameraSession:
+    """long lived `PiCamera`
+
+    `open()` starts the camera and waits `warmup` seconds for the sensor gain,
+    exposure and white balance to converge. With `lock` the converged exposure
+    and white balance are then fixed, so every image of a run matches (and no
+    further settling is needed between shots). `close()` releases the camera.
+    """
+
+    def __init__(self, resolution=None, warmup=2.0, lock=True, preview=True):
+        self.resolution = resolution
+        self.warmup = warmup
+        self.lock = lock
+        self.preview = preview
+        self.camera = None
+
+    @property
+    def is_open(self):
+        return self.camera is not None
+
+    def open(self):
+        if self.camera is not None:
+            return self
+        from picamera import PiCamera  # pylint: disable=import-error
+
+        camera = PiCamera()
+        try:
+            if self.resolution:
+                camera.resolution = self.resolution
+            if self.preview:
+                camera.start_preview()
+            time.sleep(self.warmup)
+            if self.lock:
+                self._lock(camera)
+        except:
+            camera.close()
+            raise
+        self.camera = camera
+        return self
+
+    def _lock(self, camera):
+        camera.shutter_speed = camera.exposure_speed
+        camera.exposure_mode = "off"
+        gains = camera.awb_gains
+        camera.awb_mode = "off"
+        camera.awb_gains = gains
+
+    def capture(self, output):
+        """capture an image to `output` (a path or a writable file object)"""
+        if self.camera is None:
+            raise ValueError("camera session is not open, please call open()")
+        self.camera.capture(output, format="jpeg")
+
+    def capture_sequence(self, outputs, use_video_port=True):
+        """capture one image per output, back to back
+
+        From the video port by default (continuous frames, no mode switch or
+        re-metering between images, at the cost of some image quality)
+        """
+        if self.camera is None:
+            raise ValueError("camera session is not open, please call open()")
+        self.camera.capture_sequence(
+            outputs, format="jpeg", use_video_port=use_video_port
+        )
+
+    def close(self):
+        camera, self.camera = self.camera, None
+        if camera is None:
+            return
+        try:
+            if self.preview:
+                camera.stop_preview()
+        finally:
+            camera.close()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.__dict__}"
+
+
+class FakeCamera:
+    """camera session that writes a fixed image, for running without a Pi
+
+    Keeps count of `opens`/`closes` and the `captures` made, `warmup` (s) is
+    slept on open like a real camera
+    """
+
+    # smallest valid jpeg (1x1 px)
+    IMAGE = bytes.fromhex(
+        "ffd8ffe000104a46494600010100000100010000ffdb004300080606070605080707"
+        "070909080a0c140d0c0b0b0c1912130f141d1a1f1e1d1a1c1c20242e2720222c231c"
+        "1c2837292c30313434341f27393d38323c2e333432ffc0000b080001000101011100"
+        "ffc4001f0000010501010101010100000000000000000102030405060708090a0bff"
+        "c400b5100002010303020403050504040000017d01020300041105122131410613516"
+        "107227114328191a1082342b1c11552d1f02433627282090a161718191a25262728"
+        "292a3435363738393a434445464748494a535455565758595a636465666768696a73"
+        "7475767778797a838485868788898a92939495969798999aa2a3a4a5a6a7a8a9aab2"
+        "b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2e3e4e5e6e7e8"
+        "e9eaf1f2f3f4f5f6f7f8f9faffda0008010100003f00fbd3ffd9"
+    )
+
+    def __init__(self, warmup=0.0, image=None):
+        self.warmup = warmup
+        self.image = image if image is not None else self.IMAGE
+        self.opens = 0
+        self.closes = 0
+        self.captures = []
+        self._open = False
+
+    @property
+    def is_open(self):
+        return self._open
+
+    def open(self):
+        if not self._open:
+            time.sleep(self.warmup)
+            self._open = True
+            self.opens += 1
+        return self
+
+    def capture(self, output):
+        if not self._open:
+            raise ValueError("camera session is not open, please call open()")
+        if isinstance(output, str):
+            with open(output, "wb") as fh:
+                fh.write(self.image)
+        else:
+            output.write(self.image)
+        self.captures.append(output)
+
+    def capture_sequence(self, outputs, use_video_port=True):
+        for output in outputs:
+            self.capture(output)
+
+    def close(self):
+        if self._open:
+            self._open = False
+            self.closes += 1
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return (
+            str(self.__class__.__name__)
+            + ": "
+            + f"opens={self.opens}, captures={len(self.captures)}"
+        )
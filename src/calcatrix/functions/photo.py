@@ -1,15 +1,100 @@
+import io
+import os
+import threading
 import time
 from datetime import datetime
 
-from picamera import PiCamera  # pylint: disable=import-error
+from calcatrix.functions.camera import PiCameraSession
+from calcatrix.functions.writer import ImageWriter
+from calcatrix.metrics.registry import CAPTURE_FAILURES, PHASE_SECONDS
+from calcatrix.metrics.trace import TRACER
+from calcatrix.state.catalog import checksum, file_checksum
 
 
 class Photo:
-    def __init__(self, base_path="/home/pi/dev/imgs"):
+    """capture an image per instruction
+
+    `camera` is a camera session (`PiCameraSession` by default, see
+    `calcatrix.functions.camera`). Used as a context manager (e.g. by
+    `MultiView.follow_all_instructions`) the session is opened, warmed up and
+    locked once and reused for every image until exit, called outside of one
+    the camera is opened for that single image.
+
+    Images are captured (jpeg) to memory and written by a background
+    `ImageWriter` (at most `max_pending` waiting), so the cart can move on
+    while the previous image is written. The file path is returned right away,
+    every image is on disk once the (outermost) context exits. `max_pending=0`
+    captures straight to the file instead.
+
+    With a `catalog` (`calcatrix.state.catalog.ImageCatalog`) each image is
+    added (fields, size, checksum) once it is on disk, with `thumbnails`
+    (`calcatrix.functions.thumbnail.ThumbnailCache`) its preview is then made
+    in the background.
+
+    With `burst` > 1 (or an instruction "burst") `burst` frames are captured
+    back to back per instruction (see `capture_burst`) and the list of their
+    paths is returned.
+
+    File names only have second resolution, images of the same view within
+    one second are told apart by a sequence number (see `_file_paths`), an
+    existing file is never overwritten.
+    """
+
+    def __init__(
+        self,
+        base_path="/home/pi/dev/imgs",
+        camera=None,
+        max_pending=4,
+        catalog=None,
+        thumbnails=None,
+        burst=1,
+    ):
+        if not isinstance(burst, int) or burst <= 0:
+            raise ValueError(f"please set `burst` to a positive int, not {burst}")
         self.img_template = "{}__{}__{}__{}__{}.jpg"
+        # frames of a burst (and images of a view taken within the same
+        # second) share the timestamp, `seq` keeps them apart
+        self.burst_template = "{}__{}__{}__{}__{}__{:03d}.jpg"
         self.base_path = base_path
+        self.camera = camera if camera is not None else PiCameraSession()
+        self.writer = ImageWriter(max_pending) if max_pending else None
+        self.catalog = catalog
+        self.thumbnails = thumbnails
+        self.burst = burst
+        self._depth = 0
+        # names given out in the current second, see `_file_paths`
+        self._lock = threading.Lock()
+        self._second = None
+        self._issued = {}
 
-    def __call__(self, instruction):
+    def __enter__(self):
+        if self._depth == 0:
+            start = time.perf_counter()
+            with TRACER.span("camera.warmup", cat="camera"):
+                self.camera.open()
+            # warmup, exposure/white balance converging
+            PHASE_SECONDS.observe(time.perf_counter() - start, phase="settle")
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                self.camera.close()
+            finally:
+                if self.writer is not None:
+                    self.writer.flush()
+
+    def close(self):
+        self._depth = 0
+        try:
+            self.camera.close()
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+
+    def _fields(self, instruction):
         try:
             index = instruction["index"]
         except KeyError:
@@ -32,19 +117,176 @@ class Photo:
             name = instruction["name"]
         except KeyError:
             name = 0
+        return {
+            "index": index,
+            "name": name,
+            "location": location,
+            "rot_degree": rot_degree,
+        }
 
+    def _file_path(self, fields, captured_at, seq=None):
         # e.g. '01_01_2021__17_13_18'
-        ts = datetime.now().strftime("%m_%d_%Y__%H_%M_%S")
-        filename = self.img_template.format(index, name, location, rot_degree, ts)
-        filepath = f"{self.base_path}/{filename}"
+        ts = datetime.fromtimestamp(captured_at).strftime("%m_%d_%Y__%H_%M_%S")
+        values = (
+            fields["index"],
+            fields["name"],
+            fields["location"],
+            fields["rot_degree"],
+            ts,
+        )
+        if seq is None:
+            filename = self.img_template.format(*values)
+        else:
+            filename = self.burst_template.format(*values, seq)
+        return f"{self.base_path}/{filename}"
+
+    def _file_paths(self, fields, captured_at, frames=None):
+        """unused file paths for one image (`frames` None) or a burst
+
+        The first single image of a view in a second gets the plain name,
+        later ones (and bursts, continuing after the last sequence number
+        given out) get the next sequence numbers. Names of files already on
+        disk are skipped
+        """
+        key = (fields["index"], fields["name"], fields["location"])
+        key += (fields["rot_degree"],)
+        with self._lock:
+            second = int(captured_at)
+            if second != self._second:
+                self._second = second
+                self._issued = {}
+            plain, seq = self._issued.get(key, (False, 0))
+            paths = []
+            if frames is None and not plain:
+                path = self._file_path(fields, captured_at)
+                if not os.path.exists(path):
+                    plain = True
+                    paths.append(path)
+            while len(paths) < (frames or 1):
+                path = self._file_path(fields, captured_at, seq)
+                seq += 1
+                if not os.path.exists(path):
+                    paths.append(path)
+            self._issued[key] = (plain, seq)
+        return paths
+
+    def _recorder(self, fields, captured_at):
+        # called once the image is on disk (`data` is None if captured
+        # straight to the file)
+        if self.catalog is None and self.thumbnails is None:
+            return None
+
+        def _record(path, data=None):
+            if self.catalog is not None:
+                if data is None:
+                    size, digest = os.path.getsize(path), file_checksum(path)
+                else:
+                    size, digest = len(data), checksum(data)
+                self.catalog.add(
+                    path, size=size, digest=digest, captured_at=captured_at, **fields
+                )
+            if self.thumbnails is not None:
+                self.thumbnails.submit(path, data)
+
+        return _record
+
+    def _capture(self, instruction, to_memory, save):
+        fields = self._fields(instruction)
+        captured_at = time.time()
+        if save:
+            # the catalog takes `seq` (if any) from the file name
+            (filepath,) = self._file_paths(fields, captured_at)
+        else:
+            filepath = self._file_path(fields, captured_at)
+        done = self._recorder(fields, captured_at) if save else None
+        data = None
 
         # capture image
-        with PiCamera() as camera:
-            camera.start_preview()
-            time.sleep(2)
+        with self:
+            start = time.perf_counter()
             try:
-                camera.capture(filepath)
-            finally:
-                camera.stop_preview()
+                with TRACER.span("capture", cat="camera", path=filepath):
+                    if to_memory:
+                        buf = io.BytesIO()
+                        self.camera.capture(buf)
+                        data = buf.getvalue()
+                    else:
+                        self.camera.capture(filepath)
+            except Exception:
+                CAPTURE_FAILURES.inc(stage="capture")
+                raise
+            PHASE_SECONDS.observe(time.perf_counter() - start, phase="capture")
+            if not save:
+                filepath = None
+            elif data is None:
+                if done is not None:
+                    done(filepath)
+            elif self.writer is not None:
+                self.writer.submit(filepath, data, done)
+            else:
+                with open(filepath, "wb") as fh:
+                    fh.write(data)
+                if done is not None:
+                    done(filepath, data)
+        return filepath, data
 
+    def __call__(self, instruction):
+        try:
+            frames = instruction["burst"]
+        except KeyError:
+            frames = self.burst
+        if frames > 1:
+            return self.capture_burst(instruction, frames)
+        filepath, _ = self._capture(
+            instruction, to_memory=self.writer is not None, save=True
+        )
         return filepath
+
+    def capture_burst(self, instruction, frames=None):
+        """capture `frames` (default `burst`) images back to back, from the
+        camera's video port (see `capture_sequence`) in one open session
+
+        The frames are named with the shared timestamp and their sequence
+        number (`..__{seq:03d}.jpg`, following any burst of the same view in
+        the same second). Returns the list of paths, in order
+        """
+        if frames is None:
+            frames = self.burst
+        if not isinstance(frames, int) or frames <= 0:
+            raise ValueError(f"please set `frames` to a positive int, not {frames}")
+        fields = self._fields(instruction)
+        captured_at = time.time()
+        paths = self._file_paths(fields, captured_at, frames)
+        to_memory = self.writer is not None
+        outputs = [io.BytesIO() for _ in paths] if to_memory else paths
+
+        with self:
+            start = time.perf_counter()
+            try:
+                with TRACER.span(
+                    "capture_burst", cat="camera", path=paths[0], frames=frames
+                ):
+                    self.camera.capture_sequence(outputs)
+            except Exception:
+                CAPTURE_FAILURES.inc(frames, stage="capture")
+                raise
+            PHASE_SECONDS.observe(time.perf_counter() - start, phase="capture")
+            for path, output in zip(paths, outputs):
+                done = self._recorder(fields, captured_at)
+                if to_memory:
+                    self.writer.submit(path, output.getvalue(), done)
+                elif done is not None:
+                    done(path)
+        return paths
+
+    def capture_bytes(self, instruction, save=True):
+        """capture to memory and return (file path, jpeg bytes)
+
+        For returning the image straight to a client: with `save` the image is
+        also written (in the background, see `ImageWriter`), otherwise it is
+        never written to disk and the file path is None
+        """
+        return self._capture(instruction, to_memory=True, save=save)
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.__dict__}"
@@ -0,0 +1,192 @@
+"""Downscaled previews of the captured images
+
+`ThumbnailCache` keeps jpeg thumbnails in `cache_dir`, bounded to
+`max_bytes` with least recently used eviction (the order survives restarts,
+each access touches the file's mtime). Thumbnails are made by a background
+thread after each capture (`submit`, see `Photo(thumbnails=...)`) and lazily
+on `get` when missing (e.g. evicted, or skipped because the worker was busy).
+
+Requires Pillow (imported when the first thumbnail is made). JPEG sources
+are decoded at a reduced scale (`Image.draft`), which is much cheaper than
+decoding the full resolution image and resizing it.
+"""
+
+import io
+import os
+import queue
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+def render(source, dest, size=(320, 240), quality=75):
+    """write a thumbnail (at most `size`) of `source` (a path or the encoded
+    image bytes) to `dest`"""
+    from PIL import Image  # pylint: disable=import-error
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        # let the jpeg decoder scale down (by 1/2, 1/4 or 1/8)
+        img.draft("RGB", size)
+        img = img.convert("RGB")
+        img.thumbnail(size)
+        tmp = f"{dest}.{threading.get_ident()}.tmp"
+        img.save(tmp, format="JPEG", quality=quality)
+    os.replace(tmp, dest)
+
+
+class ThumbnailCache:
+    def __init__(
+        self,
+        cache_dir,
+        max_bytes=64 * 1024 * 1024,
+        size=(320, 240),
+        quality=75,
+        max_pending=8,
+    ):
+        if not isinstance(max_bytes, int) or max_bytes <= 0:
+            raise ValueError(
+                f"please set `max_bytes` to a positive int, not {max_bytes}"
+            )
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.size = tuple(size)
+        self.quality = quality
+
+        self._lock = threading.Lock()
+        # file name -> size (bytes), least recently used first
+        self._entries = OrderedDict()
+        self.total_bytes = 0
+        self._load()
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self.errors = []
+        self.made = 0
+        self.evicted = 0
+        # captures not queued because the worker was behind (made lazily)
+        self.skipped = 0
+
+    def _load(self):
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith(".tmp"):
+                    # left by an interrupted render
+                    os.remove(entry.path)
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._entries[name] = size
+            self.total_bytes += size
+        self._evict()
+
+    def _path(self, name):
+        return self.cache_dir.joinpath(name)
+
+    def _add(self, name):
+        size = self._path(name).stat().st_size
+        with self._lock:
+            self.total_bytes += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            self.made += 1
+        self._evict()
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if self.total_bytes <= self.max_bytes or len(self._entries) <= 1:
+                    return
+                name, size = self._entries.popitem(last=False)
+                self.total_bytes -= size
+                self.evicted += 1
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    def _make(self, name, source):
+        render(source, self._path(name), self.size, self.quality)
+        self._add(name)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._work, name="thumbnails", daemon=True
+                )
+                self._thread.start()
+        return self
+
+    def submit(self, path, data=None):
+        """make the thumbnail of `path` in the background (from `data`, its
+        encoded bytes, if given). Never blocks: if the worker is behind the
+        thumbnail is skipped and made on the first `get`"""
+        self.start()
+        try:
+            self._queue.put_nowait((Path(path).name, data if data else path))
+        except queue.Full:
+            self.skipped += 1
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._make(*item)
+            except Exception as e:  # pylint: disable=broad-except
+                # keep the last few, the thumbnail is retried on `get`
+                self.errors = self.errors[-9:] + [e]
+            finally:
+                self._queue.task_done()
+
+    def get(self, path):
+        """path of the thumbnail of the image at `path`, made if missing"""
+        name = Path(path).name
+        thumb = self._path(name)
+        with self._lock:
+            cached = name in self._entries
+            if cached:
+                self._entries.move_to_end(name)
+        if cached and thumb.is_file():
+            # the lru order is kept on disk as the mtime
+            os.utime(thumb)
+            return thumb
+        self._make(name, path)
+        return thumb
+
+    def discard(self, path):
+        """remove the thumbnail of `path` (e.g. the image was removed)"""
+        name = Path(path).name
+        with self._lock:
+            size = self._entries.pop(name, None)
+            if size is not None:
+                self.total_bytes -= size
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def __repr__(self):
+        return (
+            str(self.__class__.__name__)
+            + ": "
+            + f"entries={len(self._entries)}, bytes={self.total_bytes}, "
+            f"made={self.made}, evicted={self.evicted}, skipped={self.skipped}"
+        )
@@ -0,0 +1,92 @@
+import queue
+import threading
+import time
+
+from calcatrix.metrics.registry import CAPTURE_FAILURES, IMAGES_WRITTEN, PHASE_SECONDS
+from calcatrix.metrics.trace import TRACER
+
+
+class ImageWriter:
+    """write captured images to disk from a background thread
+
+    `submit(path, data, done)` queues the (already encoded) image and returns
+    immediately unless `max_pending` images are already waiting, in which case
+    it blocks until the writer catches up (back-pressure, so memory stays
+    bounded when storage is slow). `flush()` waits for every queued image to be
+    written and raises the first write error, if any. `done(path, data)` (if
+    given) is called from the writer thread once the image is on disk (e.g. to
+    catalog it).
+    """
+
+    def __init__(self, max_pending=4):
+        if not isinstance(max_pending, int) or max_pending <= 0:
+            raise ValueError(
+                f"please set `max_pending` to a positive int, not {max_pending}"
+            )
+        self.max_pending = max_pending
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._errors = []
+        self.written = 0
+        # number of submits that had to wait for the writer
+        self.stalls = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._work, name="image-writer", daemon=True
+                )
+                self._thread.start()
+        return self
+
+    def submit(self, path, data, done=None):
+        self.start()
+        if self._queue.full():
+            self.stalls += 1
+        self._queue.put((path, data, done))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                path, data, done = item
+                start = time.perf_counter()
+                with TRACER.span("write", cat="writer", path=path, size=len(data)):
+                    with open(path, "wb") as fh:
+                        fh.write(data)
+                PHASE_SECONDS.observe(time.perf_counter() - start, phase="write")
+                IMAGES_WRITTEN.inc()
+                self.written += 1
+                if done is not None:
+                    done(path, data)
+            except Exception as e:  # pylint: disable=broad-except
+                CAPTURE_FAILURES.inc(stage="write")
+                self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        self._queue.join()
+        if self._errors:
+            err, self._errors = self._errors[0], []
+            raise err
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+        self.flush()
+
+    def __repr__(self):
+        return (
+            str(self.__class__.__name__)
+            + ": "
+            + f"pending={self._queue.qsize()}, written={self.written}, "
+            f"stalls={self.stalls}"
+        )
@@ -0,0 +1,234 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """a unit of hardware work, run by the `JobQueue` worker
+
+    `fn(job)` does the work and returns the result. Long running work should
+    call `job.check()` (raises `JobCancelled` once cancelled) between steps and
+    may report progress with `job.advance()`, a partial result can be kept by
+    setting `job.result` before raising
+    """
+
+    def __init__(self, job_id, kind, fn, params=None, total=None):
+        self.id = job_id
+        self.kind = kind
+        self.fn = fn
+        self.params = params or {}
+        self.state = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done = 0
+        self.total = total
+        self.result = None
+        self.error = None
+        # estimated time (s, from the start) at which each unit of progress is
+        # done (e.g. `MultiView.schedule`), used for the eta
+        self.plan = None
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise JobCancelled(f"job {self.id} cancelled")
+
+    def advance(self, n=1):
+        self.done += n
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def eta(self, now=None):
+        """estimated seconds until the job is done (None if unknown)
+
+        The remaining planned time is scaled by the pace so far (elapsed vs.
+        planned time of the progress made)
+        """
+        if self.state in FINISHED:
+            return 0.0
+        if not self.plan or self.started is None:
+            return None
+        if now is None:
+            now = time.time()
+        done = min(self.done, len(self.plan))
+        planned_done = self.plan[done - 1] if done else 0.0
+        remaining = self.plan[-1] - planned_done
+        pace = 1.0
+        if done and planned_done > 0:
+            pace = (now - self.started) / planned_done
+        return max(remaining * pace, 0.0)
+
+    def to_dict(self, include_result=False):
+        now = time.time()
+        if self.started is None:
+            elapsed = None
+        else:
+            elapsed = (self.finished or now) - self.started
+        d = {
+            "id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "state": self.state,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "progress": {"done": self.done, "total": self.total},
+            "elapsed_s": elapsed,
+            "eta_s": self.eta(now),
+            "error": self.error,
+        }
+        if include_result:
+            d["result"] = self.result
+        return d
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.to_dict()}"
+
+
+class JobQueue:
+    """FIFO of `Job`s run one at a time by a single worker thread
+
+    The worker is the only thread that should touch the hardware, so requests
+    only enqueue work and return immediately. Finished jobs are kept (up to
+    `max_history`) so their status and results can be retrieved
+    """
+
+    def __init__(self, max_history=100):
+        self.max_history = max_history
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._pending = deque()
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self.current = None
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._running = True
+            self._thread = threading.Thread(
+                target=self._work, name="hardware-worker", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self, cancel=True):
+        with self._lock:
+            self._running = False
+            if cancel:
+                for job in self._pending:
+                    self._finish(job, CANCELLED)
+                self._pending.clear()
+                if self.current is not None:
+                    self.current._cancel.set()
+            self._wake.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def submit(self, kind, fn, params=None, total=None):
+        """enqueue `fn(job)`, returns the `Job`"""
+        with self._lock:
+            job = Job(str(next(self._ids)), kind, fn, params=params, total=total)
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._trim()
+            self._wake.notify()
+        self.start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(str(job_id))
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        """cancel a queued job, or ask a running job to stop
+
+        Returns the job (None if unknown)
+        """
+        with self._lock:
+            job = self._jobs.get(str(job_id))
+            if job is None or job.state in FINISHED:
+                return job
+            job._cancel.set()
+            if job.state == QUEUED:
+                self._pending.remove(job)
+                self._finish(job, CANCELLED)
+            return job
+
+    def _trim(self):
+        # drop the oldest finished jobs
+        excess = len(self._jobs) - self.max_history
+        if excess <= 0:
+            return
+        for job_id in [j.id for j in self._jobs.values() if j.state in FINISHED]:
+            if excess <= 0:
+                break
+            del self._jobs[job_id]
+            excess -= 1
+
+    def _finish(self, job, state, result=None, error=None):
+        job.state = state
+        job.result = result
+        job.error = error
+        job.finished = time.time()
+        job._finished.set()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while self._running and not self._pending:
+                    self._wake.wait()
+                if not self._running:
+                    return
+                job = self._pending.popleft()
+                job.state = RUNNING
+                job.started = time.time()
+                self.current = job
+            try:
+                result = job.fn(job)
+            except JobCancelled:
+                # keep any partial result the job stored
+                state, result, error = CANCELLED, job.result, None
+            except Exception as e:  # pylint: disable=broad-except
+                state, result, error = FAILED, None, f"{type(e).__name__}: {e}"
+            else:
+                state, error = DONE, None
+            with self._lock:
+                self.current = None
+                self._finish(job, state, result, error)
+                self._trim()
+
+    def __repr__(self):
+        return (
+            str(self.__class__.__name__)
+            + ": "
+            + f"pending={len(self._pending)}, current={self.current}"
+        )
@@ -0,0 +1,259 @@
+"""Process wide metrics, rendered in the Prometheus text format
+
+Metrics are updated once per move/capture (e.g. from a `PulseReport` after
+the step loop), never per step, so instrumentation stays out of the timing
+critical loops. Every update takes the metric's lock (moves may run in
+several threads, e.g. `clock.parallel`).
+
+    STEPS.inc(report.steps, device="linear")
+    PHASE_SECONDS.observe(0.42, phase="capture")
+    REGISTRY.render()  # text for a /metrics endpoint
+"""
+
+import threading
+from bisect import bisect_left, bisect_right
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    parts = []
+    for name, value in key:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        value = value.replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, key, value in self._samples():
+            lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.name}"
+
+
+class Counter(_Metric):
+    """monotonically increasing count, per set of labels"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError(f"a counter can only increase, not by {amount}")
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+
+class Gauge(_Metric):
+    """value that can go up and down, per set of labels"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+
+class Histogram(_Metric):
+    """distribution of observed values in cumulative `buckets` (upper bounds)
+
+    `observe_many` adds a whole batch (e.g. the lateness of every pulse of a
+    move) with one sort and a bisection per bucket
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets):
+        super().__init__(name, documentation)
+        buckets = sorted(float(b) for b in buckets)
+        if not buckets:
+            raise ValueError(f"please specify at least one bucket for {name}")
+        if buckets[-1] != float("inf"):
+            buckets.append(float("inf"))
+        self.buckets = buckets
+
+    def _entry(self, key):
+        # [per bucket counts (not cumulative), sum, count]
+        try:
+            return self._values[key]
+        except KeyError:
+            entry = [[0] * len(self.buckets), 0.0, 0]
+            self._values[key] = entry
+            return entry
+
+    def observe(self, value, **labels):
+        # first bucket with an upper bound >= value
+        ind = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._entry(_label_key(labels))
+            entry[0][ind] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def observe_many(self, values, **labels):
+        ordered = sorted(values)
+        if not ordered:
+            return
+        counts = []
+        prev = 0
+        for bound in self.buckets:
+            upto = bisect_right(ordered, bound)
+            counts.append(upto - prev)
+            prev = upto
+        total = sum(ordered)
+        with self._lock:
+            entry = self._entry(_label_key(labels))
+            for i, count in enumerate(counts):
+                entry[0][i] += count
+            entry[1] += total
+            entry[2] += len(ordered)
+
+    def count(self, **labels):
+        with self._lock:
+            entry = self._values.get(_label_key(labels))
+            return entry[2] if entry else 0
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append(
+                        (f"{self.name}_bucket", key + (("le", bound),), cumulative)
+                    )
+                samples.append((f"{self.name}_sum", key, total))
+                samples.append((f"{self.name}_count", key, count))
+        return samples
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, key, value in self._samples():
+            # `le` is rendered as a float bound (+Inf for the last bucket)
+            key = tuple((k, _format_value(v) if k == "le" else v) for k, v in key)
+            lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """named collection of metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation):
+        return self.register(Counter(name, documentation))
+
+    def gauge(self, name, documentation):
+        return self.register(Gauge(name, documentation))
+
+    def histogram(self, name, documentation, buckets):
+        return self.register(Histogram(name, documentation, buckets))
+
+    def get(self, name):
+        return self._metrics[name]
+
+    def clear(self):
+        """reset every metric (e.g. between benchmark runs)"""
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{list(self._metrics)}"
+
+
+REGISTRY = Registry()
+
+STEPS = REGISTRY.counter("calcatrix_steps_total", "Steps (or half steps) output.")
+MOVES = REGISTRY.counter("calcatrix_moves_total", "Moves (step runs) made.")
+PULSE_LATENESS = REGISTRY.histogram(
+    "calcatrix_pulse_lateness_seconds",
+    "Lateness of each step pulse compared to its schedule.",
+    buckets=(1e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 1e-1),
+)
+BOUND_TRIPS = REGISTRY.counter(
+    "calcatrix_bound_trips_total", "Bound (limit switch) trips during a move."
+)
+MARKER_HITS = REGISTRY.counter(
+    "calcatrix_marker_hits_total", "Marker activations recorded during a move."
+)
+PHASE_SECONDS = REGISTRY.histogram(
+    "calcatrix_phase_seconds",
+    "Duration of each phase of a view (move, rotate, settle, capture, write).",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+CAPTURE_FAILURES = REGISTRY.counter(
+    "calcatrix_capture_failures_total", "Images that failed to capture or write."
+)
+IMAGES_WRITTEN = REGISTRY.counter(
+    "calcatrix_images_written_total", "Images written to disk."
+)
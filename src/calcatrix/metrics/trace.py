@@ -0,0 +1,160 @@
+"""Optional tracing spans, exported as Chrome trace (Perfetto) JSON
+
+Spans are only recorded while the tracer is started, otherwise `span()`
+returns a shared no-op context, so the instrumented code pays one attribute
+check per span (spans are around moves/captures, never around single steps).
+
+    TRACER.start(clock=cart.clock)
+    with TRACER.span("capture", cat="camera", index=3):
+        ...
+    TRACER.stop()
+    TRACER.export("scan.json")  # open in ui.perfetto.dev or chrome://tracing
+
+Times are taken from `clock` (`SystemClock` by default, a simulated run
+gives its virtual timeline), one row per thread.
+"""
+
+import contextlib
+import json
+import os
+import threading
+
+from calcatrix.motion.pulse import SystemClock
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def _json_arg(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+class _Span:
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start_ns = None
+
+    def __enter__(self):
+        self.start_ns = self.tracer.clock.now_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end_ns = self.tracer.clock.now_ns()
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+        self.tracer._complete(self.name, self.cat, self.start_ns, end_ns, self.args)
+
+
+class Tracer:
+    """records spans (name, category, start, duration, args) per thread
+
+    At most `max_events` events are kept per run (the oldest are kept, later
+    spans are counted in `dropped`)
+    """
+
+    def __init__(self, max_events=100_000):
+        self.max_events = max_events
+        self.clock = SystemClock()
+        self.enabled = False
+        self.events = []
+        self.dropped = 0
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def start(self, clock=None):
+        """start recording (a new trace)"""
+        with self._lock:
+            self.clock = clock if clock is not None else SystemClock()
+            self.events = []
+            self.dropped = 0
+            self._threads = {}
+            self.enabled = True
+        return self
+
+    def stop(self):
+        self.enabled = False
+        return self
+
+    def span(self, name, cat="calcatrix", **args):
+        """context manager timing the enclosed block, `args` are shown with
+        the span in the viewer"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, args)
+
+    def instant(self, name, cat="calcatrix", **args):
+        """a point in time (e.g. a bound trip)"""
+        if not self.enabled:
+            return
+        now = self.clock.now_ns()
+        self._append(
+            {"name": name, "cat": cat, "ph": "i", "ts": now / 1e3, "s": "t"}, args
+        )
+
+    def _complete(self, name, cat, start_ns, end_ns, args):
+        if not self.enabled:
+            return
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": start_ns / 1e3,
+            "dur": (end_ns - start_ns) / 1e3,
+        }
+        self._append(event, args)
+
+    def _append(self, event, args):
+        thread = threading.current_thread()
+        event["pid"] = os.getpid()
+        event["tid"] = thread.ident
+        if args:
+            event["args"] = {k: _json_arg(v) for k, v in args.items()}
+        with self._lock:
+            if len(self.events) >= self.max_events:
+                self.dropped += 1
+                return
+            self._threads[thread.ident] = thread.name
+            self.events.append(event)
+
+    def to_dict(self):
+        """the trace in the Chrome trace event format"""
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+            dropped = self.dropped
+        meta = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in threads.items()
+        ]
+        return {
+            "traceEvents": meta + events,
+            "displayTimeUnit": "ms",
+            "otherData": {"dropped": dropped},
+        }
+
+    def export(self, path):
+        with open(path, "w") as fh:
+            json.dump(self.to_dict(), fh)
+        return path
+
+    def __repr__(self):
+        return (
+            str(self.__class__.__name__)
+            + ": "
+            + f"enabled={self.enabled}, events={len(self.events)}, "
+            f"dropped={self.dropped}"
+        )
+
+
+TRACER = Tracer()
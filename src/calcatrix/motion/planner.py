@@ -0,0 +1,326 @@
+"""Route planning for view instructions
+
+Instructions ({"location": steps, "rot_degree": degrees, ...}) are ordered to
+minimize the estimated scan time of a `CostModel`:
+
+1. a monotonic sweep along the track (in the direction that is cheaper from
+   the current location)
+2. a windowed local search (moving a run of up to `window` instructions to
+   another place within `window`), e.g. reordering the views at one marker to
+   save rotation
+
+The rotator goes straight from view to view (no return to 0 in between) and
+returns to 0 once at the end. Both steps are linear in the number of
+instructions (for a fixed window), thousands of views plan in about a
+second.
+"""
+
+
+class CostModel:
+    """estimated time (s) of linear and rotary moves
+
+    - linear: `profile.duration(steps)` * `linear_scale` + `linear_overhead`,
+      with `approach` a move toward a lower location is the move to
+      `overshoot_steps` below it and the move back up (see
+      `LinearDevice.overshoot_steps`)
+    - rotary: `rotate_profile.duration(steps)` of the shortest angle (or the
+      angle / `deg_per_s` without a profile) * `rotate_scale` +
+      `rotate_overhead`
+    - each view: `capture_s`
+
+    With `coordinated` the axes move at the same time (a move costs the
+    slower of the two), otherwise one after the other. `calibrate` fits the
+    scale and overhead of each axis to measured moves.
+    """
+
+    def __init__(
+        self,
+        profile,
+        deg_per_s,
+        coordinated=False,
+        linear_scale=1.0,
+        linear_overhead=0.0,
+        rotate_scale=1.0,
+        rotate_overhead=0.0,
+        rotate_profile=None,
+        deg_per_step=None,
+        overshoot_steps=0,
+    ):
+        if deg_per_s <= 0:
+            raise ValueError(
+                f"please set `deg_per_s` to a positive value, not {deg_per_s}"
+            )
+        self.profile = profile
+        self.deg_per_s = deg_per_s
+        self.coordinated = coordinated
+        self.linear_scale = linear_scale
+        self.linear_overhead = linear_overhead
+        self.rotate_scale = rotate_scale
+        self.rotate_overhead = rotate_overhead
+        if rotate_profile is not None and not deg_per_step:
+            raise ValueError("a `rotate_profile` requires `deg_per_step`")
+        self.rotate_profile = rotate_profile
+        self.deg_per_step = deg_per_step
+        self.overshoot_steps = overshoot_steps
+        # measured time of the work done at each view (e.g. a capture)
+        self.capture_s = 0.0
+        self._linear_cache = {}
+        self._rotate_cache = {}
+
+    @classmethod
+    def from_devices(cls, linear, rotate, coordinated=False):
+        """model of a `LinearDevice` + `Rotator` pair"""
+        deg_per_s = rotate.profile.max_velocity * rotate.deg_per_step
+        return cls(
+            linear.profile,
+            deg_per_s,
+            coordinated=coordinated,
+            rotate_profile=rotate.profile,
+            deg_per_step=rotate.deg_per_step,
+            overshoot_steps=linear.overshoot_steps,
+        )
+
+    @staticmethod
+    def rotation(from_deg, to_deg):
+        """shortest rotation (degrees), as taken by `Rotator.move_to`"""
+        diff = abs(to_deg - from_deg) % 360
+        return min(diff, 360 - diff)
+
+    def _linear_base(self, steps):
+        try:
+            return self._linear_cache[steps]
+        except KeyError:
+            base = self.profile.duration(steps)
+            self._linear_cache[steps] = base
+            return base
+
+    def segments(self, from_loc, to_loc, approach=False):
+        """steps of each segment of a linear move (as pulsed by
+        `LinearDevice.move_to_location`)"""
+        from_loc, to_loc = round(from_loc), round(to_loc)
+        if approach and to_loc < from_loc:
+            below = max(to_loc - self.overshoot_steps, 0)
+            if below < to_loc:
+                return [from_loc - below, to_loc - below]
+        return [abs(to_loc - from_loc)]
+
+    def linear_time(self, from_loc, to_loc, approach=False):
+        base = sum(
+            self._linear_base(steps)
+            for steps in self.segments(from_loc, to_loc, approach)
+            if steps
+        )
+        if base == 0:
+            return 0.0
+        return base * self.linear_scale + self.linear_overhead
+
+    def _rotate_base(self, degrees):
+        if self.rotate_profile is None:
+            return degrees / self.deg_per_s
+        steps = round(degrees / self.deg_per_step)
+        try:
+            return self._rotate_cache[steps]
+        except KeyError:
+            base = self.rotate_profile.duration(steps)
+            self._rotate_cache[steps] = base
+            return base
+
+    def rotate_time(self, from_deg, to_deg):
+        degrees = self.rotation(from_deg, to_deg)
+        if degrees == 0:
+            return 0.0
+        return self._rotate_base(degrees) * self.rotate_scale + self.rotate_overhead
+
+    def move_time(self, from_loc, from_deg, to_loc, to_deg, approach=False):
+        lin = self.linear_time(from_loc, to_loc, approach)
+        rot = self.rotate_time(from_deg, to_deg)
+        return max(lin, rot) if self.coordinated else lin + rot
+
+    def schedule(
+        self,
+        instructions,
+        start_loc,
+        start_deg=0,
+        return_to_zero=False,
+        approach=False,
+    ):
+        """estimated time (s, from the start) at which each instruction is done
+
+        Each instruction is the move to it (see `linear_time` for `approach`),
+        the capture (`capture_s`) and, with `return_to_zero` (the unplanned
+        behavior), the rotation back to 0
+        """
+        done = []
+        total = 0.0
+        loc, deg = start_loc, start_deg
+        for instruction in instructions:
+            to_loc, to_deg = instruction["location"], instruction["rot_degree"]
+            total += self.move_time(loc, deg, to_loc, to_deg, approach)
+            total += self.capture_s
+            loc, deg = to_loc, to_deg
+            if return_to_zero:
+                total += self.rotate_time(deg, 0)
+                deg = 0
+            done.append(total)
+        return done
+
+    def route_time(
+        self,
+        instructions,
+        start_loc,
+        start_deg=0,
+        return_to_zero=False,
+        approach=False,
+    ):
+        """estimated time of following `instructions` in order, including the
+        final rotation back to 0 (see `schedule`)"""
+        done = self.schedule(
+            instructions, start_loc, start_deg, return_to_zero, approach
+        )
+        total = done[-1] if done else 0.0
+        if instructions and not return_to_zero:
+            total += self.rotate_time(instructions[-1]["rot_degree"], 0)
+        return total
+
+    @staticmethod
+    def _fit(pairs):
+        # least squares measured = scale * predicted + overhead
+        n = len(pairs)
+        if n == 0:
+            return None
+        sx = sum(p for p, _ in pairs)
+        sy = sum(m for _, m in pairs)
+        sxx = sum(p * p for p, _ in pairs)
+        sxy = sum(p * m for p, m in pairs)
+        denom = n * sxx - sx * sx
+        if n < 2 or denom == 0:
+            return (sy / sx if sx else 1.0), 0.0
+        scale = (n * sxy - sx * sy) / denom
+        overhead = (sy - scale * sx) / n
+        return scale, max(overhead, 0.0)
+
+    def calibrate(self, linear_moves=(), rotate_moves=()):
+        """fit each axis to measured moves
+
+        `linear_moves` are (steps, seconds) and `rotate_moves` (degrees,
+        seconds) pairs, e.g. from `MultiView.timings`. The steps of a linear
+        move made of several segments (e.g. an `approach`) are the list of the
+        steps of each segment
+        """
+        pairs = []
+        for steps, t in linear_moves:
+            if isinstance(steps, (int, float)):
+                steps = [steps]
+            if sum(steps):
+                pairs.append((sum(self._linear_base(s) for s in steps if s), t))
+        fit = self._fit(pairs)
+        if fit is not None:
+            self.linear_scale, self.linear_overhead = fit
+        pairs = [(self._rotate_base(deg), t) for deg, t in rotate_moves if deg]
+        fit = self._fit(pairs)
+        if fit is not None:
+            self.rotate_scale, self.rotate_overhead = fit
+        return self
+
+    def calibrate_timings(self, timings):
+        """`calibrate` from `MultiView.timings` (per instruction timing, with
+        the steps/degrees moved), `capture_s` is set to the mean `func` time"""
+        linear_moves = [
+            (t.get("linear_segments", t["linear_steps"]), t["linear"])
+            for t in timings
+            if "linear_steps" in t
+        ]
+        rotate_moves = [
+            (t["rotate_deg"], t["rotate"]) for t in timings if "rotate_deg" in t
+        ]
+        self.calibrate(linear_moves, rotate_moves)
+        captures = [t["func"] for t in timings if "func" in t]
+        if captures:
+            self.capture_s = sum(captures) / len(captures)
+        return self
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.__dict__}"
+
+
+def _edges_between(model, prev, seq, nxt):
+    """time of each move from `prev` (location, degrees) through `seq` and on
+    to `nxt` (an instruction, None for the end of the route: rotate back to 0)"""
+    loc, deg = prev
+    edges = []
+    for ins in seq:
+        edges.append(model.move_time(loc, deg, ins["location"], ins["rot_degree"]))
+        loc, deg = ins["location"], ins["rot_degree"]
+    if nxt is None:
+        edges.append(model.rotate_time(deg, 0))
+    else:
+        edges.append(model.move_time(loc, deg, nxt["location"], nxt["rot_degree"]))
+    return edges
+
+
+def _path_time(model, prev, seq, nxt):
+    return sum(_edges_between(model, prev, seq, nxt))
+
+
+def plan_route(instructions, model, start_loc, start_deg=0, window=4, passes=3):
+    """order `instructions` to minimize `model` time, see the module docstring
+
+    Returns (route, summary) where summary has the estimated time of the
+    current (location sorted, return to 0 after each view) and the planned
+    route, and the saving
+    """
+    baseline = sorted(instructions, key=lambda k: k["location"])
+    baseline_s = model.route_time(baseline, start_loc, start_deg, return_to_zero=True)
+    if not baseline:
+        return [], {
+            "baseline_s": 0.0,
+            "planned_s": 0.0,
+            "saving_s": 0.0,
+            "saving_pct": 0.0,
+        }
+
+    # sweep in the cheaper direction from the current location
+    candidates = [baseline, baseline[::-1]]
+    route = min(candidates, key=lambda r: model.route_time(r, start_loc, start_deg))
+    route = list(route)
+
+    # move runs of up to `window` instructions by up to `window` places. The
+    # cost of each move of the route is kept (`edges[k]` is the move into
+    # route[k], `edges[n]` the final return to 0), so only the moves of the
+    # reordered segment are estimated
+    n = len(route)
+    edges = _edges_between(model, (start_loc, start_deg), route, None)
+    for _ in range(passes):
+        improved = False
+        for i in range(n):
+            if i == 0:
+                prev = (start_loc, start_deg)
+            else:
+                prev = (route[i - 1]["location"], route[i - 1]["rot_degree"])
+            for length in range(1, window + 1):
+                for shift in range(1, window + 1):
+                    j = i + length + shift
+                    if j > n:
+                        break
+                    nxt = route[j] if j < n else None
+                    current = route[i:j]
+                    moved = current[length:] + current[:length]
+                    if _path_time(model, prev, moved, nxt) + 1e-9 < sum(
+                        edges[i : j + 1]
+                    ):
+                        route[i:j] = moved
+                        edges[i : j + 1] = _edges_between(model, prev, moved, nxt)
+                        improved = True
+        if not improved:
+            break
+
+    planned_s = model.route_time(route, start_loc, start_deg)
+    summary = {
+        "baseline_s": baseline_s,
+        "planned_s": planned_s,
+        "saving_s": baseline_s - planned_s,
+        "saving_pct": (
+            100 * (baseline_s - planned_s) / baseline_s if baseline_s else 0.0
+        ),
+    }
+    return route, summary
@@ -0,0 +1,172 @@
+import math
+
+
+class MotionProfile:
+    """Motion profile for a stepper
+
+    Converts a move of `num_steps` into per-step periods (seconds) that ramp up
+    from `start_velocity`, cruise at `max_velocity` and ramp back down to
+    `start_velocity`. If `acceleration` is not set the profile is flat (every
+    step at `max_velocity`), if `jerk` is not set the ramp is trapezoidal,
+    otherwise the ramp is an S-curve (jerk limited).
+
+    All units are in steps: steps/s, steps/s^2, steps/s^3
+
+    Short moves that can not reach `max_velocity` use the lower of the ramp up
+    and ramp down curves, so they peak early and still stop at `start_velocity`
+    """
+
+    def __init__(
+        self,
+        max_velocity=400,
+        acceleration=None,
+        jerk=None,
+        start_velocity=None,
+    ):
+        if start_velocity is None:
+            start_velocity = max_velocity
+
+        for name, val in [
+            ("max_velocity", max_velocity),
+            ("start_velocity", start_velocity),
+            ("acceleration", acceleration),
+            ("jerk", jerk),
+        ]:
+            if val is None:
+                continue
+            if not isinstance(val, (int, float)):
+                raise TypeError(
+                    f"`{name}` should be type {int} or {float}, not {type(val)} ({val})"
+                )
+            if val <= 0:
+                raise ValueError(f"please set `{name}` to a positive value, not {val}")
+
+        if start_velocity > max_velocity:
+            raise ValueError(
+                f"start_velocity ({start_velocity}) must not exceed "
+                f"max_velocity ({max_velocity})"
+            )
+        if jerk is not None and acceleration is None:
+            raise ValueError(f"jerk ({jerk}) requires an acceleration to be set")
+
+        self.max_velocity = max_velocity
+        self.start_velocity = start_velocity
+        self.acceleration = acceleration
+        self.jerk = jerk
+
+        # velocity at each step of the ramp up, ends before reaching max_velocity
+        self._ramp = self._build_ramp()
+
+    @classmethod
+    def from_config(cls, config, default_velocity):
+        """build a profile from a config dict, missing keys keep the current
+        (constant velocity) behavior"""
+        if config is None:
+            config = {}
+        try:
+            max_velocity = config["max_velocity"]
+        except KeyError:
+            max_velocity = default_velocity
+        try:
+            start_velocity = config["start_velocity"]
+        except KeyError:
+            start_velocity = min(default_velocity, max_velocity)
+        try:
+            acceleration = config["acceleration"]
+        except KeyError:
+            acceleration = None
+        try:
+            jerk = config["jerk"]
+        except KeyError:
+            jerk = None
+        return cls(
+            max_velocity=max_velocity,
+            acceleration=acceleration,
+            jerk=jerk,
+            start_velocity=start_velocity,
+        )
+
+    def _build_ramp(self):
+        v0, v_max = self.start_velocity, self.max_velocity
+        if self.acceleration is None or v0 >= v_max:
+            return []
+
+        a_max = self.acceleration
+        if self.jerk is None:
+            # v^2 = v0^2 + 2*a*s
+            ramp = []
+            s = 0
+            while True:
+                v = math.sqrt(v0 * v0 + 2 * a_max * s)
+                if v >= v_max:
+                    break
+                ramp.append(v)
+                s += 1
+            return ramp
+
+        # S-curve: jerk up to the peak acceleration, hold, then jerk down
+        j = self.jerk
+        dv = v_max - v0
+        if dv * j >= a_max * a_max:
+            a_peak = a_max
+            t_jerk = a_max / j
+            t_const = dv / a_max - t_jerk
+        else:
+            # max acceleration is never reached (triangular acceleration)
+            a_peak = math.sqrt(dv * j)
+            t_jerk = a_peak / j
+            t_const = 0.0
+        t_end = 2 * t_jerk + t_const
+
+        def accel(t):
+            if t < t_jerk:
+                return j * t
+            if t < t_jerk + t_const:
+                return a_peak
+            return max(a_peak - j * (t - t_jerk - t_const), 0.0)
+
+        # integrate in time, recording the velocity each time a step is crossed
+        dt = 1 / (8 * v_max)
+        ramp = [v0]
+        t, v, s = 0.0, v0, 0.0
+        while t < t_end:
+            a_mid = accel(t + dt / 2)
+            s += v * dt + 0.5 * a_mid * dt * dt
+            v = min(v + a_mid * dt, v_max)
+            t += dt
+            while s >= len(ramp) and v < v_max:
+                ramp.append(v)
+        return ramp
+
+    def velocity(self, step, num_steps):
+        """velocity (steps/s) of the `step`th (0 indexed) step of a `num_steps` move"""
+        remaining = num_steps - 1 - step
+        ramp = self._ramp
+        up = ramp[step] if step < len(ramp) else self.max_velocity
+        down = ramp[remaining] if remaining < len(ramp) else self.max_velocity
+        return min(up, down)
+
+    def iter_periods(self, num_steps):
+        """yield the period (seconds) of each step of a `num_steps` move"""
+        num_steps = int(num_steps)
+        ramp = self._ramp
+        n_ramp = len(ramp)
+        cruise = 1 / self.max_velocity
+        for step in range(num_steps):
+            remaining = num_steps - 1 - step
+            if step >= n_ramp and remaining >= n_ramp:
+                yield cruise
+            else:
+                yield 1 / self.velocity(step, num_steps)
+
+    def duration(self, num_steps):
+        """time (seconds) the move will take, not including per-move overhead"""
+        num_steps = int(num_steps)
+        n_ramp = len(self._ramp)
+        if num_steps <= 2 * n_ramp:
+            return sum(self.iter_periods(num_steps))
+        ramp_time = sum(1 / v for v in self._ramp)
+        return 2 * ramp_time + (num_steps - 2 * n_ramp) / self.max_velocity
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.__dict__}"
@@ -0,0 +1,209 @@
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+
+class SystemClock:
+    """Clock used to time pulses
+
+    `now_ns` is monotonic and high resolution (`time.perf_counter_ns`)
+    """
+
+    def now_ns(self):
+        return time.perf_counter_ns()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait_until(self, deadline_ns, spin_ns=0):
+        """coarse sleep until `spin_ns` before the deadline, then spin-wait"""
+        now_ns = time.perf_counter_ns
+        remaining = deadline_ns - now_ns()
+        if remaining > spin_ns:
+            time.sleep((remaining - spin_ns) / 1e9)
+        while now_ns() < deadline_ns:
+            pass
+
+    def parallel(self, *fns):
+        """run `fns` at the same time, returns the elapsed time (s) of each
+
+        The first runs in the calling thread (e.g. the timing critical step
+        pulses), the others in their own threads. The first exception raised
+        (if any) is re-raised once all have finished
+        """
+        elapsed = [0.0] * len(fns)
+        errors = []
+
+        def _run(i, fn):
+            start = self.now_ns()
+            try:
+                fn()
+            except BaseException as e:  # pylint: disable=broad-except
+                errors.append(e)
+            finally:
+                elapsed[i] = (self.now_ns() - start) / 1e9
+
+        threads = [
+            threading.Thread(target=_run, args=(i, fn), daemon=True)
+            for i, fn in enumerate(fns)
+            if i > 0
+        ]
+        for thread in threads:
+            thread.start()
+        if fns:
+            _run(0, fns[0])
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return elapsed
+
+    def __repr__(self):
+        return str(self.__class__.__name__)
+
+
+class PulseReport:
+    """Result of a pulse run
+
+    `lateness_ns[i]` is how late (ns) the rising edge of pulse `i` was compared
+    to its scheduled time
+    """
+
+    def __init__(self, lateness_ns, aborted=False):
+        self.lateness_ns = lateness_ns
+        self.aborted = aborted
+
+    @property
+    def steps(self):
+        return len(self.lateness_ns)
+
+    @property
+    def max_late_ns(self):
+        return max(self.lateness_ns) if self.lateness_ns else 0
+
+    @property
+    def mean_late_ns(self):
+        if not self.lateness_ns:
+            return 0
+        return sum(self.lateness_ns) / len(self.lateness_ns)
+
+    def percentile_late_ns(self, pct):
+        if not self.lateness_ns:
+            return 0
+        ordered = sorted(self.lateness_ns)
+        ind = min(int(len(ordered) * pct / 100), len(ordered) - 1)
+        return ordered[ind]
+
+    def summary(self):
+        return {
+            "steps": self.steps,
+            "aborted": self.aborted,
+            "mean_late_ns": self.mean_late_ns,
+            "p99_late_ns": self.percentile_late_ns(99),
+            "max_late_ns": self.max_late_ns,
+        }
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.summary()}"
+
+
+def step_at(rises, ticks_ns):
+    """(fractional) number of steps taken at `ticks_ns`
+
+    `rises` are the (ordered) rising edge times of the pulses. Between two
+    pulses the fraction is interpolated from the time since the last one, the
+    period of the next pulse is assumed equal to the last if not output yet
+    """
+    k = bisect_right(rises, ticks_ns)
+    if k == 0:
+        return 0
+    prev = rises[k - 1]
+    if k < len(rises):
+        period = rises[k] - prev
+    elif k > 1:
+        period = prev - rises[k - 2]
+    else:
+        return k
+    if period <= 0:
+        return k
+    return k + min((ticks_ns - prev) / period, 1.0)
+
+
+class PulseEngine:
+    """Timed pulse output for a step pin
+
+    Plays a precomputed schedule of step periods. Each pulse is scheduled
+    against an absolute deadline (so per-call overhead does not accumulate into
+    drift), and waited for with a coarse `sleep` followed by a spin-wait for
+    the last `spin_ns`.
+
+    If a pulse is more than a full period late, the schedule is re-anchored to
+    that pulse rather than bursting to catch up (which could stall the motor).
+
+    The rise time of each pulse is kept (`rises`) so edges seen by sensors can
+    be converted to a step count with `step_at`.
+    """
+
+    def __init__(self, step_pin, clock=None, spin_ns=500_000):
+        self.step_pin = step_pin
+        self.clock = clock if clock is not None else SystemClock()
+        self.spin_ns = spin_ns
+
+        # number of pulses output by the current (or last) run
+        self.steps = 0
+        self.rises = array("q")
+
+    def _wait_until(self, deadline_ns):
+        self.clock.wait_until(deadline_ns, self.spin_ns)
+
+    def run(self, periods, pulse_width, should_stop=None, check_every=1, abort=None):
+        """output one pulse per entry of `periods` (seconds)
+
+        `should_stop(steps)` is called every `check_every` pulses, the run ends
+        early if it returns True. `abort` (a `threading.Event`, e.g. set from an
+        edge callback) is checked before every pulse
+        """
+        now_ns = self.clock.now_ns
+        step_pin = self.step_pin
+        pulse_ns = int(pulse_width * 1e9)
+        lateness = array("q")
+        rises = array("q")
+
+        self.rises = rises
+        self.steps = 0
+        aborted = False
+        deadline = now_ns()
+        for period in periods:
+            if abort is not None and abort.is_set():
+                aborted = True
+                break
+            period_ns = int(period * 1e9)
+
+            self._wait_until(deadline)
+            rise = now_ns()
+            step_pin.on()
+            rises.append(rise)
+            late = rise - deadline
+            lateness.append(late)
+            self._wait_until(rise + min(pulse_ns, period_ns // 2))
+            step_pin.off()
+            self.steps += 1
+
+            if late > period_ns:
+                deadline = rise
+            deadline += period_ns
+
+            if should_stop is not None and self.steps % check_every == 0:
+                if should_stop(self.steps):
+                    aborted = True
+                    break
+
+        return PulseReport(lateness, aborted=aborted)
+
+    def step_at(self, ticks_ns):
+        """step count (with fraction) of the current run at `ticks_ns`"""
+        return step_at(self.rises, ticks_ns)
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.__dict__}"
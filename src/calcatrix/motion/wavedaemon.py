@@ -0,0 +1,250 @@
+"""Simulated pigpio style waveform daemon
+
+Implements the subset of the socket protocol used by `WaveformClient` so the
+waveform pulse output can be run (and tested) on a machine without a Pi.
+Waves are "played" in real time (scaled by `time_scale`): the daemon reports
+busy for the duration of the wave and applies the gpio levels at the end.
+
+    python -m calcatrix.motion.wavedaemon --port 8888
+"""
+
+import argparse
+import socketserver
+import struct
+import threading
+import time
+
+from calcatrix.motion.waveform import (
+    CMD_MODES,
+    CMD_WRITE,
+    CMD_WVAG,
+    CMD_WVBSY,
+    CMD_WVCLR,
+    CMD_WVCRE,
+    CMD_WVDEL,
+    CMD_WVHLT,
+    CMD_WVNEW,
+    CMD_WVTX,
+    _CMD_FMT,
+    _CMD_LEN,
+    _PULSE_FMT,
+    _RES_FMT,
+)
+
+_PULSE_LEN = struct.calcsize(_PULSE_FMT)
+
+# pigpio error codes
+PI_BAD_GPIO = -3
+PI_BAD_MODE = -4
+PI_BAD_WAVE_ID = -66
+PI_EMPTY_WAVEFORM = -69
+PI_UNKNOWN_COMMAND = -88
+
+MAX_GPIO = 53
+
+
+def _bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class _Wave:
+    def __init__(self, pulses):
+        self.pulses = pulses
+        self.duration_us = sum(p[2] for p in pulses)
+
+
+class WaveState:
+    """gpio levels, waves and the wave currently transmitting"""
+
+    def __init__(self, time_scale=1.0):
+        self.time_scale = time_scale
+        self.lock = threading.Lock()
+        self.modes = {}
+        self.levels = {}
+        # number of rising edges seen per gpio (e.g. step pulses)
+        self.rising_edges = {}
+        self.pending = []
+        self.waves = {}
+        self._next_id = 0
+        # (wave, start time, end time) of the transmitting wave
+        self.tx = None
+        # wave ids in the order they were sent
+        self.history = []
+
+    def _now(self):
+        return time.monotonic()
+
+    def _apply(self, pulses, until_us=None):
+        elapsed = 0
+        for on_mask, off_mask, delay in pulses:
+            if until_us is not None and elapsed >= until_us:
+                break
+            for gpio in _bits(on_mask):
+                if not self.levels.get(gpio, 0):
+                    self.rising_edges[gpio] = self.rising_edges.get(gpio, 0) + 1
+                self.levels[gpio] = 1
+            for gpio in _bits(off_mask):
+                self.levels[gpio] = 0
+            elapsed += delay
+
+    def _finish_tx(self, until_us=None):
+        if self.tx is None:
+            return
+        wave, _, _ = self.tx
+        self._apply(wave.pulses, until_us)
+        self.tx = None
+
+    def _busy(self):
+        if self.tx is None:
+            return False
+        if self._now() >= self.tx[2]:
+            self._finish_tx()
+            return False
+        return True
+
+    def handle(self, cmd, p1, p2, ext):
+        with self.lock:
+            if cmd == CMD_MODES:
+                if p1 > MAX_GPIO:
+                    return PI_BAD_GPIO
+                if p2 > 7:
+                    return PI_BAD_MODE
+                self.modes[p1] = p2
+                return 0
+            if cmd == CMD_WRITE:
+                if p1 > MAX_GPIO:
+                    return PI_BAD_GPIO
+                if p2 and not self.levels.get(p1, 0):
+                    self.rising_edges[p1] = self.rising_edges.get(p1, 0) + 1
+                self.levels[p1] = int(bool(p2))
+                return 0
+            if cmd == CMD_WVCLR:
+                self.pending = []
+                self.waves = {}
+                return 0
+            if cmd == CMD_WVNEW:
+                self.pending = []
+                return 0
+            if cmd == CMD_WVAG:
+                for i in range(0, len(ext) - _PULSE_LEN + 1, _PULSE_LEN):
+                    self.pending.append(struct.unpack_from(_PULSE_FMT, ext, i))
+                return len(self.pending)
+            if cmd == CMD_WVCRE:
+                if not self.pending:
+                    return PI_EMPTY_WAVEFORM
+                wave_id = self._next_id
+                self._next_id += 1
+                self.waves[wave_id] = _Wave(self.pending)
+                self.pending = []
+                return wave_id
+            if cmd == CMD_WVDEL:
+                if p1 not in self.waves:
+                    return PI_BAD_WAVE_ID
+                del self.waves[p1]
+                return 0
+            if cmd == CMD_WVTX:
+                try:
+                    wave = self.waves[p1]
+                except KeyError:
+                    return PI_BAD_WAVE_ID
+                # a new wave replaces the transmitting one
+                self._busy()
+                self._finish_tx()
+                start = self._now()
+                end = start + wave.duration_us / 1e6 * self.time_scale
+                self.tx = (wave, start, end)
+                self.history.append(p1)
+                return len(wave.pulses)
+            if cmd == CMD_WVBSY:
+                return int(self._busy())
+            if cmd == CMD_WVHLT:
+                if self._busy():
+                    _, start, _ = self.tx
+                    elapsed_us = (self._now() - start) / self.time_scale * 1e6
+                    self._finish_tx(until_us=elapsed_us)
+                return 0
+            return PI_UNKNOWN_COMMAND
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.__dict__}"
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def _recv_exact(self, size):
+        buf = b""
+        while len(buf) < size:
+            chunk = self.request.recv(size - len(buf))
+            if not chunk:
+                return None
+            buf += chunk
+        return buf
+
+    def handle(self):
+        while True:
+            header = self._recv_exact(_CMD_LEN)
+            if header is None:
+                return
+            cmd, p1, p2, p3 = struct.unpack(_CMD_FMT, header)
+            ext = b""
+            if p3:
+                ext = self._recv_exact(p3)
+                if ext is None:
+                    return
+            res = self.server.state.handle(cmd, p1, p2, ext)
+            self.request.sendall(struct.pack(_RES_FMT, cmd, p1, p2, res))
+
+
+class SimulatedWaveDaemon(socketserver.ThreadingTCPServer):
+    """threaded TCP server wrapping a `WaveState`
+
+    Use `port=0` to bind a free port (see `server_address`) and
+    `start()`/`stop()` to run it in a background thread
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=8888, time_scale=1.0):
+        super().__init__((host, port), _Handler)
+        self.state = WaveState(time_scale=time_scale)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=1.0,
+        help="scale applied to wave durations (e.g. 0.1 plays 10x faster)",
+    )
+    args = parser.parse_args()
+    daemon = SimulatedWaveDaemon(args.host, args.port, time_scale=args.time_scale)
+    print(f"simulated waveform daemon listening on {daemon.server_address}")
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server_close()
+
+
+if __name__ == "__main__":
+    main()
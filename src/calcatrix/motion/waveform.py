@@ -0,0 +1,312 @@
+import socket
+import struct
+import time
+from array import array
+from bisect import bisect_right
+from itertools import islice
+
+from calcatrix.motion.pulse import PulseEngine, PulseReport, step_at
+
+# subset of the pigpio socket command set used to build and play waveforms
+CMD_MODES = 0
+CMD_WRITE = 4
+CMD_WVCLR = 27
+CMD_WVAG = 28
+CMD_WVBSY = 32
+CMD_WVHLT = 33
+CMD_WVCRE = 49
+CMD_WVDEL = 50
+CMD_WVTX = 51
+CMD_WVNEW = 53
+
+MODE_OUTPUT = 1
+
+_CMD_FMT = "<IIII"
+_RES_FMT = "<IIIi"
+_CMD_LEN = struct.calcsize(_CMD_FMT)
+_PULSE_FMT = "<III"
+
+
+class WaveformClient:
+    """Socket client for a pigpio style waveform daemon
+
+    Only the commands needed to upload and play pulse trains are implemented.
+    A pulse is `(gpio_on_mask, gpio_off_mask, delay_us)`.
+    """
+
+    def __init__(self, host="localhost", port=8888, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._sock = None
+
+    def _connect(self):
+        if self._sock is None:
+            self._sock = socket.create_connection(
+                (self.host, self.port), timeout=self.timeout
+            )
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self._sock
+
+    def _recv_exact(self, sock, size):
+        buf = b""
+        while len(buf) < size:
+            chunk = sock.recv(size - len(buf))
+            if not chunk:
+                raise ConnectionError(
+                    f"waveform daemon ({self.host}:{self.port}) closed the connection"
+                )
+            buf += chunk
+        return buf
+
+    def command(self, cmd, p1=0, p2=0, ext=b""):
+        sock = self._connect()
+        sock.sendall(struct.pack(_CMD_FMT, cmd, p1, p2, len(ext)) + ext)
+        _, _, _, res = struct.unpack(_RES_FMT, self._recv_exact(sock, _CMD_LEN))
+        if res < 0:
+            raise RuntimeError(
+                f"waveform daemon ({self.host}:{self.port}) command {cmd} "
+                f"({p1}, {p2}) failed with {res}"
+            )
+        return res
+
+    def set_output(self, gpio):
+        return self.command(CMD_MODES, gpio, MODE_OUTPUT)
+
+    def write(self, gpio, level):
+        return self.command(CMD_WRITE, gpio, int(bool(level)))
+
+    def wave_clear(self):
+        return self.command(CMD_WVCLR)
+
+    def wave_new(self):
+        return self.command(CMD_WVNEW)
+
+    def wave_add_generic(self, pulses):
+        ext = b"".join(struct.pack(_PULSE_FMT, *p) for p in pulses)
+        return self.command(CMD_WVAG, ext=ext)
+
+    def wave_create(self):
+        return self.command(CMD_WVCRE)
+
+    def wave_delete(self, wave_id):
+        return self.command(CMD_WVDEL, wave_id)
+
+    def wave_send_once(self, wave_id):
+        return self.command(CMD_WVTX, wave_id)
+
+    def wave_tx_busy(self):
+        return bool(self.command(CMD_WVBSY))
+
+    def wave_tx_stop(self):
+        return self.command(CMD_WVHLT)
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.host}:{self.port}"
+
+
+class WaveformEngine:
+    """Hardware timed pulse output
+
+    Same interface as `PulseEngine`, but the pulse train is uploaded to a
+    waveform daemon (in chunks of `chunk_steps`) which plays it with DMA
+    timing. The next chunk is uploaded while the current one plays, Python only
+    polls for completion (every `poll_interval` s) or an abort.
+
+    Because the pulses are not output by this process:
+    - `should_stop(steps)` is evaluated once per poll, with `steps` estimated
+      from the elapsed time and the schedule
+    - `lateness_ns` is the delay of each pulse caused by gaps between chunks
+      (timing inside a chunk is exact)
+    - `rises` are the scheduled rise times, from the time each chunk was sent
+    """
+
+    def __init__(
+        self,
+        gpio,
+        host="localhost",
+        port=8888,
+        chunk_steps=4000,
+        poll_interval=0.001,
+        client=None,
+    ):
+        self.gpio = gpio
+        self.client = client if client is not None else WaveformClient(host, port)
+        self.chunk_steps = chunk_steps
+        self.poll_interval = poll_interval
+        self.steps = 0
+        self.rises = array("q")
+        self._ready = False
+
+    def _setup(self):
+        if not self._ready:
+            self.client.set_output(self.gpio)
+            self._ready = True
+
+    def _create(self, pulses):
+        self.client.wave_new()
+        self.client.wave_add_generic(pulses)
+        return self.client.wave_create()
+
+    def _step_chunk(self, periods, pulse_width):
+        mask = 1 << self.gpio
+        pulse_us = int(pulse_width * 1e6)
+        pulses = []
+        # cumulative end time (ns, relative to chunk start) of each step
+        ends = array("q")
+        total = 0
+        for period in periods:
+            period_us = int(period * 1e6)
+            high_us = min(pulse_us, period_us // 2)
+            pulses.append((mask, 0, high_us))
+            pulses.append((0, mask, period_us - high_us))
+            total += period_us * 1000
+            ends.append(total)
+        return pulses, ends
+
+    def play(self, pulses, ends=None, should_stop=None, on_progress=None):
+        """play `pulses` once and wait for it to finish (or be stopped)
+
+        `ends` (ns) is used to estimate progress, which is passed to
+        `should_stop`/`on_progress`. Returns (completed, elapsed_ns)
+        """
+        self._setup()
+        wave_id = self._create(pulses)
+        try:
+            return self._play_created(wave_id, ends, should_stop, on_progress)
+        finally:
+            self.client.wave_delete(wave_id)
+
+    def _play_created(self, wave_id, ends, should_stop, on_progress, prepare=None):
+        start = time.perf_counter_ns()
+        self.client.wave_send_once(wave_id)
+        if prepare is not None:
+            prepare()
+        while self.client.wave_tx_busy():
+            elapsed = time.perf_counter_ns() - start
+            if ends is not None:
+                done = bisect_right(ends, elapsed)
+                if on_progress is not None:
+                    on_progress(done)
+                if should_stop is not None and should_stop(done):
+                    self.client.wave_tx_stop()
+                    return False, elapsed
+            time.sleep(self.poll_interval)
+        return True, time.perf_counter_ns() - start
+
+    def run(self, periods, pulse_width, should_stop=None, check_every=1, abort=None):
+        """see `PulseEngine.run`, `abort` is checked every poll"""
+        self._setup()
+        periods = iter(periods)
+        lateness = array("q")
+        self.rises = array("q")
+        self.steps = 0
+        aborted = False
+
+        pulses, ends = self._step_chunk(islice(periods, self.chunk_steps), pulse_width)
+        wave_id = self._create(pulses) if pulses else None
+        gap_ns = 0
+
+        def _should_stop(steps):
+            if abort is not None and abort.is_set():
+                return True
+            return should_stop is not None and should_stop(steps)
+
+        if abort is not None and abort.is_set():
+            if wave_id is not None:
+                self.client.wave_delete(wave_id)
+            wave_id, aborted = None, True
+        while wave_id is not None:
+            base = self.steps
+            upcoming = {}
+
+            def _prepare():
+                # upload the next chunk while this one plays
+                nxt, nxt_ends = self._step_chunk(
+                    islice(periods, self.chunk_steps), pulse_width
+                )
+                upcoming["ends"] = nxt_ends
+                upcoming["id"] = self._create(nxt) if nxt else None
+
+            def _progress(done):
+                self.steps = base + done
+
+            def _stop(done):
+                return _should_stop(base + done)
+
+            sent = time.perf_counter_ns()
+            self.rises.append(sent)
+            self.rises.extend(sent + end for end in ends[:-1])
+            try:
+                completed, elapsed = self._play_created(
+                    wave_id,
+                    ends,
+                    _stop,
+                    _progress,
+                    prepare=_prepare,
+                )
+            finally:
+                self.client.wave_delete(wave_id)
+
+            if completed:
+                played = len(ends)
+            else:
+                played = bisect_right(ends, elapsed)
+            lateness.extend([gap_ns] * played)
+            self.steps = base + played
+            del self.rises[self.steps :]
+
+            if not completed:
+                aborted = True
+                if upcoming.get("id") is not None:
+                    self.client.wave_delete(upcoming["id"])
+                break
+            if _should_stop(self.steps):
+                aborted = True
+                if upcoming.get("id") is not None:
+                    self.client.wave_delete(upcoming["id"])
+                break
+
+            # time between the end of this chunk and the start of the next
+            expected_end = sent + ends[-1]
+            gap_ns = max(time.perf_counter_ns() - expected_end, 0)
+            wave_id, ends = upcoming.get("id"), upcoming.get("ends")
+
+        return PulseReport(lateness, aborted=aborted)
+
+    def step_at(self, ticks_ns):
+        """see `PulseEngine.step_at`"""
+        return step_at(self.rises, ticks_ns)
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.__dict__}"
+
+
+def build_engine(output_config, gpio, step_pin, clock=None):
+    """select the pulse output for a stepper from its `output` config
+
+    `{"type": "waveform", "host": ..., "port": ...}` uses a waveform daemon,
+    anything else (or no config) keeps the in process sleep/spin `PulseEngine`
+    """
+    if not output_config:
+        return PulseEngine(step_pin, clock=clock)
+    try:
+        output_type = output_config["type"]
+    except KeyError:
+        output_type = "sleep"
+
+    if output_type == "waveform":
+        kwargs = {k: v for k, v in output_config.items() if k != "type"}
+        return WaveformEngine(gpio, **kwargs)
+    elif output_type == "sleep":
+        return PulseEngine(step_pin, clock=clock)
+    else:
+        raise ValueError(
+            f"output type ({output_type}) not supported, please select from "
+            f"['sleep', 'waveform']"
+        )
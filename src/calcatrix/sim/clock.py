@@ -0,0 +1,43 @@
+class VirtualClock:
+    """Simulated clock
+
+    Same interface as `SystemClock`, but sleeping/waiting only moves the
+    clock forward, so a simulated run takes (almost) no real time
+    """
+
+    def __init__(self, start_ns=0):
+        self._now_ns = start_ns
+
+    def now_ns(self):
+        return self._now_ns
+
+    def time(self):
+        return self._now_ns / 1e9
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self._now_ns += int(seconds * 1e9)
+
+    def wait_until(self, deadline_ns, spin_ns=0):
+        if deadline_ns > self._now_ns:
+            self._now_ns = deadline_ns
+
+    def parallel(self, *fns):
+        """see `SystemClock.parallel`
+
+        Each function is run (in turn) from the same start time and the clock
+        is left at the latest end, as if they had run at the same time
+        """
+        start = self._now_ns
+        end = start
+        elapsed = []
+        for fn in fns:
+            self._now_ns = start
+            fn()
+            elapsed.append((self._now_ns - start) / 1e9)
+            end = max(end, self._now_ns)
+        self._now_ns = end
+        return elapsed
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self._now_ns}ns"
@@ -0,0 +1,310 @@
+from array import array
+
+from calcatrix.devices.edges import EdgeMixin
+from calcatrix.devices.stepper import Stepper
+from calcatrix.devices.rotate import Rotator
+from calcatrix.motion.pulse import PulseReport, step_at
+from calcatrix.sim.clock import VirtualClock
+
+
+class SimOutput:
+    """digital output, stands in for `gpiozero.DigitalOutputDevice`"""
+
+    def __init__(self, pin, on_rise=None):
+        self.pin = pin
+        self.value = False
+        self.on_rise = on_rise
+
+    def on(self):
+        if not self.value:
+            self.value = True
+            if self.on_rise is not None:
+                self.on_rise()
+
+    def off(self):
+        self.value = False
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.pin}={self.value}"
+
+
+class SimGPIO:
+    """stands in for the `RPi.GPIO` module used by the `Rotator`"""
+
+    BCM = "BCM"
+    OUT = "OUT"
+
+    def __init__(self):
+        self.mode = None
+        self.levels = {}
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, mode):
+        self.levels[pin] = 0
+
+    def output(self, pin, level):
+        # like RPi.GPIO, a list of pins can be written at once
+        if isinstance(pin, (list, tuple)):
+            if not isinstance(level, (list, tuple)):
+                level = [level] * len(pin)
+            for p, lvl in zip(pin, level):
+                self.levels[p] = lvl
+            return
+        self.levels[pin] = level
+
+    def cleanup(self):
+        self.levels = {}
+
+
+class SimHall(EdgeMixin):
+    """hall sensor on the simulated track, edges are fired by the rig"""
+
+    def __init__(
+        self, rig, name="hall_sensor", when_activated=None, when_deactivated=None, **_
+    ):
+        self.rig = rig
+        self.name = name
+        self.rezero()
+        self._init_edges(when_activated, when_deactivated)
+
+    @property
+    def value(self):
+        return self.rig.marker_active()
+
+    def _on_activated(self, step, ticks):
+        if step is not None:
+            self.activations.append(step)
+            self.activation_ticks.append(ticks or 0)
+
+    def _on_deactivated(self, step, ticks):
+        if step is not None:
+            self.deactivations.append(step)
+            self.deactivation_ticks.append(ticks or 0)
+
+    def rezero(self):
+        # (fractional) step and time (ns) of each edge
+        self.activations = array("d")
+        self.deactivations = array("d")
+        self.activation_ticks = array("q")
+        self.deactivation_ticks = array("q")
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.name}"
+
+
+class SimLimit(EdgeMixin):
+    """limit switch on the simulated track, edges are fired by the rig"""
+
+    def __init__(
+        self, rig, name="limit_switch", when_activated=None, when_deactivated=None, **_
+    ):
+        self.rig = rig
+        self.name = name
+        self.trips = []
+        self._init_edges(when_activated, when_deactivated)
+
+    @property
+    def value(self):
+        return self.rig.limit_active(self.name)
+
+    def _on_activated(self, step, ticks):
+        if self.trip is not None:
+            self.trips.append(step)
+
+    def rezero(self):
+        self.trips = []
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.name}"
+
+
+class SimEngine:
+    """pulse output that moves the simulated cart
+
+    Same interface as `PulseEngine`, pulses are "output" on the virtual clock
+    (no waiting), so lateness is always 0
+    """
+
+    def __init__(self, rig, stepper):
+        self.rig = rig
+        self.stepper = stepper
+        self.steps = 0
+        self.rises = array("q")
+
+    def run(self, periods, pulse_width, should_stop=None, check_every=1, abort=None):
+        clock = self.rig.clock
+        step = self.rig.step
+        direction = self.stepper.dir_pin.value
+        lateness = array("q")
+        self.rises = rises = array("q")
+        self.steps = 0
+        aborted = False
+        t = clock.now_ns()
+        for period in periods:
+            if abort is not None and abort.is_set():
+                aborted = True
+                break
+            t += int(period * 1e9)
+            clock.wait_until(t)
+            rises.append(t)
+            step(direction)
+            self.steps += 1
+            lateness.append(0)
+            if should_stop is not None and self.steps % check_every == 0:
+                if should_stop(self.steps):
+                    aborted = True
+                    break
+        return PulseReport(lateness, aborted=aborted)
+
+    def step_at(self, ticks_ns):
+        return step_at(self.rises, ticks_ns)
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.steps}"
+
+
+class SimRig:
+    """Simulated rig backend
+
+    A virtual track of `track_steps` (linear stepper steps) with magnets
+    (centers, in steps) of `magnet_width`, bound "a" active at or below
+    `bound_a` and bound "b" active at or above `bound_b`, plus a rotator.
+    Stepping with the dir pin on moves toward "a" (position decreases), the
+    cart stalls at either physical end of the track.
+
+    All devices share a `VirtualClock`, so a full `MultiView.initialize()` +
+    `follow_all_instructions()` runs in (real) milliseconds. Select it with
+    `init_config["backend"] = {"type": "sim", ...}`
+    """
+
+    name = "sim"
+
+    def __init__(
+        self,
+        track_steps=20000,
+        magnets=None,
+        magnet_width=30,
+        bound_a=50,
+        bound_b=None,
+        start=None,
+    ):
+        if not isinstance(track_steps, int) or track_steps <= 0:
+            raise ValueError(
+                f"please set `track_steps` to a positive int, not {track_steps}"
+            )
+        if bound_b is None:
+            bound_b = track_steps - 50
+        if not 0 <= bound_a < bound_b <= track_steps:
+            raise ValueError(
+                f"bounds must satisfy 0 <= bound_a ({bound_a}) < bound_b ({bound_b})"
+                f" <= track_steps ({track_steps})"
+            )
+        if magnets is None:
+            # evenly spaced between the bounds
+            num = 10
+            span = bound_b - bound_a
+            magnets = [bound_a + int(span * (i + 1) / (num + 1)) for i in range(num)]
+        if start is None:
+            start = track_steps // 2
+
+        self.track_steps = track_steps
+        self.magnets = sorted(magnets)
+        self.magnet_width = magnet_width
+        self.bound_a = bound_a
+        self.bound_b = bound_b
+        self.position = start
+        self.clock = VirtualClock()
+
+        half = magnet_width // 2
+        self._marker_map = bytearray(track_steps + 1)
+        for center in self.magnets:
+            for pos in range(
+                max(center - half, 0), min(center + half, track_steps) + 1
+            ):
+                self._marker_map[pos] = 1
+
+        self.stalls = 0
+        self.total_steps = 0
+        self.markers = []
+        self.limits = {}
+        self.steppers = []
+        self.rotators = []
+
+    # --- track state
+    def marker_active(self):
+        return bool(self._marker_map[self.position])
+
+    def limit_active(self, name, position=None):
+        if position is None:
+            position = self.position
+        if name == "a":
+            return position <= self.bound_a
+        elif name == "b":
+            return position >= self.bound_b
+        raise ValueError(f"limit ({name}) not on track, please use 'a' or 'b'")
+
+    def step(self, direction):
+        """move the cart one step (if enabled), firing any sensor edges"""
+        for stepper in self.steppers:
+            # enable pin is active low, on == disabled
+            if stepper.enable_pin.value:
+                return
+        pos = self.position + (-1 if direction else 1)
+        if pos < 0 or pos > self.track_steps:
+            self.stalls += 1
+            return
+        prev = self.position
+        self.position = pos
+        self.total_steps += 1
+
+        marker = self._marker_map[pos]
+        if marker != self._marker_map[prev]:
+            ticks = self.clock.now_ns()
+            for hall in self.markers:
+                hall._edge(bool(marker), ticks)
+
+        for name, limits in self.limits.items():
+            now_active = self.limit_active(name, pos)
+            if now_active != self.limit_active(name, prev):
+                ticks = self.clock.now_ns()
+                for limit in limits:
+                    limit._edge(now_active, ticks)
+
+    # --- backend interface (see `HardwareBackend`)
+    def stepper(self, init_config, name="stepper"):
+        stepper = Stepper(init_config, name=name, pin_cls=SimOutput, clock=self.clock)
+        stepper.engine = SimEngine(self, stepper)
+        stepper.step_pin.on_rise = lambda: self.step(stepper.dir_pin.value)
+        self.steppers.append(stepper)
+        return stepper
+
+    def hall(self, **kwargs):
+        hall = SimHall(self, **kwargs)
+        self.markers.append(hall)
+        return hall
+
+    def limit(self, **kwargs):
+        limit = SimLimit(self, **kwargs)
+        # raises if the name is not a bound on the track
+        self.limit_active(limit.name)
+        self.limits.setdefault(limit.name, []).append(limit)
+        return limit
+
+    def rotator(self, pins, output=None, profile=None):
+        # a waveform output makes no sense without a daemon, always "sleep", and
+        # moves run inline on the virtual clock
+        rotator = Rotator(
+            pins, gpio=SimGPIO(), clock=self.clock, profile=profile, background=False
+        )
+        self.rotators.append(rotator)
+        return rotator
+
+    def __repr__(self):
+        return (
+            str(self.__class__.__name__)
+            + ": "
+            + f"position={self.position}, track_steps={self.track_steps}, "
+            f"magnets={len(self.magnets)}, t={self.clock.time():.3f}s"
+        )
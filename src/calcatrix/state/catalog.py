@@ -0,0 +1,304 @@
+"""SQLite catalog of the captured images
+
+One row per image (file name, index, view name, location, rotation, capture
+time, size, checksum, burst sequence number), written by `Photo` as each
+image reaches disk, so listing/filtering the images is an indexed query
+rather than a directory scan + file name parsing per request.
+
+Listing is keyset paginated (`after` is the `id` of the last row of the
+previous page), so every page costs the same however deep into the catalog.
+
+If the database is missing it is rebuilt from the files in `base_path` (the
+fields are parsed from the file names, see `parse_file_name`), checksums are
+then left empty unless `rebuild(checksums=True)` reads every file.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_name TEXT NOT NULL UNIQUE,
+    idx INTEGER,
+    name TEXT,
+    location INTEGER,
+    rot_degree INTEGER,
+    captured_at REAL,
+    size INTEGER,
+    checksum TEXT,
+    seq INTEGER
+);
+CREATE INDEX IF NOT EXISTS images_idx ON images (idx);
+CREATE INDEX IF NOT EXISTS images_name ON images (name);
+CREATE INDEX IF NOT EXISTS images_rot_degree ON images (rot_degree);
+CREATE INDEX IF NOT EXISTS images_captured_at ON images (captured_at);
+"""
+
+_COLUMNS = (
+    "id",
+    "file_name",
+    "idx",
+    "name",
+    "location",
+    "rot_degree",
+    "captured_at",
+    "size",
+    "checksum",
+    "seq",
+)
+
+# timestamp part of the `Photo` file names
+TS_FORMAT = "%m_%d_%Y__%H_%M_%S"
+
+
+def checksum(data):
+    """hex digest stored in the catalog (sha256)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_file_name(file_name):
+    """fields of a `Photo` file name
+    (`{index}__{name}__{location}__{rot_degree}__{%m_%d_%Y__%H_%M_%S}.jpg`,
+    with a trailing `__{seq}` for the frames of a burst)
+
+    Returns None if the name does not follow the template
+    """
+    stem, ext = os.path.splitext(file_name)
+    if ext.lower() not in (".jpg", ".jpeg"):
+        return None
+    parts = stem.split("__")
+    if len(parts) not in (6, 7):
+        return None
+    index, name, location, rot_degree = parts[:4]
+    try:
+        captured_at = datetime.strptime("__".join(parts[4:6]), TS_FORMAT).timestamp()
+    except ValueError:
+        return None
+    return {
+        "file_name": file_name,
+        "idx": _int_or_none(index),
+        "name": name,
+        "location": _int_or_none(location),
+        "rot_degree": _int_or_none(rot_degree),
+        "captured_at": captured_at,
+        "seq": _int_or_none(parts[6]) if len(parts) == 7 else None,
+    }
+
+
+class ImageCatalog:
+    """catalog of the images in `base_path`, stored in `db_path` (by default
+    `catalog.sqlite3` in `base_path`)
+
+    Safe to use from several threads (e.g. the image writer and the server
+    request handlers), writes are serialized by a lock
+    """
+
+    def __init__(self, base_path, db_path=None, rebuild_missing=True):
+        self.base_path = Path(base_path)
+        if db_path is None:
+            db_path = self.base_path.joinpath("catalog.sqlite3")
+        self.db_path = Path(db_path)
+        missing = not self.db_path.exists()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            columns = {
+                row[1] for row in self._conn.execute("PRAGMA table_info(images)")
+            }
+            if "seq" not in columns:
+                # catalogs made before bursts
+                self._conn.execute("ALTER TABLE images ADD COLUMN seq INTEGER")
+            self._conn.commit()
+        if missing and rebuild_missing and self.base_path.is_dir():
+            self.rebuild()
+
+    def add(self, path, size=None, digest=None, captured_at=None, **fields):
+        """add (or replace) the row of the image at `path`
+
+        `fields` are any of index/idx, name, location, rot_degree and seq,
+        missing ones are parsed from the file name
+        """
+        file_name = Path(path).name
+        row = parse_file_name(file_name) or {"file_name": file_name}
+        if "index" in fields:
+            fields["idx"] = fields.pop("index")
+        for key in ("idx", "location", "rot_degree", "seq"):
+            if key in fields:
+                fields[key] = _int_or_none(fields[key])
+        row.update(fields)
+        if captured_at is not None:
+            row["captured_at"] = captured_at
+        row.setdefault("captured_at", time.time())
+        row["size"] = size
+        row["checksum"] = digest
+        self._insert([row])
+        return row
+
+    def _insert(self, rows, replace_all=False):
+        keys = _COLUMNS[1:]
+        sql = (
+            f"INSERT OR REPLACE INTO images ({', '.join(keys)}) "
+            f"VALUES ({', '.join('?' for _ in keys)})"
+        )
+        values = [tuple(row.get(k) for k in keys) for row in rows]
+        with self._lock:
+            # one transaction (sqlite3 opens it on the first statement)
+            if replace_all:
+                self._conn.execute("DELETE FROM images")
+            self._conn.executemany(sql, values)
+            self._conn.commit()
+
+    def remove(self, path):
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM images WHERE file_name = ?", (Path(path).name,)
+            )
+            self._conn.commit()
+        return cur.rowcount > 0
+
+    def get(self, path):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM images WHERE file_name = ?", (Path(path).name,)
+            ).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def _to_dict(self, row):
+        d = dict(row)
+        d["index"] = d.pop("idx")
+        d["path"] = str(self.base_path.joinpath(d["file_name"]))
+        return d
+
+    @staticmethod
+    def _where(index=None, name=None, rot_degree=None, since=None, until=None):
+        clauses, params = [], []
+        if index is not None:
+            clauses.append("idx = ?")
+            params.append(int(index))
+        if name is not None:
+            clauses.append("name = ?")
+            params.append(str(name))
+        if rot_degree is not None:
+            clauses.append("rot_degree = ?")
+            params.append(int(rot_degree))
+        if since is not None:
+            clauses.append("captured_at >= ?")
+            params.append(float(since))
+        if until is not None:
+            clauses.append("captured_at < ?")
+            params.append(float(until))
+        return clauses, params
+
+    def list(
+        self,
+        index=None,
+        name=None,
+        rot_degree=None,
+        since=None,
+        until=None,
+        limit=100,
+        after=None,
+    ):
+        """a page of images (oldest first) matching the filters
+
+        `since`/`until` are unix times. Returns {"images": [...], "total": n,
+        "next": id to pass as `after` for the next page (None on the last)}
+        """
+        if not isinstance(limit, int) or limit <= 0:
+            raise ValueError(f"please set `limit` to a positive int, not {limit}")
+        clauses, params = self._where(index, name, rot_degree, since, until)
+        where = " AND ".join(clauses)
+        count_sql = "SELECT COUNT(*) FROM images"
+        if where:
+            count_sql += f" WHERE {where}"
+        page_clauses, page_params = list(clauses), list(params)
+        if after is not None:
+            page_clauses.append("id > ?")
+            page_params.append(int(after))
+        page_sql = "SELECT * FROM images"
+        if page_clauses:
+            page_sql += " WHERE " + " AND ".join(page_clauses)
+        # one extra row tells whether there is a next page
+        page_sql += " ORDER BY id LIMIT ?"
+        page_params.append(limit + 1)
+        with self._lock:
+            total = self._conn.execute(count_sql, params).fetchone()[0]
+            rows = self._conn.execute(page_sql, page_params).fetchall()
+        images = [self._to_dict(row) for row in rows[:limit]]
+        return {
+            "images": images,
+            "total": total,
+            "next": images[-1]["id"] if len(rows) > limit else None,
+        }
+
+    def iter_paths(self, batch=500, **filters):
+        """paths of every image matching `filters` (see `list`), fetched a
+        page at a time"""
+        after = None
+        while True:
+            page = self.list(limit=batch, after=after, **filters)
+            for image in page["images"]:
+                yield image["path"]
+            after = page["next"]
+            if after is None:
+                return
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def rebuild(self, checksums=False):
+        """replace the catalog with the images found in `base_path`
+
+        Files are listed with `os.scandir` (type and size without extra
+        syscalls per file on most file systems), rows are inserted in one
+        transaction. Returns the number of images
+        """
+        rows = []
+        with os.scandir(self.base_path) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                row = parse_file_name(entry.name)
+                if row is None:
+                    continue
+                row["size"] = entry.stat().st_size
+                row["checksum"] = file_checksum(entry.path) if checksums else None
+                rows.append(row)
+        # oldest first, so ids follow the capture order
+        rows.sort(key=lambda r: (r["captured_at"], r["file_name"]))
+        self._insert(rows, replace_all=True)
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.db_path}"
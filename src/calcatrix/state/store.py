@@ -0,0 +1,225 @@
+"""Journaled state store
+
+The state (a JSON compatible dict) is kept as a snapshot file plus an append
+only journal (`<path>.journal`) of updates:
+
+- snapshot: {"format": "calcatrix-state", "version": 1, "seq": n, "state": {}}
+- journal: one JSON object per line, {"seq": n, "set": {field: value}}
+
+An update only appends a line to the (already open) journal, fsync is done at
+most every `sync_interval` seconds: an update inside the interval reaches the
+OS right away and is fsync'd by a background timer at the end of the
+interval (or earlier by a later update, `flush()` or `close()`), so no update
+stays off disk for longer than `sync_interval`. After `compact_every` updates
+the state is compacted: written to a temporary file, fsync'd and renamed over
+the snapshot (atomic), then the journal is truncated. Loading reads the
+snapshot and replays the journal entries newer than it, a torn last line
+(e.g. power loss mid write) is ignored.
+"""
+
+import json
+import os
+import pickle
+import threading
+import time
+from pathlib import Path
+
+FORMAT = "calcatrix-state"
+VERSION = 1
+
+
+class StateStore:
+    def __init__(self, path, compact_every=200, sync_interval=1.0):
+        if not path:
+            raise ValueError(f"no filepath has been specified ({path})")
+        if not isinstance(compact_every, int) or compact_every <= 0:
+            raise ValueError(
+                f"please set `compact_every` to a positive int, not {compact_every}"
+            )
+        self.path = Path(path)
+        self.journal_path = Path(str(path) + ".journal")
+        self.compact_every = compact_every
+        self.sync_interval = sync_interval
+
+        self.state = None
+        self.seq = 0
+        # journal entries since the last compaction
+        self.pending = 0
+        self._journal = None
+        self._last_sync = 0.0
+        self._unsynced = False
+        # updates are made from the caller's thread, fsync'd from the timer's
+        self._lock = threading.RLock()
+        self._timer = None
+
+    def _read_snapshot(self):
+        if not self.path.is_file():
+            return None, 0
+        raw = self.path.read_bytes()
+        if raw[:1] == b"\x80":
+            # legacy (pickled) state file, rewritten as json on the next compaction
+            return pickle.loads(raw), 0
+        data = json.loads(raw.decode("utf-8"))
+        try:
+            fmt, version = data["format"], data["version"]
+        except KeyError:
+            raise ValueError(f"{self.path} is not a {FORMAT} file")
+        if fmt != FORMAT or version > VERSION:
+            raise ValueError(
+                f"{self.path} is {fmt} version {version}, only {FORMAT} versions "
+                f"<= {VERSION} are supported"
+            )
+        return data["state"], data["seq"]
+
+    def load(self):
+        """read the snapshot and replay the journal, returns the state (or None)"""
+        state, seq = self._read_snapshot()
+        torn = False
+        if self.journal_path.is_file():
+            with open(self.journal_path, "r", encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # torn write, nothing valid can follow it
+                        torn = True
+                        break
+                    if entry["seq"] <= seq:
+                        continue
+                    if state is None:
+                        state = {}
+                    state.update(entry["set"])
+                    seq = entry["seq"]
+                    self.pending += 1
+        self.state = state
+        self.seq = seq
+        if torn:
+            # don't append after the torn line
+            self.compact()
+        return state
+
+    def _open_journal(self):
+        if self._journal is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+        return self._journal
+
+    def _sync(self, force=False):
+        if self._journal is None or not self._unsynced:
+            return
+        now = time.monotonic()
+        if force or now - self._last_sync >= self.sync_interval:
+            os.fsync(self._journal.fileno())
+            self._last_sync = now
+            self._unsynced = False
+
+    def _schedule_sync(self):
+        # fsync the pending update(s) once the interval is over
+        if not self._unsynced or self._timer is not None:
+            return
+        delay = max(self.sync_interval - (time.monotonic() - self._last_sync), 0)
+        self._timer = threading.Timer(delay, self._deferred_sync)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _deferred_sync(self):
+        with self._lock:
+            self._timer = None
+            self._sync(force=True)
+
+    def update(self, **fields):
+        """record changed fields (unchanged values are not journaled)"""
+        with self._lock:
+            self._update(fields)
+
+    def _update(self, fields):
+        if self.state is None:
+            self.state = {}
+        changed = {
+            k: v for k, v in fields.items() if k not in self.state or self.state[k] != v
+        }
+        if not changed:
+            return
+        self.state.update(changed)
+        self.seq += 1
+        journal = self._open_journal()
+        journal.write(json.dumps({"seq": self.seq, "set": changed}) + "\n")
+        journal.flush()
+        self._unsynced = True
+        self.pending += 1
+        if self.pending >= self.compact_every:
+            self.compact()
+        else:
+            self._sync()
+            self._schedule_sync()
+
+    def save(self, state):
+        """replace the full state (written as a new snapshot)"""
+        with self._lock:
+            self.state = dict(state)
+            self.seq += 1
+            self._compact()
+
+    def compact(self):
+        """atomically write the current state as the snapshot, clear the journal"""
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        if self.state is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "format": FORMAT,
+            "version": VERSION,
+            "seq": self.seq,
+            "state": self.state,
+        }
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(data, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self.path)
+        self._sync_dir()
+
+        # entries are <= the snapshot seq now, so a crash before the truncate
+        # is harmless (they are skipped on load)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        with open(self.journal_path, "w", encoding="utf-8") as fh:
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.pending = 0
+        self._unsynced = False
+
+    def _sync_dir(self):
+        try:
+            fd = os.open(self.path.parent, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def flush(self):
+        """fsync any journaled updates not yet on disk"""
+        with self._lock:
+            self._sync(force=True)
+
+    def close(self):
+        with self._lock:
+            timer, self._timer = self._timer, None
+            if timer is not None:
+                timer.cancel()
+            self._sync(force=True)
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def __repr__(self):
+        return str(self.__class__.__name__) + ": " + f"{self.__dict__}"
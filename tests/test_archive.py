@@ -0,0 +1,93 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from calcatrix.functions.archive import stream_archive
+from calcatrix.state.catalog import ImageCatalog
+
+
+def _images(path, sizes):
+    paths = []
+    for i, size in enumerate(sizes):
+        image = path.joinpath(f"{i}__0__{i}__0__01_01_2021__17_13_{i:02d}.jpg")
+        image.write_bytes(bytes(j % 251 for j in range(size)))
+        paths.append(str(image))
+    return paths
+
+
+# sizes around the tar block (512 bytes) and the read chunk
+_SIZES = [0, 1, 511, 512, 513, 5000]
+
+
+@pytest.mark.parametrize("chunk_size", [64, 1 << 16])
+def test_tar_round_trip(tmp_path, chunk_size):
+    paths = _images(tmp_path, _SIZES)
+    data = b"".join(stream_archive(paths, "tar", chunk_size=chunk_size))
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        members = tar.getmembers()
+        assert [m.name for m in members] == [p.rsplit("/", 1)[1] for p in paths]
+        for member, path in zip(members, paths):
+            with open(path, "rb") as fh:
+                assert tar.extractfile(member).read() == fh.read()
+
+
+@pytest.mark.parametrize("chunk_size", [64, 1 << 16])
+def test_zip_round_trip(tmp_path, chunk_size):
+    paths = _images(tmp_path, _SIZES)
+    data = b"".join(stream_archive(paths, "zip", chunk_size=chunk_size))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        infos = zf.infolist()
+        assert [i.filename for i in infos] == [p.rsplit("/", 1)[1] for p in paths]
+        for info, path in zip(infos, paths):
+            assert info.compress_type == zipfile.ZIP_STORED
+            with open(path, "rb") as fh:
+                assert zf.read(info) == fh.read()
+
+
+@pytest.mark.parametrize("fmt", ["tar", "zip"])
+def test_missing_files_are_skipped(tmp_path, fmt):
+    paths = _images(tmp_path, [10, 20])
+    paths.insert(1, str(tmp_path.joinpath("removed.jpg")))
+    data = b"".join(stream_archive(paths, fmt))
+    if fmt == "tar":
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            names = tar.getnames()
+    else:
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            names = zf.namelist()
+    assert "removed.jpg" not in names
+    assert len(names) == 2
+
+
+def test_chunks_stay_small(tmp_path):
+    paths = _images(tmp_path, [200_000, 200_000])
+    for fmt in ("tar", "zip"):
+        chunks = list(stream_archive(paths, fmt, chunk_size=4096))
+        assert all(chunks)
+        assert max(len(chunk) for chunk in chunks) <= 4096 + 1024
+
+
+def test_empty_archives(tmp_path):
+    data = b"".join(stream_archive([], "tar"))
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert tar.getnames() == []
+    data = b"".join(stream_archive([], "zip"))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.namelist() == []
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        stream_archive([], "rar")
+
+
+def test_catalog_paths_stream_in_pages(tmp_path):
+    paths = _images(tmp_path, [10] * 7)
+    catalog = ImageCatalog(tmp_path)
+    assert list(catalog.iter_paths(batch=3)) == paths
+    data = b"".join(stream_archive(catalog.iter_paths(batch=3, index=2), "tar"))
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert tar.getnames() == [paths[2].rsplit("/", 1)[1]]
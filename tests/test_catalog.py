@@ -0,0 +1,142 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from calcatrix.functions.camera import FakeCamera
+from calcatrix.functions.photo import Photo
+from calcatrix.state.catalog import (
+    TS_FORMAT,
+    ImageCatalog,
+    checksum,
+    parse_file_name,
+)
+
+_START = datetime(2021, 1, 1, 17, 13, 18).timestamp()
+
+
+def _name(index, name, location, rot_degree, captured_at):
+    ts = datetime.fromtimestamp(captured_at).strftime(TS_FORMAT)
+    return f"{index}__{name}__{location}__{rot_degree}__{ts}.jpg"
+
+
+def _write_images(path, num):
+    names = []
+    for i in range(num):
+        name = _name(i // 4, i % 4, 100 * (i // 4), 90 * (i % 4), _START + i)
+        path.joinpath(name).write_bytes(b"jpeg %d" % i)
+        names.append(name)
+    return names
+
+
+def test_parse_file_name():
+    fields = parse_file_name(_name(3, "a", 120, 45, _START))
+    assert fields["idx"] == 3
+    assert fields["name"] == "a"
+    assert fields["location"] == 120
+    assert fields["rot_degree"] == 45
+    assert fields["captured_at"] == _START
+    assert parse_file_name("catalog.sqlite3") is None
+    assert parse_file_name("a__b.jpg") is None
+    assert parse_file_name("1__a__2__3__13_45_2021__10_00_00.jpg") is None
+
+
+def test_add_get_remove(tmp_path):
+    catalog = ImageCatalog(tmp_path)
+    path = tmp_path.joinpath(_name(1, "a", 10, 90, _START))
+    row = catalog.add(path, size=4, digest=checksum(b"jpeg"))
+    assert row["idx"] == 1
+
+    image = catalog.get(path)
+    assert image["index"] == 1
+    assert image["rot_degree"] == 90
+    assert image["size"] == 4
+    assert image["checksum"] == checksum(b"jpeg")
+    assert image["path"] == str(path)
+    assert len(catalog) == 1
+
+    # replaced, not duplicated
+    catalog.add(path, size=5)
+    assert len(catalog) == 1
+    assert catalog.get(path)["size"] == 5
+
+    assert catalog.remove(path)
+    assert not catalog.remove(path)
+    assert catalog.get(path) is None
+
+
+def test_pages_cover_every_image_once(tmp_path):
+    names = _write_images(tmp_path, 23)
+    catalog = ImageCatalog(tmp_path)
+    seen = []
+    after = None
+    while True:
+        page = catalog.list(limit=5, after=after)
+        assert page["total"] == 23
+        assert len(page["images"]) <= 5
+        seen.extend(image["file_name"] for image in page["images"])
+        after = page["next"]
+        if after is None:
+            break
+    # oldest first
+    assert seen == names
+
+
+def test_filters(tmp_path):
+    _write_images(tmp_path, 12)
+    catalog = ImageCatalog(tmp_path)
+
+    page = catalog.list(index=1)
+    assert page["total"] == 4
+    assert {image["index"] for image in page["images"]} == {1}
+
+    page = catalog.list(name="2", rot_degree=180)
+    assert page["total"] == 3
+
+    page = catalog.list(since=_START + 3, until=_START + 6)
+    assert [image["captured_at"] for image in page["images"]] == [
+        _START + 3,
+        _START + 4,
+        _START + 5,
+    ]
+
+    with pytest.raises(ValueError):
+        catalog.list(limit=0)
+
+
+def test_missing_catalog_is_rebuilt(tmp_path):
+    names = _write_images(tmp_path, 6)
+    tmp_path.joinpath("notes.txt").write_text("not an image")
+    db_path = tmp_path.joinpath("db", "catalog.sqlite3")
+
+    catalog = ImageCatalog(tmp_path, db_path=db_path)
+    assert len(catalog) == 6
+    assert catalog.get(names[0])["checksum"] is None
+    catalog.close()
+
+    # present, so not rebuilt
+    os.remove(tmp_path.joinpath(names[0]))
+    catalog = ImageCatalog(tmp_path, db_path=db_path)
+    assert len(catalog) == 6
+    assert catalog.rebuild(checksums=True) == 5
+    image = catalog.get(names[1])
+    assert image["checksum"] == checksum(b"jpeg 1")
+    assert image["size"] == len(b"jpeg 1")
+
+
+def test_photo_catalogs_each_capture(tmp_path):
+    catalog = ImageCatalog(tmp_path)
+    photo = Photo(base_path=str(tmp_path), camera=FakeCamera(), catalog=catalog)
+    instructions = [
+        {"index": i, "name": "0", "location": 100 * i, "rot_degree": 30}
+        for i in range(3)
+    ]
+    with photo:
+        paths = [photo(instruction) for instruction in instructions]
+
+    page = catalog.list()
+    assert [image["path"] for image in page["images"]] == paths
+    for image in page["images"]:
+        assert image["size"] == len(FakeCamera.IMAGE)
+        assert image["checksum"] == checksum(FakeCamera.IMAGE)
+        assert image["rot_degree"] == 30
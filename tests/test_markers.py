@@ -0,0 +1,115 @@
+import pytest
+
+from calcatrix.benchmark.scenarios import sim_config
+from calcatrix.devices.edges import EdgeMixin
+from calcatrix.devices.markers import cluster_edges
+from calcatrix.devices.multiview import MultiView
+
+
+def test_clean_markers():
+    markers = cluster_edges([100, 300], [110, 310])
+    assert [m["center"] for m in markers] == [105, 305]
+    assert [m["width"] for m in markers] == [10, 10]
+    assert [m["spans"] for m in markers] == [1, 1]
+    assert [m["confidence"] for m in markers] == [1.0, 1.0]
+
+
+def test_centers_keep_the_fraction():
+    (marker,) = cluster_edges([100.25], [110.5])
+    assert marker["center"] == pytest.approx(105.375)
+    assert marker["width"] == pytest.approx(10.25)
+
+
+def test_chatter_within_tolerance_is_merged():
+    markers = cluster_edges([100, 108, 300], [106, 112, 312], tolerance=5)
+    assert len(markers) == 2
+    first, second = markers
+    assert first["center"] == 106
+    assert first["spans"] == 2
+    assert first["confidence"] == pytest.approx(0.5)
+    assert second["spans"] == 1
+
+
+def test_gaps_past_tolerance_are_separate_markers():
+    markers = cluster_edges([100, 120], [110, 130], tolerance=5)
+    assert [m["center"] for m in markers] == [105, 125]
+
+
+def test_markers_active_at_the_start_or_the_end():
+    markers = cluster_edges([200], [10], end_step=220)
+    assert [(m["center"], m["width"]) for m in markers] == [(5, 10), (210, 20)]
+    # the open span is dropped without an end step
+    assert len(cluster_edges([200], [10])) == 1
+
+
+def test_width_confidence_is_relative_to_the_median():
+    markers = cluster_edges([0, 100, 200], [10, 110, 205])
+    assert [m["confidence"] for m in markers] == [1.0, 1.0, 0.5]
+
+
+def test_no_edges():
+    assert cluster_edges([], []) == []
+
+
+def test_clustering_is_linear_on_long_tracks():
+    rises = [i * 100 for i in range(5000)]
+    falls = [r + 10 for r in rises]
+    markers = cluster_edges(rises, falls)
+    assert len(markers) == 5000
+    assert markers[-1]["center"] == 499905
+
+
+class _PigpioFactory:
+    # pigpio ticks: microseconds, wrapping at 2**32
+    def __init__(self, tick):
+        self.tick = tick
+
+    def ticks(self):
+        return self.tick
+
+    @staticmethod
+    def ticks_diff(later, earlier):
+        return ((later - earlier) % 0x100000000) / 1e6
+
+
+class _Sensor(EdgeMixin):
+    def __init__(self, factory):
+        self.pin_factory = factory
+        self.edges = []
+        self._init_edges()
+
+    def _state_to_value(self, state):
+        return state
+
+    def _on_activated(self, step, ticks):
+        self.edges.append((step, ticks))
+
+
+def test_edge_ticks_are_converted_through_the_pin_factory():
+    sensor = _Sensor(_PigpioFactory(0xFFFFFF00))
+    sensor.arm(counter=lambda ticks: ticks)
+    # 0x200 us later, after the counter wrapped
+    sensor._pin_edge(0x100, 1)
+    ((step, ticks),) = sensor.edges
+    assert ticks - sensor._ref_ns == 0x200 * 1000
+    assert step == ticks
+
+
+def test_edges_while_disarmed_have_no_step():
+    sensor = _Sensor(_PigpioFactory(0))
+    sensor._pin_edge(100, 1)
+    assert sensor.edges == [(None, sensor.edges[0][1])]
+
+
+@pytest.mark.parametrize("mode", ["single", "fast"])
+def test_homing_finds_every_magnet(mode):
+    config = sim_config(8000, 4)
+    config["linear"]["homing"] = {"mode": mode}
+    cart = MultiView(init_config=config)
+    cart.initialize(force_init=True)
+    linear = cart.linear
+    assert len(linear.positions) == len(config["backend"]["magnets"])
+    assert all(m["spans"] == 1 for m in linear.markers)
+    for position in linear.positions.values():
+        linear.move_to_location(round(position))
+        assert linear.marker.value
@@ -0,0 +1,124 @@
+import random
+
+import pytest
+
+from calcatrix.benchmark.scenarios import sim_config
+from calcatrix.devices.multiview import MultiView
+from calcatrix.motion.planner import CostModel, plan_route
+from calcatrix.motion.profile import MotionProfile
+
+
+def _model(coordinated=False):
+    return CostModel(MotionProfile(max_velocity=100), 90, coordinated=coordinated)
+
+
+def _instruction(location, rot_degree):
+    return {"location": location, "rot_degree": rot_degree}
+
+
+def test_rotation_takes_the_shortest_way():
+    assert CostModel.rotation(0, 90) == 90
+    assert CostModel.rotation(10, 350) == 20
+    assert CostModel.rotation(350, 10) == 20
+    assert CostModel.rotation(0, 180) == 180
+
+
+def test_move_time_adds_or_overlaps_the_axes():
+    model = _model()
+    assert model.linear_time(0, 100) == pytest.approx(1.0)
+    assert model.linear_time(100, 0) == pytest.approx(1.0)
+    assert model.linear_time(5, 5) == 0.0
+    assert model.rotate_time(0, 45) == pytest.approx(0.5)
+    assert model.move_time(0, 0, 100, 45) == pytest.approx(1.5)
+    assert _model(coordinated=True).move_time(0, 0, 100, 45) == pytest.approx(1.0)
+
+
+def test_route_time_returns_to_zero():
+    model = _model()
+    route = [_instruction(100, 90), _instruction(200, 90)]
+    # 1 s + 1 s (90 deg), 1 s, 1 s back to 0 at the end
+    assert model.route_time(route, 0) == pytest.approx(4.0)
+    # 2 s, 1 s back to 0, 1 s + 1 s (90 deg), 1 s back to 0
+    assert model.route_time(route, 0, return_to_zero=True) == pytest.approx(6.0)
+
+
+def test_calibrate_fits_scale_and_overhead():
+    model = _model()
+    model.calibrate(
+        linear_moves=[(100, 2.5), (200, 4.5), (400, 8.5)],
+        rotate_moves=[(90, 1.0), (180, 2.0)],
+    )
+    assert model.linear_scale == pytest.approx(2.0)
+    assert model.linear_overhead == pytest.approx(0.5)
+    assert model.rotate_scale == pytest.approx(1.0)
+    assert model.rotate_overhead == pytest.approx(0.0)
+
+
+def test_plan_route_is_a_faster_permutation():
+    rng = random.Random(7)
+    instructions = [
+        _instruction(loc, deg)
+        for loc in range(0, 2000, 200)
+        for deg in rng.sample([0, 45, 90, 135, 225, 270, 315], 3)
+    ]
+    model = _model()
+    route, summary = plan_route(instructions, model, start_loc=1000)
+
+    key = lambda ins: (ins["location"], ins["rot_degree"])
+    assert sorted(route, key=key) == sorted(instructions, key=key)
+    assert summary["planned_s"] == pytest.approx(model.route_time(route, 1000))
+    sweep = sorted(instructions, key=key)
+    best_sweep = min(model.route_time(r, 1000) for r in (sweep, sweep[::-1]))
+    assert summary["planned_s"] <= best_sweep + 1e-9
+    assert summary["planned_s"] < summary["baseline_s"]
+    assert summary["saving_s"] == pytest.approx(
+        summary["baseline_s"] - summary["planned_s"]
+    )
+
+
+def test_plan_route_of_nothing():
+    route, summary = plan_route([], _model(), start_loc=0)
+    assert route == []
+    assert summary["planned_s"] == 0.0
+
+
+def test_planned_scan_matches_its_estimate():
+    config = sim_config(8000, 3, angle=30)
+    config["multiview"]["route"] = "planned"
+    cart = MultiView(init_config=config)
+    cart.initialize(force_init=True)
+    start = cart.clock.now_ns()
+    cart.follow_all_instructions(func=None)
+    elapsed = (cart.clock.now_ns() - start) / 1e9
+
+    summary = cart.route_summary
+    assert summary["planned_s"] < summary["baseline_s"]
+    assert elapsed == pytest.approx(summary["planned_s"], rel=0.05)
+
+
+def test_approach_moves_include_the_overshoot():
+    model = CostModel(MotionProfile(max_velocity=100), 90, overshoot_steps=50)
+    assert model.segments(300, 100, approach=True) == [250, 50]
+    assert model.segments(100, 300, approach=True) == [200]
+    assert model.segments(300, 20, approach=True) == [300, 20]
+    assert model.linear_time(300, 100, approach=True) == pytest.approx(3.0)
+    assert model.linear_time(300, 100) == pytest.approx(2.0)
+
+
+def test_serpentine_estimate_matches_the_run():
+    cart = MultiView(init_config=sim_config(8000, 3))
+    cart.initialize(force_init=True)
+    estimate = cart.estimate(passes=2, approach=True)
+    start = cart.clock.now_ns()
+    cart.follow_passes(2, func=None, approach=True)
+    elapsed = (cart.clock.now_ns() - start) / 1e9
+    assert elapsed == pytest.approx(estimate["total_s"], rel=0.02)
+
+    # the steps pulsed (overshoot and back), not the net displacement
+    overshot = [t for t in cart.timings if len(t["linear_segments"]) == 2]
+    assert overshot
+    for timing in overshot:
+        assert timing["linear_steps"] == sum(timing["linear_segments"])
+    cart.timing_history.extend(cart.timings)
+    model = cart.calibrate()
+    assert model.linear_scale == pytest.approx(1.0, rel=0.02)
@@ -0,0 +1,164 @@
+import json
+import pickle
+import time
+
+import pytest
+
+from calcatrix.state import store as store_module
+from calcatrix.state.store import FORMAT, StateStore
+
+
+def test_updates_replay_from_the_journal(tmp_path):
+    path = tmp_path.joinpath("state.json")
+    store = StateStore(path)
+    store.save({"cur_location": 0, "max_steps": 1000})
+    store.update(cur_location=10)
+    store.update(cur_location=20, max_steps=900)
+    store.close()
+
+    loaded = StateStore(path)
+    assert loaded.load() == {"cur_location": 20, "max_steps": 900}
+    assert loaded.seq == store.seq
+    # the snapshot is untouched until a compaction
+    assert json.loads(path.read_text())["state"]["cur_location"] == 0
+
+
+def test_unchanged_values_are_not_journaled(tmp_path):
+    store = StateStore(tmp_path.joinpath("state.json"))
+    store.save({"cur_location": 5})
+    store.update(cur_location=5)
+    store.close()
+    assert store.journal_path.read_text() == ""
+
+
+def test_compaction_writes_a_snapshot_and_clears_the_journal(tmp_path):
+    path = tmp_path.joinpath("state.json")
+    store = StateStore(path, compact_every=3)
+    for loc in range(1, 4):
+        store.update(cur_location=loc)
+    store.close()
+
+    data = json.loads(path.read_text())
+    assert data["format"] == FORMAT
+    assert data["seq"] == 3
+    assert data["state"] == {"cur_location": 3}
+    assert store.journal_path.read_text() == ""
+    assert not path.with_name(path.name + ".tmp").exists()
+    assert StateStore(path).load() == {"cur_location": 3}
+
+
+def test_journal_entries_older_than_the_snapshot_are_skipped(tmp_path):
+    path = tmp_path.joinpath("state.json")
+    snapshot = {"format": FORMAT, "version": 1, "seq": 2, "state": {"a": 2, "b": 0}}
+    path.write_text(json.dumps(snapshot))
+    # e.g. a crash between the snapshot rename and the journal truncate
+    entries = [
+        {"seq": 1, "set": {"a": 1}},
+        {"seq": 2, "set": {"a": 2}},
+        {"seq": 3, "set": {"b": 3}},
+    ]
+    journal = path.with_name(path.name + ".journal")
+    journal.write_text("".join(json.dumps(e) + "\n" for e in entries))
+
+    store = StateStore(path)
+    assert store.load() == {"a": 2, "b": 3}
+    assert store.seq == 3
+
+
+def test_a_torn_last_line_is_ignored(tmp_path):
+    path = tmp_path.joinpath("state.json")
+    store = StateStore(path)
+    store.update(cur_location=1)
+    store.update(cur_location=2)
+    store.close()
+    with open(store.journal_path, "a", encoding="utf-8") as fh:
+        fh.write('{"seq": 3, "set": {"cur_loc')
+
+    loaded = StateStore(path)
+    assert loaded.load() == {"cur_location": 2}
+    # compacted, so later updates are not appended after the torn line
+    assert loaded.journal_path.read_text() == ""
+    loaded.update(cur_location=4)
+    loaded.close()
+    assert StateStore(path).load() == {"cur_location": 4}
+
+
+def test_legacy_pickle_is_migrated(tmp_path):
+    path = tmp_path.joinpath("trial_0.pickle")
+    legacy = {"positions": {0: 10.5}, "cur_location": 3, "max_steps": 100}
+    path.write_bytes(pickle.dumps(legacy))
+
+    store = StateStore(path)
+    assert store.load() == legacy
+    store.update(cur_location=4)
+    store.compact()
+    store.close()
+
+    data = json.loads(path.read_text())
+    assert data["format"] == FORMAT
+    assert data["state"]["cur_location"] == 4
+    assert StateStore(path).load()["max_steps"] == 100
+
+
+def test_unsupported_files_are_refused(tmp_path):
+    path = tmp_path.joinpath("state.json")
+    path.write_text(json.dumps({"format": FORMAT, "version": 99, "seq": 0}))
+    with pytest.raises(ValueError):
+        StateStore(path).load()
+    path.write_text(json.dumps({"state": {}}))
+    with pytest.raises(ValueError):
+        StateStore(path).load()
+
+
+def test_missing_files_load_as_none(tmp_path):
+    assert StateStore(tmp_path.joinpath("state.json")).load() is None
+
+
+def test_updates_are_fsynced_within_the_interval(tmp_path, monkeypatch):
+    synced = []
+    fsync = store_module.os.fsync
+
+    def _fsync(fd):
+        synced.append(fd)
+        fsync(fd)
+
+    monkeypatch.setattr(store_module.os, "fsync", _fsync)
+    store = StateStore(tmp_path.joinpath("state.json"), sync_interval=0.05)
+    store.update(cur_location=1)
+    store.update(cur_location=2)
+    synced_now = len(synced)
+    deadline = time.monotonic() + 2
+    while len(synced) == synced_now and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # the second update is inside the interval, the timer fsyncs it
+    assert len(synced) > synced_now
+    store.close()
+
+
+def test_linear_state_survives_a_restart(tmp_path, capsys):
+    from calcatrix.benchmark.scenarios import sim_config
+    from calcatrix.devices.multiview import MultiView
+
+    config = sim_config(6000, 3)
+    config["linear"]["positions"] = {
+        "file_path": str(tmp_path.joinpath("state.json")),
+        "init_from_file": True,
+        "verify": True,
+    }
+    cart = MultiView(init_config=config)
+    cart.initialize(force_init=True)
+    cart.linear.move_to_location(2000)
+    cart.linear.store.close()
+
+    # same track position, the stored location is verified on a marker
+    config["backend"]["start"] = cart.backend.position
+    restarted = MultiView(init_config=config)
+    restarted.initialize()
+    linear = restarted.linear
+    assert "homing" not in capsys.readouterr().out
+    assert linear.positions == cart.linear.positions
+    assert linear.markers == cart.linear.markers
+    assert linear.max_steps == cart.linear.max_steps
+    # the restored location is right: the cart lands on a marker
+    linear.move_to_location(round(linear.positions[1]))
+    assert linear.marker.value